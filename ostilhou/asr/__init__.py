@@ -1,13 +1,22 @@
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import sys
 import os
 import platform
+from functools import lru_cache
+from itertools import product
 
 from .post_processing import verbal_fillers
 from ..dicts import acronyms, dicts
 
 from .dataset import *
 from .recognizer import *
+from .models import ModelRegistry, model_registry, use_model, set_model_memory_budget
+from .worker_pool import WorkerPool
+from .batch import transcribe_files, iter_transcribe_files
+from .job_queue import JobQueue
+from .transcription_cache import TranscriptionCache, enable_transcription_cache, disable_transcription_cache
+from .metrics import MemorySink, JsonLinesSink, add_metrics_sink, remove_metrics_sink
+from .lexicon_store import PronunciationStore, phonetize_words, build_lexicon
 
 
 # Graphemes to phonemes
@@ -231,37 +240,109 @@ lexicon_sub = load_lexicon_sub()
 
 
 
-def phonetize_word(word: str) -> tuple[List[str], int]:
+def _build_grapheme_trie(graphemes: Dict[str, str], max_len=4) -> dict:
     """
-    Simple phonetizer
-    Returns a string of phonemes representing the pronunciation
-    of a single given word.
-    All words must be given in lowercase, except acronyms
-    Numbers can't be phonetized, so they need to be normalized first.
+    Character trie of the graphemes to phonemes table.
+    Phonemes are stored under the `None` key of a node.
+    """
+    trie = dict()
+    for graph, phon in graphemes.items():
+        if len(graph) > max_len:
+            continue
+        node = trie
+        for c in graph:
+            node = node.setdefault(c, dict())
+        node[None] = phon
+    return trie
+
+_w2f_trie = _build_grapheme_trie(w2f)
+
+
+def _phonetize_graphemes(word: str) -> Tuple[str, List[str]]:
     """
+    Convert a word to phonemes with a single longest-match walk
+    on the graphemes trie.
+    Returns the pronunciation and the list of unparsed characters.
+    """
+    wordb = '.' + word + '.'
+    lowered = wordb.lower()
+    if len(lowered) != len(wordb):
+        # Some characters change length when lowercased
+        return _phonetize_graphemes_sliced(word)
     
+    head = 0
+    phon = []
+    errors = []
+    wlen = len(wordb)
+    while head < wlen:
+        node = _w2f_trie
+        match = None
+        i = head
+        while i < wlen and i - head < 4:
+            node = node.get(lowered[i])
+            if node is None:
+                break
+            i += 1
+            if None in node:
+                match, match_end = node[None], i
+        if match is not None:
+            phon.append(match)
+            head = match_end
+        else:
+            token = lowered[head]
+            if token not in ('.', "'"):
+                errors.append(token)
+            head += 1
+    
+    return ' '.join(phon), errors
+
+
+def _phonetize_graphemes_sliced(word: str) -> Tuple[str, List[str]]:
+    head = 0
+    phon = []
+    wordb = '.' + word + '.'
+    errors = []
+    while head < len(wordb):
+        parsed = False
+        for i in (4, 3, 2, 1):
+            token = wordb[head:head+i].lower()
+            if token in w2f:
+                phon.append(w2f[token])
+                head += i-1
+                parsed = True
+                break
+        head += 1
+        if not parsed and token not in ('.', "'"):
+            errors.append(token)
+    
+    return ' '.join(phon), errors
+
+
+
+_PHONETIZE_CACHE_SIZE = 500_000
+
+
+@lru_cache(maxsize=_PHONETIZE_CACHE_SIZE)
+def _phonetize_word_cached(word: str) -> Tuple[Tuple[str, ...], int]:
     word = word.strip()
     lowered = word.lower()
 
     if '-' in word:
         # Composed word with hyphen, treat every subword individually
-        prop = [""]
+        # Candidates are the product of every subword's pronunciations
+        prop = ("",)
         errors = 0
         for sub in word.split('-'):
-            new_prop = []
-            rep, err = phonetize_word(sub)
+            rep, err = _phonetize_word_cached(sub)
             errors += err
-            for r in rep:
-                for pre in prop:
-                    new_prop.append(str.strip(pre + ' ' + r))
-            prop = new_prop
+            prop = tuple( str.strip(pre + ' ' + r) for r, pre in product(rep, prop) )
         return prop, errors
 
     if word in acronyms:
-        return acronyms[word], 0
+        return tuple(acronyms[word]), 0
     
     if word in acr2f:
-        return acr2f[word], 0
+        return tuple(acr2f[word]), 0
     
     for d in [
         "first_names",
@@ -271,37 +352,42 @@ def phonetize_word(word: str) -> tuple[List[str], int]:
     ]:
         if word in dicts[d]:
             if dicts[d][word]:
-                return dicts[d][word], 0
+                return tuple(dicts[d][word]), 0
 
     if lowered in lexicon_sub:
         alter = lexicon_add.get(lowered, [])
-        return lexicon_sub[lowered] + alter, 0
+        return tuple(lexicon_sub[lowered] + alter), 0
     
     if lowered in verbal_fillers:
-        return [ verbal_fillers[lowered] ], 0
+        return (verbal_fillers[lowered],), 0
 
-    
-    head = 0
-    phon = []
-    wordb = '.' + word + '.'
-    errors = []
-    while head < len(wordb):
-        parsed = False
-        for i in (4, 3, 2, 1):
-            token = wordb[head:head+i].lower()
-            if token in w2f:
-                phon.append(w2f[token])
-                head += i-1
-                parsed = True
-                break
-        head += 1
-        if not parsed and token not in ('.', "'"):
-            errors.append(token)
-    
-    pron = ' '.join(phon)
+    pron, errors = _phonetize_graphemes(word)
 
     if errors:
         print("ERROR [phonetizer]", word, pron, errors)
     
     variants = lexicon_add.get(word, [])
-    return [pron] + variants, len(errors)
+    return (pron, *variants), len(errors)
+
+
+def clear_phonetize_cache() -> None:
+    """ Must be called after modifying the lexicons or the graphemes table """
+    global _w2f_trie
+    _w2f_trie = _build_grapheme_trie(w2f)
+    _phonetize_word_cached.cache_clear()
+
+
+
+def phonetize_word(word: str) -> tuple[List[str], int]:
+    """
+    Simple phonetizer
+    Returns a string of phonemes representing the pronunciation
+    of a single given word.
+    All words must be given in lowercase, except acronyms
+    Numbers can't be phonetized, so they need to be normalized first.
+
+    Results are memoized, see `clear_phonetize_cache`.
+    """
+    
+    prons, errors = _phonetize_word_cached(word)
+    return list(prons), errors
@@ -1,20 +1,30 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from typing import List
+from typing import List, Union, Optional, Callable
 import sys
+import json
 
 import jiwer
 import re
 from math import inf
+from difflib import SequenceMatcher
+from itertools import accumulate
 
+import numpy as np
 from tqdm import tqdm
+from vosk import KaldiRecognizer
 
 from ..text import (
     pre_process, filter_out_chars,
     sentence_stats, normalize_sentence,
     PUNCTUATION,
 )
+from ..text.timecoded import TimecodedWords
+from ..audio.ffmpeg import stream_audio_file
+from .models import load_model
+from .recognizer import DEFAULT_CHUNK_SIZE, decode_buffer, result_words
+from .chunking import silence_cuts
 
 
 
@@ -25,6 +35,12 @@ def _count_words(s: str) -> int:
     return len(s.split())
 
 
+def _hyp_words(hyp: Union[List[dict], TimecodedWords]) -> List[str]:
+    if isinstance(hyp, TimecodedWords):
+        return hyp.words
+    return [ t["word"] for t in hyp ]
+
+
 def prepare_text_for_alignment(s: str) -> str:
     """ Process sentence for alignment matching """
     s = re.sub(r"{.+?}", '', s) # Ignore metadata
@@ -49,7 +65,7 @@ def prepare_text_for_alignment(s: str) -> str:
 
 def align(
         sentences:list,
-        hyp:List[dict],
+        hyp:Union[List[dict], TimecodedWords],
         left_boundary:int, right_boundary:int,
         positional_weight=0.5,
         progress_bar=True
@@ -60,8 +76,8 @@ def align(
         
         Args:
             sentences (list of str): List of reference sentences
-            hyp (list of vosk tokens (dicts)): List of timecoded words for
-                the whole text.
+            hyp (list of vosk tokens (dicts) or TimecodedWords): timecoded
+                words for the whole text.
             left_boudary (int): restrict search from this word index
             right_boundary (int): restrict search up to this word index
             positional_weight (float): weight (from 0.0 to 1.0) to apply to
@@ -74,7 +90,7 @@ def align(
                 {'sentence', 'hyp', 'span', 'score'}
                 Where:
                     sentence (str): original reference sentence
-                    hyp (list): list of timecoded inference tokens
+                    hyp (list or TimecodedWords): timecoded inference tokens
                     span (tuple): start and end token indexes in global hypothesis
                     score (float): CER score for this alignment
     """
@@ -87,6 +103,7 @@ def align(
     
     total_ref_words = sum(n_ref_words)
     total_hyp_words = len(hyp)
+    hyp_words = _hyp_words(hyp)
     matches = []
 
     if progress_bar:
@@ -106,15 +123,14 @@ def align(
             # dist *= dist
             best_score = inf
             for offset in range(1, right_boundary - i + 1):
-                hyp_windowed = hyp[i: i+offset]
-                hyp_sentence = ''.join( [t["word"] for t in hyp_windowed] )
+                hyp_sentence = ''.join(hyp_words[i: i+offset])
                 hyp_sentence = prepare_text_for_alignment(hyp_sentence)
                 score = (
                     jiwer.cer(norm_sentence, hyp_sentence) * (1.0 - positional_weight) +
                     dist * positional_weight
                 )
                 if score <= best_score:
-                    best_hyp = hyp_windowed
+                    best_hyp = hyp[i: i+offset]
                     best_span = (i, i+offset)
                     best_score = score
                 else:
@@ -140,6 +156,156 @@ def align(
 
 
 
+def sentence_words(s: str) -> List[str]:
+    """ Words of a sentence, as they would be output by the recognizer """
+    s = re.sub(r"{.+?}", '', s) # Ignore metadata
+    s = re.sub(r"<[A-Z\']+?>", '', s) # Ignore special tokens
+    s = pre_process(s)
+    if sentence_stats(s)["decimal"] > 0:
+        s = normalize_sentence(s, autocorrect=True)
+    s = filter_out_chars(s, PUNCTUATION)
+    return [ w.lower() for w in s.split() if any(c.isalpha() for c in w) ]
+
+
+
+def sentence_vocabulary(sentences: List[str]) -> List[str]:
+    """
+    Vocabulary of a list of sentences, to be used as a recognizer grammar
+    Capitalized and hyphenated variants are included, as words missing from
+    the model's vocabulary are ignored by the recognizer.
+    """
+    vocabulary = set()
+    for sentence in sentences:
+        s = filter_out_chars(pre_process(re.sub(r"{.+?}", '', sentence)), PUNCTUATION)
+        for word in s.split():
+            if any(c.isalpha() for c in word):
+                vocabulary.add(word)
+        for word in sentence_words(sentence):
+            vocabulary.add(word)
+            vocabulary.update( part for part in word.split('-') if part )
+    return sorted(vocabulary)
+
+
+
+def decode_constrained(
+        samples: np.ndarray,
+        sentences: List[str],
+        sample_rate: int = 16000,
+        window: int = 2,
+        max_length: float = 30,
+        model=None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        recognizer_factory: Callable = KaldiRecognizer,
+        progress_bar=True
+    ) -> List[dict]:
+    """
+    Decode audio with recognizers constrained to the vocabulary of the
+    sentences expected at each point of the audio.
+
+    The audio is cut at silences, in regions up to `max_length` seconds.
+    Each region is decoded with a grammar made of the words of the sentences
+    following the last recognized words, as many as the region's duration
+    should hold at the average speech rate, plus `window` sentences on each side.
+    The search space of the recognizer is much smaller than with its full
+    vocabulary, so decoding is faster and recognized words are closer to
+    the reference text.
+
+    Parameters
+    ----------
+        samples: numpy array
+            Mono 16 bits audio samples
+        sentences: list of str
+            Reference sentences, in order
+        window: int
+            Number of sentences added on each side of the expected ones
+        max_length: float
+            Maximum duration of a decoded region (in seconds)
+        model: vosk.Model
+            Model to use, the currently loaded model if None
+        recognizer_factory:
+            Builds a recognizer from a model, a sample rate and a grammar
+    
+    Returns a list of Vosk tokens (`{'word', 'start', 'end', 'conf'}` dicts)
+    for the whole audio, unknown words (`[unk]`) excluded
+    """
+    model = model or load_model()
+    words = [ sentence_words(s) for s in sentences ]
+    # Index of the sentence of every reference word
+    word_sentence = [ i for i, sw in enumerate(words) for _ in sw ]
+    flat_words = [ w for sw in words for w in sw ]
+    if not flat_words or len(samples) == 0:
+        return []
+    # Index in `flat_words` of the first word of every sentence
+    sentence_offsets = [0] + list(accumulate( len(sw) for sw in words ))
+    words_per_sample = len(flat_words) / len(samples)
+
+    ranges = silence_cuts(samples, sample_rate, max_length)
+    if progress_bar:
+        ranges = tqdm(ranges)
+    
+    tokens = []
+    cursor = 0  # Index of the next expected reference word
+    for start, end in ranges:
+        expected = (end - start) * words_per_sample
+        first = word_sentence[min(cursor, len(flat_words) - 1)]
+        last = word_sentence[min(int(cursor + expected), len(flat_words) - 1)]
+        first, last = max(first - window, 0), min(last + window + 1, len(sentences))
+        grammar = sentence_vocabulary(sentences[first:last]) + ["[unk]"]
+
+        recognizer = recognizer_factory(model, sample_rate, json.dumps(grammar, ensure_ascii=False))
+        recognizer.SetWords(True)
+        offset = start / sample_rate
+        region_tokens = []
+        for result in decode_buffer(recognizer, samples[start:end].tobytes(), chunk_size):
+            for tok in result_words(result):
+                if tok["word"] == "[unk]":
+                    continue
+                tok["start"] += offset
+                tok["end"] += offset
+                region_tokens.append(tok)
+        tokens.extend(region_tokens)
+
+        # Move the cursor after the last recognized words of the reference window
+        window_start = sentence_offsets[first]
+        window_words = flat_words[window_start:sentence_offsets[last]]
+        matcher = SequenceMatcher(
+            None, [ t["word"].lower() for t in region_tokens ], window_words, autojunk=False
+        )
+        blocks = [ b for b in matcher.get_matching_blocks() if b.size > 0 ]
+        if blocks:
+            cursor = max(cursor, window_start + blocks[-1].b + blocks[-1].size)
+        else:
+            cursor = int(cursor + expected)
+    
+    return tokens
+
+
+
+def transcribe_file_constrained(
+        filepath: str,
+        sentences: List[str],
+        window: int = 2,
+        max_length: float = 30,
+        model_name: Optional[str] = None,
+        progress_bar=True
+    ) -> List[dict]:
+    """
+    Transcribe an audio file with the vocabulary of its reference sentences,
+    see `decode_constrained`.
+    The result can be aligned with the sentences using `align`.
+
+    Returns a list of Vosk tokens
+    """
+    model = load_model(model_name)
+    buffers = []
+    stream_audio_file(filepath, 16000, buffers.append, 64000)
+    samples = np.frombuffer(b''.join(buffers), dtype=np.int16)
+    return decode_constrained(
+        samples, sentences, 16000, window, max_length, model, progress_bar=progress_bar
+    )
+
+
+
 def get_prev_word_idx(matches, idx):
     if idx <= 0:
         return 0
@@ -225,9 +391,10 @@ def find_best_cut(sentence_a, sentence_b, hyp) -> int:
     sentence_b = prepare_text_for_alignment(sentence_b)
     best_score = inf
     best_cut = -1
+    hyp_words = _hyp_words(hyp)
     for i in range(1, len(hyp)):
-        hyp_a = prepare_text_for_alignment(''.join([ t["word"] for t in hyp[:i] ]))
-        hyp_b = prepare_text_for_alignment(''.join([ t["word"] for t in hyp[i:] ]))
+        hyp_a = prepare_text_for_alignment(''.join(hyp_words[:i]))
+        hyp_b = prepare_text_for_alignment(''.join(hyp_words[i:]))
         score = jiwer.cer(sentence_a, hyp_a) + jiwer.cer(sentence_b, hyp_b)
         if score < best_score:
             best_score = score
@@ -0,0 +1,251 @@
+"""
+Batch transcription of short audio files
+
+Transcribing a short clip with `transcribe_file` starts an ffmpeg process
+and takes a recognizer for a single file: for clips of a few seconds, such as
+Common Voice's, starting processes costs more than decoding.
+
+Here clips are transcribed in batches by long-lived worker processes sharing
+a preloaded model (see `WorkerPool`). WAV files already in the recognizer's
+format (16kHz mono 16 bits) are read directly, the other clips of a batch are
+converted by a single ffmpeg process, with one output per clip.
+Recognizers are reused from one clip to the next.
+
+    for result in iter_transcribe_files(clips, workers=4):
+        print(result["path"], ' '.join(result["text"]))
+"""
+
+from typing import List, Iterable, Iterator, Optional, Tuple
+import os
+import sys
+import io
+import json
+import time
+import wave
+import subprocess
+from tempfile import TemporaryDirectory
+
+from tqdm import tqdm
+
+from .models import load_model, get_loaded_model_name
+from .worker_pool import WorkerPool
+from .metrics import measure, CallMetrics
+from .recognizer import DEFAULT_CHUNK_SIZE, recognizer_pool, decode_stream
+from .transcription_cache import get_transcription_cache, hash_file, model_identity, make_key
+
+
+
+_BYTES_PER_SECOND = 32000   # 16kHz 16 bits mono PCM
+
+
+
+def _read_wav(path: str) -> Optional[bytes]:
+    """ PCM data of a WAV file in the recognizer's format, None for other files """
+    if not path.lower().endswith(".wav"):
+        return None
+    try:
+        with wave.open(path, "rb") as f:
+            if f.getframerate() == 16000 and f.getnchannels() == 1 and f.getsampwidth() == 2:
+                return f.readframes(f.getnframes())
+    except (wave.Error, EOFError, OSError):
+        pass
+    return None
+
+
+
+def _ffmpeg_command(paths: List[str], outputs: List[str]) -> List[str]:
+    command = ["ffmpeg", "-loglevel", "error", "-hide_banner", "-nostdin", "-y"]
+    for path in paths:
+        command += ["-i", path]
+    for i, output in enumerate(outputs):
+        command += ["-map", f"{i}:a:0", "-ar", "16000", "-ac", "1", "-f", "s16le", output]
+    return command
+
+
+
+def _convert_files(paths: List[str]) -> List[Optional[bytes]]:
+    """
+    Convert audio files to PCM data with a single ffmpeg process.
+    When ffmpeg fails on the batch (a missing or corrupt file), files
+    are converted one by one. Files that can't be read give None.
+    """
+    if not paths:
+        return []
+    with TemporaryDirectory() as tmp_dir:
+        outputs = [ os.path.join(tmp_dir, f"{i}.raw") for i in range(len(paths)) ]
+        try:
+            process = subprocess.run(
+                _ffmpeg_command(paths, outputs), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        except FileNotFoundError:
+            print("ffmpeg not found", file=sys.stderr)
+            return [None] * len(paths)
+        if process.returncode != 0:
+            if len(paths) == 1:
+                return [None]
+            return [ data for path in paths for data in _convert_files([path]) ]
+        data = []
+        for output in outputs:
+            with open(output, "rb") as f:
+                data.append(f.read())
+        return data
+
+
+
+def _transcribe_batch(task: Tuple[List[str], int]) -> Tuple[List[dict], dict]:
+    """
+    Transcribe a batch of audio files, in a worker process
+    Returns the results and the counters of the metrics of the batch,
+    merged in the calling process (see `CallMetrics.merge`)
+    """
+    paths, chunk_size = task
+    model = load_model()
+    metrics = CallMetrics("transcribe_files")
+
+    # Convert the files that can't be read directly
+    t0 = time.perf_counter()
+    audio = [ _read_wav(path) for path in paths ]
+    to_convert = [ i for i, data in enumerate(audio) if data is None ]
+    for i, data in zip(to_convert, _convert_files([ paths[i] for i in to_convert ])):
+        audio[i] = data
+    load_time = time.perf_counter() - t0
+    total_bytes = sum( len(data) for data in audio if data ) or 1
+
+    results = []
+    for path, data in zip(paths, audio):
+        if data is None:
+            results.append({
+                "path": path, "text": [], "duration": None,
+                "load_time": 0.0, "decode_time": 0.0, "error": "Couldn't read audio file",
+            })
+            continue
+        t0 = time.perf_counter()
+        text = []
+        with recognizer_pool.recognizer(model) as recognizer:
+            for result in decode_stream(
+            metrics.wrap_recognizer(recognizer), metrics.wrap_stream(io.BytesIO(data)), chunk_size):
+                sentence = json.loads(result)["text"]
+                if sentence:
+                    text.append(sentence)
+        results.append({
+            "path": path,
+            "text": text,
+            "duration": len(data) / _BYTES_PER_SECOND,
+            # Conversion time of the batch, shared according to the audio length
+            "load_time": load_time * len(data) / total_bytes,
+            "decode_time": time.perf_counter() - t0,
+            "error": None,
+        })
+    return results, metrics.counters()
+
+
+
+def _cache_key(path: str, chunk_size: int) -> Optional[str]:
+    # Same keys as `transcribe_file`, so both functions share their results
+    if not os.path.exists(path):
+        return None
+    return make_key("file", hash_file(path), model_identity(get_loaded_model_name()), {"chunk_size": chunk_size})
+
+
+
+def iter_transcribe_files(
+        paths: Iterable[str],
+        workers: int = 1,
+        batch_size: int = 32,
+        model_name: Optional[str] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> Iterator[dict]:
+    """
+    Transcribe many short audio files, yield the results in the order of the files.
+
+    Parameters
+    ----------
+        workers: int
+            Number of decoding processes (decoding in the current process if 1)
+        batch_size: int
+            Number of files sent to a worker at a time
+        model_name: str
+            Name or path of the model (see `load_model`)
+
+    Yield a dictionary for every file:
+        {
+            'path': str,
+            'text': list of str,    same as `transcribe_file`
+            'duration': float,      audio duration, in seconds
+            'load_time': float,     time spent reading and converting the audio
+            'decode_time': float,   time spent in the recognizer
+            'error': str,           None if the file was transcribed
+            'cached': bool,         result from the transcription cache
+        }
+    """
+    paths = list(paths)
+    batches = [ paths[i:i+batch_size] for i in range(0, len(paths), batch_size) ]
+
+    cache = get_transcription_cache()
+    if cache is not None:
+        load_model(model_name)
+
+    def cached_results(batch: List[str]) -> List[Optional[dict]]:
+        results = []
+        for path in batch:
+            key = _cache_key(path, chunk_size) if cache is not None else None
+            text = cache.get(key) if key is not None else None
+            results.append(None if text is None else {
+                "path": path, "text": text, "duration": None,
+                "load_time": 0.0, "decode_time": 0.0, "error": None, "cached": True,
+            })
+        return results
+
+    def merge(batch: List[str], cached: List[Optional[dict]], decoded: List[dict]) -> Iterator[dict]:
+        decoded = iter(decoded)
+        for path, result in zip(batch, cached):
+            if result is None:
+                result = next(decoded)
+                result["cached"] = False
+                if cache is not None and result["error"] is None:
+                    key = _cache_key(path, chunk_size)
+                    if key is not None:
+                        cache.put(key, result["text"])
+            yield result
+
+    cached = [ cached_results(batch) for batch in batches ]
+    tasks = [
+        ([ path for path, result in zip(batch, batch_cached) if result is None ], chunk_size)
+        for batch, batch_cached in zip(batches, cached)
+    ]
+
+    with measure("transcribe_files") as metrics:
+        if workers > 1 and len(batches) > 1:
+            with WorkerPool(model_name, workers) as pool:
+                results = pool.imap(_transcribe_batch, tasks)
+                for batch, batch_cached, (decoded, counters) in zip(batches, cached, results):
+                    metrics.merge(counters)
+                    yield from merge(batch, batch_cached, decoded)
+        else:
+            load_model(model_name)
+            for batch, batch_cached, task in zip(batches, cached, tasks):
+                decoded, counters = _transcribe_batch(task) if task[0] else ([], None)
+                if counters:
+                    metrics.merge(counters)
+                yield from merge(batch, batch_cached, decoded)
+
+
+
+def transcribe_files(
+        paths: Iterable[str],
+        workers: int = 1,
+        batch_size: int = 32,
+        model_name: Optional[str] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        show_progress_bar: bool = False
+    ) -> List[dict]:
+    """
+    Transcribe many short audio files, see `iter_transcribe_files`
+
+    Returns the list of results, in the order of the files
+    """
+    paths = list(paths)
+    results = iter_transcribe_files(paths, workers, batch_size, model_name, chunk_size)
+    if show_progress_bar:
+        results = tqdm(results, total=len(paths))
+    return list(results)
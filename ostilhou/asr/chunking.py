@@ -0,0 +1,76 @@
+"""
+Cutting of long audio buffers in chunks, decoded independently
+
+Chunks are cut at silences (`silence_cuts`) or as fixed-length overlapping
+windows (`window_cuts`). They are given as ranges of samples.
+The transcriptions of the chunks are joined with `stitch_chunks`.
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+
+from ..audio.audio_numpy import split_to_segments
+
+
+
+def silence_cuts(samples: np.ndarray, sample_rate: int, max_length: float) -> List[Tuple[int, int]]:
+    """
+    Cut an audio buffer in contiguous ranges of samples, at silences
+    found by `split_to_segments`
+
+    Parameters
+    ----------
+        max_length: float
+            Maximum length of a chunk, in seconds
+    """
+    segments = split_to_segments(samples, sample_rate, max_length=max_length)
+    cuts = [0]
+    for (_, prev_end), (next_start, _) in zip(segments[:-1], segments[1:]):
+        # Cut in the middle of the silence between two segments
+        cuts.append(int((prev_end + next_start) / 2 * sample_rate))
+    cuts.append(len(samples))
+    return [ (a, b) for a, b in zip(cuts[:-1], cuts[1:]) if b > a ]
+
+
+
+def window_cuts(n_samples: int, sample_rate: int, length: float, overlap: float) -> List[Tuple[int, int]]:
+    """ Cut an audio buffer in fixed-length overlapping ranges of samples """
+    window = int(length * sample_rate)
+    step = window - int(overlap * sample_rate)
+    if step <= 0:
+        raise ValueError("Overlap must be shorter than the window length")
+    ranges = []
+    start = 0
+    while True:
+        ranges.append((start, min(start + window, n_samples)))
+        if start + window >= n_samples:
+            break
+        start += step
+    return ranges
+
+
+
+def stitch_chunks(chunks: List[List[dict]], bounds: List[Tuple[float, float]]) -> List[dict]:
+    """
+    Join the transcriptions of consecutive audio chunks.
+    Where two chunks overlap, words are taken from the first chunk before
+    the middle of the overlap zone, and from the second chunk after it,
+    so words in overlap zones are kept only once.
+
+    Parameters
+    ----------
+        chunks: list of lists of Vosk tokens
+            Timecodes are relative to the whole audio
+        bounds: list of (start, end) tuples
+            Boundaries of every chunk, in seconds
+    """
+    stitched = []
+    for i, tokens in enumerate(chunks):
+        low = (bounds[i-1][1] + bounds[i][0]) / 2 if i > 0 else float("-inf")
+        high = (bounds[i][1] + bounds[i+1][0]) / 2 if i + 1 < len(chunks) else float("inf")
+        for tok in tokens:
+            middle = (tok["start"] + tok["end"]) / 2
+            if low <= middle < high:
+                stitched.append(tok)
+    return stitched
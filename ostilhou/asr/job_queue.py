@@ -0,0 +1,420 @@
+"""
+Persistent queue of transcription jobs
+
+Audio files are added to a queue stored in a SQLite database, then
+transcribed by a runner using a pool of worker processes sharing a
+preloaded model (see `WorkerPool`):
+
+    queue = JobQueue("archives.sqlite")
+    queue.add(list_files_with_extension("mp3", "archives/"), output_dir="transcriptions/")
+    queue.run(workers=8)
+
+Every file is cut at silences in chunks, and the transcription of each chunk
+is stored as soon as it is decoded. When all the chunks of a file are decoded,
+the timecoded words are written to a JSON file (a list of Vosk tokens).
+After a crash or an interruption, running the queue again resumes the
+decoding from the first chunk that wasn't stored.
+
+Throughput and estimated remaining time are computed from the queue state
+(see `JobQueue.stats`), so they can be queried from another process while
+the queue is running.
+
+Only one runner should process a queue at a time.
+"""
+
+from typing import List, Iterable, Iterator, Tuple, Callable, Optional
+import os
+import sys
+import time
+import json
+import sqlite3
+from concurrent.futures import wait, FIRST_COMPLETED
+
+import numpy as np
+
+from .models import load_model
+from .worker_pool import WorkerPool
+from .recognizer import DEFAULT_CHUNK_SIZE, transcribe_chunk
+from .chunking import silence_cuts, stitch_chunks
+from ..audio.ffmpeg import stream_audio_file
+
+
+
+_SAMPLE_RATE = 16000
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+
+def _load_samples(path: str) -> np.ndarray:
+    buffers = []
+    stream_audio_file(path, _SAMPLE_RATE, buffers.append, 64000)
+    return np.frombuffer(b''.join(buffers), dtype=np.int16)
+
+
+
+def _write_json(tokens: List[dict], path: str) -> None:
+    # Write to a temporary file first, so an output file is always complete
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(tokens, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+
+class JobQueue:
+    """
+    SQLite-backed queue of transcription jobs
+
+    Parameters
+    ----------
+        path: str
+            Database file, created if it doesn't exist
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY, "
+                "path TEXT UNIQUE NOT NULL, "
+                "output TEXT NOT NULL, "
+                "status TEXT NOT NULL, "
+                "size INTEGER, "        # File size, to estimate the duration of unplanned jobs
+                "duration REAL, "       # Audio duration, once the job is planned
+                "error TEXT, "
+                "added REAL, started REAL, finished REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "job_id INTEGER NOT NULL, "
+                "idx INTEGER NOT NULL, "
+                "start_time REAL NOT NULL, "
+                "end_time REAL NOT NULL, "
+                "tokens TEXT, "         # JSON list of Vosk tokens, NULL until decoded
+                "decoded REAL, "
+                "PRIMARY KEY (job_id, idx))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+
+
+    def add(self, paths: Iterable[str], output_dir: Optional[str] = None) -> int:
+        """
+        Add audio files to the queue, files already in the queue are ignored.
+        The transcription of a file is written in `output_dir`
+        (next to the audio file if None), with a `.json` extension.
+
+        Returns the number of added jobs
+        """
+        rows = []
+        for path in paths:
+            path = os.path.abspath(path)
+            basename = os.path.splitext(os.path.basename(path))[0]
+            output = os.path.join(output_dir or os.path.dirname(path), basename + ".json")
+            size = os.path.getsize(path) if os.path.exists(path) else None
+            rows.append((path, os.path.abspath(output), PENDING, size, time.time()))
+        with self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO jobs (path, output, status, size, added) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            return self._conn.total_changes - before
+
+
+    def retry_failed(self) -> int:
+        """ Put failed jobs back in the queue, returns their number """
+        with self._conn:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, error = NULL WHERE status = ?", (PENDING, FAILED)
+            ).rowcount
+
+
+    def jobs(self, status: Optional[str] = None) -> List[dict]:
+        """ List the jobs, with the given status or all of them """
+        query = "SELECT id, path, output, status, duration, error FROM jobs"
+        params = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        return [
+            { "id": i, "path": p, "output": o, "status": s, "duration": d, "error": e }
+            for i, p, o, s, d, e in self._conn.execute(query + " ORDER BY id", params)
+        ]
+
+
+    def _set_status(self, job_id: int, status: str, error: Optional[str] = None) -> None:
+        column = { RUNNING: "started", DONE: "finished", FAILED: "finished" }.get(status)
+        with self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?" + (f", {column} = ?" if column else "") + " WHERE id = ?",
+                (status, error, time.time(), job_id) if column else (status, error, job_id)
+            )
+
+
+    def _plan(self, job_id: int, samples: np.ndarray, max_length: float) -> List[Tuple[int, float, float, bool]]:
+        """
+        Cut the audio of a job in chunks, unless it was done in a previous run.
+        Returns the (index, start, end, decoded) tuples of every chunk.
+        """
+        rows = self._conn.execute(
+            "SELECT idx, start_time, end_time, tokens IS NOT NULL FROM chunks WHERE job_id = ? ORDER BY idx",
+            (job_id,)
+        ).fetchall()
+        if rows:
+            return [ (idx, start, end, bool(decoded)) for idx, start, end, decoded in rows ]
+
+        ranges = silence_cuts(samples, _SAMPLE_RATE, max_length)
+        rows = [ (i, a / _SAMPLE_RATE, b / _SAMPLE_RATE, False) for i, (a, b) in enumerate(ranges) ]
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO chunks (job_id, idx, start_time, end_time) VALUES (?, ?, ?, ?)",
+                [ (job_id, i, start, end) for i, start, end, _ in rows ]
+            )
+            self._conn.execute(
+                "UPDATE jobs SET duration = ? WHERE id = ?", (len(samples) / _SAMPLE_RATE, job_id)
+            )
+        return rows
+
+
+    def _iter_tasks(self, max_length: float, chunk_size: int) -> Iterator[Tuple[int, int, tuple]]:
+        """
+        Yield (job id, chunk index, decoding task) for every chunk left to decode.
+        Audio files are loaded one at a time, when their chunks are needed.
+        """
+        last_id = 0
+        while True:
+            row = self._conn.execute(
+                "SELECT id, path FROM jobs WHERE status IN (?, ?) AND id > ? ORDER BY id LIMIT 1",
+                (PENDING, RUNNING, last_id)
+            ).fetchone()
+            if row is None:
+                return
+            job_id, path = row
+            last_id = job_id
+            try:
+                samples = _load_samples(path)
+                if len(samples) == 0:
+                    raise ValueError("No audio data")
+                chunks = self._plan(job_id, samples, max_length)
+            except Exception as e:
+                print(f"{path}: {e}", file=sys.stderr)
+                self._set_status(job_id, FAILED, str(e))
+                continue
+
+            self._set_status(job_id, RUNNING)
+            todo = [ (idx, start, end) for idx, start, end, decoded in chunks if not decoded ]
+            if not todo:
+                self._finish(job_id)
+                continue
+            for idx, start, end in todo:
+                if self._status(job_id) != RUNNING:
+                    break   # A chunk failed
+                a, b = round(start * _SAMPLE_RATE), round(end * _SAMPLE_RATE)
+                yield job_id, idx, (samples[a:b].tobytes(), start, chunk_size)
+
+
+    def _status(self, job_id: int) -> str:
+        return self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+
+    def _store_chunk(self, job_id: int, idx: int, tokens: List[dict]) -> None:
+        if self._status(job_id) != RUNNING:
+            return
+        with self._conn:
+            self._conn.execute(
+                "UPDATE chunks SET tokens = ?, decoded = ? WHERE job_id = ? AND idx = ?",
+                (json.dumps(tokens, ensure_ascii=False), time.time(), job_id, idx)
+            )
+        remaining = self._conn.execute(
+            "SELECT COUNT(*) FROM chunks WHERE job_id = ? AND tokens IS NULL", (job_id,)
+        ).fetchone()[0]
+        if remaining == 0:
+            self._finish(job_id)
+
+
+    def _finish(self, job_id: int) -> None:
+        """ Join the transcriptions of the chunks of a job and write them """
+        output = self._conn.execute("SELECT output FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+        rows = self._conn.execute(
+            "SELECT start_time, end_time, tokens FROM chunks WHERE job_id = ? ORDER BY idx", (job_id,)
+        ).fetchall()
+        chunks = [ json.loads(tokens) for _, _, tokens in rows ]
+        bounds = [ (start, end) for start, end, _ in rows ]
+        try:
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            _write_json(stitch_chunks(chunks, bounds), output)
+        except OSError as e:
+            self._set_status(job_id, FAILED, str(e))
+            return
+        self._set_status(job_id, DONE)
+
+
+    def run(
+            self,
+            workers: int = 1,
+            model_name: Optional[str] = None,
+            max_length: float = 30,
+            chunk_size: int = DEFAULT_CHUNK_SIZE,
+            watch: bool = False,
+            poll_interval: float = 10.0,
+            decode: Callable = transcribe_chunk
+        ) -> None:
+        """
+        Transcribe the files of the queue, resuming unfinished jobs
+
+        Parameters
+        ----------
+            workers: int
+                Number of decoding processes
+            model_name: str
+                Name or path of the model (see `load_model`)
+            max_length: float
+                Maximum duration of a chunk, in seconds
+            watch: bool
+                Keep running, waiting for new jobs, every `poll_interval` seconds
+            decode:
+                Function transcribing a (PCM data, offset, chunk size) task
+                to a list of Vosk tokens
+        """
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('run_started', ?)", (str(time.time()),)
+            )
+        pool = WorkerPool(model_name, workers) if workers > 1 else None
+        if pool is None:
+            load_model(model_name)
+        try:
+            while True:
+                tasks = self._iter_tasks(max_length, chunk_size)
+                if pool is None:
+                    for job_id, idx, task in tasks:
+                        self._decode_one(job_id, idx, decode, task)
+                else:
+                    self._decode_pool(pool, tasks, decode, max_pending=2 * workers)
+                if not watch:
+                    break
+                time.sleep(poll_interval)
+        finally:
+            if pool is not None:
+                pool.close()
+
+
+    def _decode_one(self, job_id: int, idx: int, decode: Callable, task: tuple) -> None:
+        try:
+            tokens = decode(task)
+        except Exception as e:
+            self._set_status(job_id, FAILED, f"chunk {idx}: {e}")
+            return
+        self._store_chunk(job_id, idx, tokens)
+
+
+    def _decode_pool(self, pool: WorkerPool, tasks: Iterator, decode: Callable, max_pending: int) -> None:
+        # Keep a bounded number of chunks in flight, so only a few
+        # audio files are held in memory at a time
+        in_flight = dict()
+        try:
+            while True:
+                for job_id, idx, task in tasks:
+                    in_flight[pool.submit(decode, task)] = (job_id, idx)
+                    if len(in_flight) >= max_pending:
+                        break
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id, idx = in_flight.pop(future)
+                    try:
+                        tokens = future.result()
+                    except Exception as e:
+                        self._set_status(job_id, FAILED, f"chunk {idx}: {e}")
+                        continue
+                    self._store_chunk(job_id, idx, tokens)
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+
+    def stats(self, window: float = 300.0) -> dict:
+        """
+        Progress of the queue
+
+        Throughput is the duration of audio decoded per second, over the last
+        `window` seconds of the current (or last) run.
+        Returns a dictionary with:
+            jobs: number of jobs for every status
+            audio_total, audio_done, audio_remaining: durations in seconds,
+                estimated from file sizes for files not planned yet
+            throughput: seconds of audio per second (None if unknown)
+            eta: estimated remaining time in seconds (None if unknown)
+        """
+        now = time.time()
+        jobs = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+        done, remaining = self._conn.execute(
+            "SELECT "
+            "COALESCE(SUM(CASE WHEN tokens IS NOT NULL THEN end_time - start_time END), 0), "
+            "COALESCE(SUM(CASE WHEN tokens IS NULL THEN end_time - start_time END), 0) "
+            "FROM chunks JOIN jobs ON jobs.id = chunks.job_id WHERE jobs.status != ?",
+            (FAILED,)
+        ).fetchone()
+
+        # Estimate the duration of unplanned jobs from their file size
+        planned_size, planned_duration = self._conn.execute(
+            "SELECT SUM(size), SUM(duration) FROM jobs WHERE duration IS NOT NULL AND size IS NOT NULL"
+        ).fetchone()
+        unplanned_size, n_unplanned = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM jobs WHERE duration IS NULL AND status != ?",
+            (FAILED,)
+        ).fetchone()
+        unplanned = None
+        if n_unplanned == 0:
+            unplanned = 0.0
+        elif planned_size:
+            unplanned = unplanned_size * planned_duration / planned_size
+
+        throughput = None
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'run_started'").fetchone()
+        if row is not None:
+            last_decoded = self._conn.execute("SELECT MAX(decoded) FROM chunks").fetchone()[0] or now
+            # Measure up to now when running, up to the last decoded chunk otherwise
+            end = now if jobs.get(RUNNING) else last_decoded
+            start = max(float(row[0]), end - window)
+            decoded = self._conn.execute(
+                "SELECT COALESCE(SUM(end_time - start_time), 0) FROM chunks WHERE decoded > ? AND decoded <= ?",
+                (start, end)
+            ).fetchone()[0]
+            if end > start and decoded > 0:
+                throughput = decoded / (end - start)
+
+        audio_remaining = remaining + unplanned if unplanned is not None else None
+        eta = None
+        if audio_remaining is not None and throughput:
+            eta = audio_remaining / throughput
+        return {
+            "jobs": { s: jobs.get(s, 0) for s in (PENDING, RUNNING, DONE, FAILED) },
+            "audio_total": done + audio_remaining if audio_remaining is not None else None,
+            "audio_done": done,
+            "audio_remaining": audio_remaining,
+            "throughput": throughput,
+            "eta": eta,
+        }
+
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,306 @@
+"""
+Persistent store of word pronunciations
+
+Phonetizing a whole corpus vocabulary is slow, and most words don't change
+from one run to the next. Pronunciations are stored in a SQLite database,
+in the user's cache directory, along with hashes of the tables used
+by `phonetize_word` (graphemes to phonemes, acronyms, lexicons...).
+Stored pronunciations are dropped when the tables they depend on change.
+"""
+
+from typing import List, Dict, Set, Tuple, Iterable, Iterator, Optional
+import os
+import sys
+import sqlite3
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from ..utils import get_cache_directory
+
+
+
+def g2p_rules_hash() -> str:
+    """
+    Hash of the tables used by `phonetize_word` which are not
+    specific to a single word (graphemes to phonemes, acronyms, proper nouns...)
+    """
+    from . import w2f, acr2f, acronyms, dicts, verbal_fillers
+
+    tables = [
+        w2f, acr2f, acronyms, verbal_fillers,
+        [ dicts[d] for d in ("first_names", "last_names", "places", "proper_nouns") ],
+    ]
+    data = json.dumps(tables, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+
+def lexicon_digests() -> Dict[str, str]:
+    """ Hash of the hardcoded pronunciations (`lexicon_add` and `lexicon_sub`) of every word """
+    from . import lexicon_add, lexicon_sub
+
+    digests = dict()
+    for key in set(lexicon_add).union(lexicon_sub):
+        data = json.dumps([lexicon_sub.get(key), lexicon_add.get(key)], ensure_ascii=False)
+        digests[key] = hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+    return digests
+
+
+
+def _lexicon_keys(word: str) -> Set[str]:
+    # Keys of `lexicon_add` and `lexicon_sub` that `phonetize_word` may look up for a word
+    word = word.strip()
+    keys = { word, word.lower() }
+    for sub in word.split('-'):
+        keys.add(sub)
+        keys.add(sub.lower())
+    return keys
+
+
+
+class PronunciationStore:
+    """
+    SQLite store of pronunciations, keyed by word
+
+    All entries are dropped when the hash of the phonetization rules
+    differs from the stored one (see `g2p_rules_hash`).
+    When only `lexicon_add` or `lexicon_sub` have changed, only the entries
+    of the modified words are dropped.
+
+    Can be used as a context manager.
+    """
+
+    _QUERY_SIZE = 500   # Max number of words per SQL query
+
+    def __init__(
+            self,
+            path: Optional[str] = None,
+            rules_hash: Optional[str] = None,
+            digests: Optional[Dict[str, str]] = None
+        ):
+        self.path = path or os.path.join(get_cache_directory(), "lexicon.sqlite")
+        self.rules_hash = rules_hash or g2p_rules_hash()
+        if digests is None:
+            digests = lexicon_digests()
+        self._conn = sqlite3.connect(self.path, timeout=30)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS lexicon "
+                "(word TEXT PRIMARY KEY, prons TEXT NOT NULL, errors INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS digests (key TEXT PRIMARY KEY, digest TEXT NOT NULL)"
+            )
+            self._invalidate(digests)
+
+
+    def _invalidate(self, digests: Dict[str, str]) -> None:
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'rules_hash'"
+        ).fetchone()
+        stored_digests = dict(self._conn.execute("SELECT key, digest FROM digests"))
+
+        if row is None or row[0] != self.rules_hash:
+            if row is not None:
+                print("Phonetization rules have changed, clearing stored lexicon", file=sys.stderr)
+            self._conn.execute("DELETE FROM lexicon")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('rules_hash', ?)",
+                (self.rules_hash,)
+            )
+        else:
+            changed = {
+                key for key in set(digests).union(stored_digests)
+                if digests.get(key) != stored_digests.get(key)
+            }
+            if changed:
+                stale = [
+                    (word,) for (word,) in self._conn.execute("SELECT word FROM lexicon")
+                    if not changed.isdisjoint(_lexicon_keys(word))
+                ]
+                self._conn.executemany("DELETE FROM lexicon WHERE word = ?", stale)
+
+        if digests != stored_digests:
+            self._conn.execute("DELETE FROM digests")
+            self._conn.executemany(
+                "INSERT INTO digests (key, digest) VALUES (?, ?)", digests.items()
+            )
+
+
+    def get_many(self, words: Iterable[str]) -> Dict[str, Tuple[List[str], int]]:
+        """ Return the stored pronunciations and error counts of the given words """
+        words = list(words)
+        found = dict()
+        for i in range(0, len(words), self._QUERY_SIZE):
+            chunk = words[i:i+self._QUERY_SIZE]
+            rows = self._conn.execute(
+                "SELECT word, prons, errors FROM lexicon WHERE word IN ({})".format(
+                    ','.join('?' * len(chunk))
+                ),
+                chunk
+            )
+            for word, prons, errors in rows:
+                found[word] = (json.loads(prons), errors)
+        return found
+
+
+    def put_many(self, pronunciations: Dict[str, Tuple[List[str], int]]) -> None:
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO lexicon (word, prons, errors) VALUES (?, ?, ?)",
+                [
+                    (word, json.dumps(prons, ensure_ascii=False), errors)
+                    for word, (prons, errors) in pronunciations.items()
+                ]
+            )
+
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM lexicon").fetchone()[0]
+
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+def _phonetize_chunk(words: List[str]) -> List[Tuple[List[str], int]]:
+    from . import phonetize_word
+    return [ phonetize_word(w) for w in words ]
+
+
+
+def _iter_pronunciations(
+        words: List[str],
+        store: Optional[PronunciationStore],
+        workers: int,
+        chunk_size: int
+    ) -> Iterator[Tuple[str, List[str], int]]:
+    """
+    Yield (word, pronunciations, number of errors) for every unique word,
+    in the order of the given words.
+    Words missing from the store are phonetized in chunks, across `workers` processes.
+    """
+    words = list(dict.fromkeys(words))
+    pronunciations = store.get_many(words) if store is not None else dict()
+    unknown = [ w for w in words if w not in pronunciations ]
+    chunks = [ unknown[i:i+chunk_size] for i in range(0, len(unknown), chunk_size) ]
+
+    def new_pronunciations() -> Iterator[Tuple[List[str], int]]:
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Results are returned in submission order
+                results = executor.map(_phonetize_chunk, chunks)
+                for chunk, chunk_prons in zip(chunks, results):
+                    if store is not None:
+                        store.put_many(dict(zip(chunk, chunk_prons)))
+                    yield from chunk_prons
+        else:
+            for chunk in chunks:
+                chunk_prons = _phonetize_chunk(chunk)
+                if store is not None:
+                    store.put_many(dict(zip(chunk, chunk_prons)))
+                yield from chunk_prons
+
+    new_prons = new_pronunciations()
+    for word in words:
+        if word in pronunciations:
+            prons, errors = pronunciations[word]
+        else:
+            prons, errors = next(new_prons)
+        yield word, prons, errors
+    # Exhaust the generator, so the last chunk is stored
+    for _ in new_prons:
+        pass
+
+
+
+def phonetize_words(
+        words: Iterable[str],
+        store: Optional[PronunciationStore] = None,
+        workers: int = 1,
+        chunk_size: int = 2000
+    ) -> Dict[str, Tuple[List[str], int]]:
+    """
+    Phonetize many words at once.
+    Only the words missing from the store are phonetized, and added to it.
+
+    Parameters
+    ----------
+        store: PronunciationStore
+            Optional store of previously phonetized words
+        workers: int
+            Number of processes to spread the words to phonetize over
+        chunk_size: int
+            Number of words sent to a worker at a time
+
+    Returns a dictionary of words to (pronunciations, number of errors),
+    as returned by `phonetize_word`
+    """
+
+    return {
+        word: (prons, errors)
+        for word, prons, errors
+        in _iter_pronunciations(list(words), store, workers, chunk_size)
+    }
+
+
+
+def build_lexicon(
+        words: Iterable[str],
+        path: str,
+        store: Optional[PronunciationStore] = None,
+        workers: int = 1,
+        chunk_size: int = 2000,
+        special_tokens: Optional[Dict[str, str]] = None
+    ) -> Set[str]:
+    """
+    Write a pronunciation lexicon file, in Kaldi's `lexicon.txt` format.
+
+    Words are written in sorted order, as soon as they are phonetized,
+    so the resulting file is the same whatever the number of workers.
+    Words with phonetization errors are left out.
+
+    Parameters
+    ----------
+        words: iterable of str
+            Vocabulary, duplicates are ignored
+        path: str
+            Output lexicon file
+        store: PronunciationStore
+            Optional store of previously phonetized words
+        workers: int
+            Number of processes to spread the words to phonetize over
+        chunk_size: int
+            Number of words sent to a worker at a time
+        special_tokens: dict
+            Tokens and their phones, written first in the lexicon
+    
+    Returns the set of phones used in the lexicon (special tokens excluded)
+    """
+
+    phones = set()
+    words = sorted(set(words))
+    with open(path, 'w', encoding='utf-8') as f_out:
+        for token, phone in (special_tokens or dict()).items():
+            f_out.write(f"{token} {phone}\n")
+        for word, prons, errors in _iter_pronunciations(words, store, workers, chunk_size):
+            for pron in prons:
+                if not pron:
+                    print("ERROR empty pronunciation", word, file=sys.stderr)
+                elif errors == 0:
+                    f_out.write(f"{word} {pron}\n")
+                    phones.update(pron.split())
+    return phones
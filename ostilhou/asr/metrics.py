@@ -0,0 +1,320 @@
+"""
+Performance metrics of transcription calls
+
+When at least one sink is registered (see `add_metrics_sink`), every call
+to a transcription function of `ostilhou.asr.recognizer` produces a record
+of the form:
+
+    {
+        'function': str,            name of the transcription function
+        'timestamp': float,         end of the call (seconds since epoch)
+        'audio_duration': float,    seconds of audio fed to the recognizer
+        'bytes': int,               bytes of audio fed to the recognizer
+        'chunks': int,              number of calls to `AcceptWaveform`
+        'wall_time': float,         duration of the call, in seconds
+        'cpu_time': float,          CPU time of the process during the call
+        'decode_time': float,       time spent in the recognizer (Kaldi)
+        'read_time': float,         time spent waiting for audio (ffmpeg)
+        'rtf': float,               real-time factor (wall time / audio duration)
+        'skipped_duration': float,  seconds of audio left out by voice activity detection
+    }
+
+Live transcription calls (with a `PartialPolicy`) add the mean and maximum
+latency of the emitted words, in seconds ('word_latency', 'word_latency_max').
+
+No metrics are collected when no sink is registered.
+"""
+
+from typing import List, Iterable, Iterator
+import time
+import json
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+
+
+class MetricsSink:
+    """ Base class of metrics sinks """
+
+    def record(self, metrics: dict) -> None:
+        raise NotImplementedError
+
+
+
+class MemorySink(MetricsSink):
+    """ Keep metrics records in memory """
+
+    def __init__(self):
+        self.records: List[dict] = []
+        self._lock = threading.Lock()
+
+    def record(self, metrics: dict) -> None:
+        with self._lock:
+            self.records.append(metrics)
+
+    def summary(self, percentiles=(50, 90, 99)) -> dict:
+        with self._lock:
+            return summarize(self.records, percentiles)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.records.clear()
+
+
+
+class JsonLinesSink(MetricsSink):
+    """
+    Append metrics records to a file, one JSON object per line.
+    Many processes can write to the same file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, metrics: dict) -> None:
+        line = json.dumps(metrics) + '\n'
+        with self._lock:
+            # A single write in append mode, so lines from concurrent
+            # processes are not interleaved
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+
+def read_metrics(path: str) -> Iterator[dict]:
+    """ Read the records written by a `JsonLinesSink` """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+
+_SUMMARY_FIELDS = (
+    "audio_duration", "wall_time", "cpu_time", "decode_time", "read_time", "rtf", "bytes",
+    "skipped_duration", "word_latency", "word_latency_max",
+)
+
+
+def summarize(records: Iterable[dict], percentiles=(50, 90, 99)) -> dict:
+    """
+    Aggregate metrics records
+
+    Returns a dictionary with the number of calls, total audio duration,
+    total wall time, overall real-time factor, and the mean, percentiles
+    and max of every metric.
+    """
+    records = list(records)
+    summary = {
+        "calls": len(records),
+        "audio_duration": sum( r["audio_duration"] for r in records ),
+        "wall_time": sum( r["wall_time"] for r in records ),
+        "skipped_duration": sum( r.get("skipped_duration", 0.0) for r in records ),
+    }
+    summary["rtf"] = summary["wall_time"] / summary["audio_duration"] if summary["audio_duration"] else None
+    if not records:
+        return summary
+
+    summary["fields"] = dict()
+    for field in _SUMMARY_FIELDS:
+        values = np.array([ r[field] for r in records if r.get(field) is not None ], dtype=np.float64)
+        if len(values) == 0:
+            continue
+        stats = { "mean": float(values.mean()) }
+        for p, v in zip(percentiles, np.percentile(values, percentiles)):
+            stats[f"p{p}"] = float(v)
+        stats["max"] = float(values.max())
+        summary["fields"][field] = stats
+    return summary
+
+
+
+_sinks: List[MetricsSink] = []
+
+
+def add_metrics_sink(sink: MetricsSink) -> MetricsSink:
+    """ Start sending metrics records to a sink """
+    if sink not in _sinks:
+        _sinks.append(sink)
+    return sink
+
+
+def remove_metrics_sink(sink: MetricsSink) -> None:
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+
+class _TimedRecognizer:
+    """ Recognizer proxy, measuring the time spent in the recognizer """
+
+    def __init__(self, recognizer, metrics: "CallMetrics"):
+        self._recognizer = recognizer
+        self._metrics = metrics
+
+    def AcceptWaveform(self, data):
+        t0 = time.perf_counter()
+        accepted = self._recognizer.AcceptWaveform(data)
+        self._metrics.decode_time += time.perf_counter() - t0
+        self._metrics.bytes += len(data)
+        self._metrics.chunks += 1
+        return accepted
+
+    def _timed(self, method):
+        t0 = time.perf_counter()
+        result = method()
+        self._metrics.decode_time += time.perf_counter() - t0
+        return result
+
+    def Result(self):
+        return self._timed(self._recognizer.Result)
+
+    def PartialResult(self):
+        return self._timed(self._recognizer.PartialResult)
+
+    def FinalResult(self):
+        return self._timed(self._recognizer.FinalResult)
+
+    def __getattr__(self, name):
+        return getattr(self._recognizer, name)
+
+
+
+class _TimedStream:
+    """ Binary stream proxy, measuring the time spent waiting for data """
+
+    def __init__(self, stream, metrics: "CallMetrics"):
+        self._stream = stream
+        self._metrics = metrics
+
+    def readinto(self, buffer) -> int:
+        t0 = time.perf_counter()
+        n = self._stream.readinto(buffer)
+        self._metrics.read_time += time.perf_counter() - t0
+        return n
+
+    def read(self, size=-1) -> bytes:
+        t0 = time.perf_counter()
+        data = self._stream.read(size)
+        self._metrics.read_time += time.perf_counter() - t0
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+
+class CallMetrics:
+    """ Metrics of a single transcription call """
+
+    def __init__(self, function: str, sample_rate=16000):
+        self.function = function
+        self.sample_rate = sample_rate
+        self.bytes = 0
+        self.chunks = 0
+        self.decode_time = 0.0
+        self.read_time = 0.0
+        self.skipped_bytes = 0
+        self.latencies: List[float] = []
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def wrap_recognizer(self, recognizer):
+        return _TimedRecognizer(recognizer, self)
+
+    def wrap_stream(self, stream):
+        return _TimedStream(stream, self)
+
+    def skip(self, n_bytes: int) -> None:
+        """ Count audio read but not fed to the recognizer """
+        self.skipped_bytes += n_bytes
+
+    def add_latencies(self, latencies: Iterable[float]) -> None:
+        """ Record the latency of emitted words """
+        self.latencies.extend(latencies)
+
+    def counters(self) -> dict:
+        """ Counters of a part of a call, done in a worker process (see `merge`) """
+        return {
+            "bytes": self.bytes,
+            "chunks": self.chunks,
+            "decode_time": self.decode_time,
+            "read_time": self.read_time,
+            "skipped_bytes": self.skipped_bytes,
+        }
+
+    def merge(self, counters: dict) -> None:
+        """ Add the counters of a part of the call, measured in a worker process """
+        self.bytes += counters["bytes"]
+        self.chunks += counters["chunks"]
+        self.decode_time += counters["decode_time"]
+        self.read_time += counters["read_time"]
+        self.skipped_bytes += counters["skipped_bytes"]
+
+    def to_dict(self) -> dict:
+        wall_time = time.perf_counter() - self._wall_start
+        audio_duration = self.bytes / 2 / self.sample_rate
+        record = {
+            "function": self.function,
+            "timestamp": time.time(),
+            "audio_duration": audio_duration,
+            "bytes": self.bytes,
+            "chunks": self.chunks,
+            "wall_time": wall_time,
+            "cpu_time": time.process_time() - self._cpu_start,
+            "decode_time": self.decode_time,
+            "read_time": self.read_time,
+            "rtf": wall_time / audio_duration if audio_duration else None,
+            "skipped_duration": self.skipped_bytes / 2 / self.sample_rate,
+        }
+        if self.latencies:
+            record["word_latency"] = float(np.mean(self.latencies))
+            record["word_latency_max"] = float(np.max(self.latencies))
+        return record
+
+
+
+class _NoMetrics:
+    """ Used when no sink is registered """
+
+    def wrap_recognizer(self, recognizer):
+        return recognizer
+
+    def wrap_stream(self, stream):
+        return stream
+
+    def skip(self, n_bytes: int) -> None:
+        pass
+
+    def add_latencies(self, latencies: Iterable[float]) -> None:
+        pass
+
+    def merge(self, counters: dict) -> None:
+        pass
+
+_no_metrics = _NoMetrics()
+
+
+
+@contextmanager
+def measure(function: str, sample_rate=16000) -> Iterator[CallMetrics]:
+    """
+    Measure a transcription call, the record is sent to every sink
+    when the call succeeds.
+    The recognizer and audio stream of the call must be wrapped
+    with the `wrap_recognizer` and `wrap_stream` methods.
+    Parts of the call done in worker processes are measured with
+    their own `CallMetrics`, whose counters are merged (see `merge`).
+    """
+    if not _sinks:
+        yield _no_metrics
+        return
+    metrics = CallMetrics(function, sample_rate)
+    yield metrics
+    record = metrics.to_dict()
+    for sink in list(_sinks):
+        sink.record(record)
@@ -1,18 +1,27 @@
-from typing import List
+from typing import List, Optional, Callable
 
 import os
 import sys
-import platform
 import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 
 import ssl
 import certifi
 import urllib
-import zipfile
+import urllib.request
+import http.client
+import hashlib
+import shutil
+import struct
+import zlib
 from tqdm import tqdm
 
 from vosk import Model, SetLogLevel
 
+from ..utils import get_cache_directory
+
 
 
 MODEL_LIST_URL = "https://raw.githubusercontent.com/gweltou/patromou/refs/heads/main/model_list.json"
@@ -21,22 +30,13 @@ _certifi_context = ssl.create_default_context(cafile=certifi.where())
 _model_list = None
 _loaded_model = None
 _loaded_model_name = ""
+_loaded_model_path = None
+_default_model_lock = threading.Lock()
 
 
 
 def _get_model_directory() -> str:
-    if platform.system() in ("Linux", "Darwin"):
-        default = os.path.join(os.path.expanduser("~"), ".cache")
-    elif platform.system() == "Windows":
-        default = os.getenv("LOCALAPPDATA")
-    else:
-        raise OSError("Unsupported operating system")
-    model_dir = os.path.join(os.getenv("XDG_CACHE_HOME", default), "anaouder", "models")
-    
-    if not os.path.exists(model_dir):
-        os.makedirs(model_dir, exist_ok=True)
-    
-    return model_dir
+    return get_cache_directory("models")
 
 _model_root = _get_model_directory()
 
@@ -84,6 +84,9 @@ def get_available_models() -> List[str]:
     """
     valid_models = []
     for f in os.listdir(_model_root):
+        if f.startswith('.'):
+            # Model being downloaded
+            continue
         path = os.path.join(_model_root, f)
         if _is_valid_vosk_model(path):
             valid_models.append(f)
@@ -121,9 +124,183 @@ def is_model_loaded(model_name=None) -> bool:
 
 
 
+def _load_vosk_model(model_path: str) -> Model:
+    print(f"Loading {os.path.basename(model_path.rstrip(os.path.sep))}", file=sys.stderr)
+    SetLogLevel(-1)
+    return Model(model_path)
+
+
+
+class ModelRegistry:
+    """
+    Models kept in memory, to switch between models without reloading them
+
+    Models are loaded once and kept as long as the total size of the
+    loaded models stays under a memory budget. Beyond it, the least recently
+    used models are unloaded, except the models in use (acquired and not
+    released yet), which are never unloaded: the budget can be exceeded when
+    every model is in use. The memory used by a model is estimated from the
+    size of its files.
+
+    Models are identified by their path. The registry is thread-safe,
+    a model requested by several threads at once is only loaded once.
+
+    Parameters
+    ----------
+        memory_budget: int
+            Maximum total size of the loaded models, in bytes
+            (None for no limit)
+        loader: callable
+            Function loading a model from its path
+    """
+
+    def __init__(
+            self,
+            memory_budget: Optional[int] = 2 * 1024**3,
+            loader: Callable[[str], Model] = _load_vosk_model
+        ):
+        self.memory_budget = memory_budget
+        self._loader = loader
+        self._models: OrderedDict = OrderedDict()   # Least recently used first
+        self._loading = set()
+        self._condition = threading.Condition()
+
+
+    def __contains__(self, model_path: str) -> bool:
+        return os.path.abspath(model_path) in self._models
+
+
+    @property
+    def memory_used(self) -> int:
+        """ Estimated memory used by the loaded models, in bytes """
+        with self._condition:
+            return sum( entry["size"] for entry in self._models.values() )
+
+
+    def loaded_models(self) -> List[str]:
+        """ Paths of the loaded models, least recently used first """
+        with self._condition:
+            return list(self._models)
+
+
+    def acquire(self, model_path: str) -> Model:
+        """ Load a model if needed and mark it as in use, until `release` is called """
+        model_path = os.path.abspath(model_path)
+        with self._condition:
+            while model_path in self._loading:
+                self._condition.wait()
+            entry = self._models.get(model_path)
+            if entry is not None:
+                self._models.move_to_end(model_path)
+                entry["refs"] += 1
+                return entry["model"]
+            self._loading.add(model_path)
+
+        try:
+            size = scan_model_dir(model_path)["size"]
+            with self._condition:
+                # Make room before loading
+                self._evict(size)
+            model = self._loader(model_path)
+        except BaseException:
+            with self._condition:
+                self._loading.discard(model_path)
+                self._condition.notify_all()
+            raise
+
+        with self._condition:
+            self._loading.discard(model_path)
+            self._models[model_path] = { "model": model, "size": size, "refs": 1 }
+            self._evict()
+            self._condition.notify_all()
+        return model
+
+
+    def release(self, model_path: str) -> None:
+        """ Mark a model acquired with `acquire` as no longer in use """
+        model_path = os.path.abspath(model_path)
+        with self._condition:
+            entry = self._models.get(model_path)
+            if entry is None or entry["refs"] == 0:
+                raise ValueError(f"Model {model_path} is not in use")
+            entry["refs"] -= 1
+            self._evict()
+
+
+    @contextmanager
+    def use(self, model_path: str):
+        """ Context manager acquiring a model and releasing it on exit """
+        model = self.acquire(model_path)
+        try:
+            yield model
+        finally:
+            self.release(model_path)
+
+
+    def set_memory_budget(self, memory_budget: Optional[int]) -> None:
+        with self._condition:
+            self.memory_budget = memory_budget
+            self._evict()
+
+
+    def clear(self) -> None:
+        """ Unload every model not in use """
+        with self._condition:
+            for model_path in [ p for p, entry in self._models.items() if entry["refs"] == 0 ]:
+                del self._models[model_path]
+
+
+    def _evict(self, extra=0) -> None:
+        # Called with the lock held
+        if self.memory_budget is None:
+            return
+        used = sum( entry["size"] for entry in self._models.values() )
+        for model_path, entry in list(self._models.items()):
+            if used + extra <= self.memory_budget:
+                break
+            if entry["refs"] == 0:
+                del self._models[model_path]
+                used -= entry["size"]
+
+
+model_registry = ModelRegistry()
+
+
+
+def set_model_memory_budget(memory_budget: Optional[int]) -> None:
+    """ Maximum total size of the models kept in memory, in bytes (None for no limit) """
+    model_registry.set_memory_budget(memory_budget)
+
+
+
+def _get_model_path(model_name: str) -> str:
+    """ Local path of a model, downloaded if necessary """
+    if _is_valid_vosk_model(model_name):
+        # Given path to a model on local storage
+        return model_name
+    elif model_name in get_available_models():
+        # Model is already cached
+        return os.path.join(_get_model_directory(), model_name)
+    elif model_name in get_all_models():
+        # Model needs to be downloaded
+        return _download(model_name, _get_model_directory())
+    raise RuntimeError(
+        f"Model {model_name} is not a valid model; available models = {get_all_models()}"
+    )
+
+
+
 def load_model(model_name: str = None) -> Model:
+    """
+    Load a model and make it the default model,
+    returned by every later call without argument.
+
+    The previous default model stays in memory (see `ModelRegistry`),
+    switching back to it doesn't reload it.
+    """
     global _loaded_model_name
     global _loaded_model
+    global _loaded_model_path
     
     if model_name == None:
         if _loaded_model:
@@ -135,93 +312,464 @@ def load_model(model_name: str = None) -> Model:
     if model_name == _loaded_model_name:
         return _loaded_model
 
-    if _is_valid_vosk_model(model_name):
-        # Given path to a model on local storage
-        model_path = model_name
-    elif model_name in get_available_models():
-        # Model is already cached
-        model_path = os.path.join(_get_model_directory(), model_name)
-    elif model_name in get_all_models():
-        # Model needs to be downloaded
-        model_path = _download(model_name, _get_model_directory())
-    else:
-        raise RuntimeError(
-            f"Model {model_name} is not a valid model; available models = {get_all_models()}"
-        )
+    model_path = _get_model_path(model_name)
 
-    print(f"Loading {os.path.basename(model_path.rstrip(os.path.sep))}", file=sys.stderr)
-    SetLogLevel(-1)
-    _loaded_model = Model(model_path)
-    _loaded_model_name = model_name
+    with _default_model_lock:
+        if model_name == _loaded_model_name:
+            # Loaded by another thread
+            return _loaded_model
+        model = model_registry.acquire(model_path)
+        if _loaded_model_path is not None:
+            model_registry.release(_loaded_model_path)
+        _loaded_model = model
+        _loaded_model_name = model_name
+        _loaded_model_path = model_path
 
     return _loaded_model
 
 
+
+@contextmanager
+def use_model(model_name: str = None):
+    """
+    Context manager giving a model, which is kept in memory until exit,
+    without changing the default model (see `load_model`).
+
+        with use_model("vosk-model-br-0.8") as model:
+            transcribe_segments_ffmpeg(path, segments, model=model)
+    """
+    if model_name == None:
+        model_name = _loaded_model_name or get_latest_model()
+    elif model_name in _MODEL_ALIASES:
+        model_name = _MODEL_ALIASES[model_name]
+    model_path = _get_model_path(model_name)
+    with model_registry.use(model_path) as model:
+        yield model
+
+
 def get_loaded_model_name() -> str:
     return _loaded_model_name
 
 
-def _download(model_name: str, root: str) -> str:
+
+_ZIP_LOCAL_HEADER = 0x04034b50
+_ZIP_CENTRAL_HEADER = 0x02014b50
+_ZIP_END_RECORD = 0x06054b50
+_ZIP_DATA_DESCRIPTOR = 0x08074b50
+
+
+class _ZipStreamExtractor:
+    """
+    Extract a zip archive from a stream of data, while it is downloaded.
+
+    Entries are read from their local headers, so the archive is never
+    stored on disk. The CRC32 of every entry is checked.
+    `offset` is the position in the archive of the first entry not yet
+    completely extracted, where extraction can be resumed.
+    """
+
+    def __init__(self, dest: str, offset=0):
+        self.dest = os.path.abspath(dest)
+        self.offset = offset
+        self.done = False
+        self._position = offset     # Position of the start of the buffer in the archive
+        self._buffer = bytearray()
+        self._entry = None
+
+
+    def _consume(self, n: int) -> bytes:
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        self._position += n
+        return data
+
+
+    def _read_header(self) -> bool:
+        if len(self._buffer) < 4:
+            return False
+        signature = struct.unpack("<I", self._buffer[:4])[0]
+        if signature in (_ZIP_CENTRAL_HEADER, _ZIP_END_RECORD):
+            self.done = True
+            return False
+        if signature != _ZIP_LOCAL_HEADER:
+            raise RuntimeError("Invalid zip archive")
+        if len(self._buffer) < 30:
+            return False
+        (_, _, flags, method, _, _, crc, csize, usize, name_len, extra_len) = struct.unpack(
+            "<IHHHHHIIIHH", self._buffer[:30]
+        )
+        if len(self._buffer) < 30 + name_len + extra_len:
+            return False
+        header = self._consume(30 + name_len + extra_len)
+        name = header[30:30+name_len].decode("utf-8" if flags & 0x800 else "cp437")
+        extra = header[30+name_len:]
+
+        # Zip64 sizes
+        zip64 = False
+        i = 0
+        while i + 4 <= len(extra):
+            tag, size = struct.unpack("<HH", extra[i:i+4])
+            if tag == 0x0001:
+                zip64 = True
+                if usize == 0xFFFFFFFF and size >= 8:
+                    usize = struct.unpack("<Q", extra[i+4:i+12])[0]
+                if csize == 0xFFFFFFFF and size >= 16:
+                    csize = struct.unpack("<Q", extra[i+12:i+20])[0]
+            i += 4 + size
+
+        if method not in (0, 8):
+            raise RuntimeError(f"Unsupported compression method in zip archive ({method})")
+        descriptor = bool(flags & 0x08)
+        if descriptor and method != 8:
+            raise RuntimeError("Can't stream a stored zip entry of unknown size")
+
+        path = os.path.normpath(os.path.join(self.dest, name))
+        if not path.startswith(self.dest + os.sep):
+            raise RuntimeError(f"Invalid path in zip archive: {name}")
+        if name.endswith('/'):
+            os.makedirs(path, exist_ok=True)
+            output = None
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            output = open(path, "wb")
+
+        self._entry = {
+            "name": name,
+            "output": output,
+            "crc": crc,
+            "actual_crc": 0,
+            "remaining": None if descriptor else csize,
+            "zip64": zip64,
+            "decompressor": zlib.decompressobj(-15) if method == 8 else None,
+            "data_done": False,
+        }
+        return True
+
+
+    def _write(self, data: bytes) -> None:
+        entry = self._entry
+        if entry["decompressor"] is not None:
+            data = entry["decompressor"].decompress(data)
+        if data:
+            entry["actual_crc"] = zlib.crc32(data, entry["actual_crc"])
+            if entry["output"]:
+                entry["output"].write(data)
+
+
+    def _read_data(self) -> bool:
+        entry = self._entry
+        if entry["remaining"] is not None:
+            # Size known from the local header
+            n = min(entry["remaining"], len(self._buffer))
+            self._write(self._consume(n))
+            entry["remaining"] -= n
+            if entry["remaining"] > 0:
+                return False
+            entry["data_done"] = True
+            return True
+
+        # Deflate stream followed by a data descriptor
+        decompressor = entry["decompressor"]
+        data = self._consume(len(self._buffer))
+        self._write(data)
+        if not decompressor.eof:
+            return False
+        unused = decompressor.unused_data
+        self._buffer[:0] = unused
+        self._position -= len(unused)
+        entry["data_done"] = True
+        return True
+
+
+    def _read_descriptor(self) -> bool:
+        entry = self._entry
+        size_len = 8 if entry["zip64"] else 4
+        if len(self._buffer) < 4:
+            return False
+        has_signature = struct.unpack("<I", self._buffer[:4])[0] == _ZIP_DATA_DESCRIPTOR
+        length = (4 if has_signature else 0) + 4 + 2 * size_len
+        if len(self._buffer) < length:
+            return False
+        descriptor = self._consume(length)
+        entry["crc"] = struct.unpack("<I", descriptor[length-4-2*size_len:length-2*size_len])[0]
+        return True
+
+
+    def _finish_entry(self) -> None:
+        entry = self._entry
+        if entry["decompressor"] is not None:
+            self._write(b'')
+            tail = entry["decompressor"].flush()
+            if tail:
+                entry["actual_crc"] = zlib.crc32(tail, entry["actual_crc"])
+                if entry["output"]:
+                    entry["output"].write(tail)
+        if entry["output"]:
+            entry["output"].close()
+        if entry["actual_crc"] != entry["crc"]:
+            raise RuntimeError(f"Corrupted file in zip archive: {entry['name']}")
+        self._entry = None
+        self.offset = self._position
+
+
+    def feed(self, data: bytes) -> bool:
+        """ Extract the entries completed by `data`, returns True if any """
+        self._buffer += data
+        completed = False
+        while not self.done:
+            if self._entry is None:
+                if not self._read_header():
+                    break
+            elif not self._entry["data_done"]:
+                if not self._read_data():
+                    break
+            else:
+                if self._entry["remaining"] is None and not self._read_descriptor():
+                    break
+                self._finish_entry()
+                completed = True
+        return completed
+
+
+    def close(self) -> None:
+        if self._entry and self._entry["output"]:
+            self._entry["output"].close()
+        self._entry = None
+
+
+
+def _write_journal(path: str, journal: dict) -> None:
+    with open(path + ".tmp", 'w') as f:
+        json.dump(journal, f)
+    os.replace(path + ".tmp", path)
+
+
+def _read_journal(path: str) -> dict:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return dict()
+
+
+
+def _download_and_extract(url: str, tmp_dir: str, journal: dict, journal_path: str, sha256=None) -> None:
+    offset = journal.get("offset", 0)
+    request = urllib.request.Request(url)
+    if offset > 0:
+        request.add_header("Range", f"bytes={offset}-")
+        if journal.get("validator"):
+            # Get the whole archive if it changed since the interruption
+            request.add_header("If-Range", journal["validator"])
+
+    with urllib.request.urlopen(request, timeout=30, context=_certifi_context) as source:
+        if offset > 0 and source.status != 206:
+            print("Cannot resume download, starting over", file=sys.stderr)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            offset = 0
+        journal["offset"] = offset
+        journal["validator"] = source.headers.get("ETag") or source.headers.get("Last-Modified")
+        _write_journal(journal_path, journal)
+
+        # The checksum of the archive can only be computed on a complete download
+        hasher = hashlib.sha256() if offset == 0 else None
+        length = source.headers.get("Content-Length")
+        os.makedirs(tmp_dir, exist_ok=True)
+        extractor = _ZipStreamExtractor(tmp_dir, offset)
+        try:
+            with tqdm(
+                total=offset + int(length) if length else None,
+                initial=offset,
+                ncols=80,
+                unit="iB",
+                unit_scale=True,
+                unit_divisor=1024,
+            ) as loop:
+                while True:
+                    buffer = source.read(65536)
+                    if not buffer:
+                        break
+                    if hasher:
+                        hasher.update(buffer)
+                    if not extractor.done and extractor.feed(buffer):
+                        journal["offset"] = extractor.offset
+                        _write_journal(journal_path, journal)
+                    loop.update(len(buffer))
+                    if extractor.done and not hasher:
+                        break
+        finally:
+            extractor.close()
+
+    if not extractor.done:
+        raise ConnectionError("Incomplete download")
+    if sha256:
+        if hasher is None:
+            print("Archive checksum not verified (resumed download), files were verified with their CRC32",
+                  file=sys.stderr)
+        elif hasher.hexdigest() != sha256.lower():
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.remove(journal_path)
+            raise RuntimeError(f"Checksum mismatch for {url}")
+
+
+
+def _download(model_name: str, root: str, sha256: str = None, retries=3) -> str:
     """
-    Code modified from https://github.com/openai/whisper
-    Get the requested model path on disk or download it if not present
+    Download a model and extract it while downloading.
+
+    The model is extracted in a hidden temporary folder, moved to its final
+    location once complete. An interrupted download is resumed (with a HTTP
+    Range request) from the last completely extracted file, when the download
+    is started again, or automatically up to `retries` times.
+    The archive is checked against `sha256` (or the 'sha256' field of the
+    model list), and every file against its CRC32.
     """
     os.makedirs(root, exist_ok=True)
     
     model_path = os.path.join(root, model_name)
 
-    for model in _model_list:
+    for model in _get_model_list():
         if model["name"] == model_name:
             url = model["url"]
+            sha256 = sha256 or model.get("sha256")
             break
     else:
         raise RuntimeError("Couldn't find requested model url")
-    
-    download_target = os.path.join(root, os.path.basename(url))
+
+    tmp_dir = os.path.join(root, f".{model_name}.part")
+    journal_path = tmp_dir + ".json"
+    journal = _read_journal(journal_path)
+    if journal.get("url") != url:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        journal = { "url": url, "offset": 0 }
 
     print(f"Downloading model from {url}", file=sys.stderr)
-    with urllib.request.urlopen(url, context=_certifi_context) as source, open(download_target, "wb") as output:
-        with tqdm(
-            total=int(source.info().get("Content-Length")),
-            ncols=80,
-            unit="iB",
-            unit_scale=True,
-            unit_divisor=1024,
-        ) as loop:
-            while True:
-                buffer = source.read(8192)
-                if not buffer:
-                    break
+    for attempt in range(retries + 1):
+        try:
+            _download_and_extract(url, tmp_dir, journal, journal_path, sha256)
+            break
+        except (urllib.error.URLError, http.client.HTTPException, ConnectionError, TimeoutError) as error:
+            if isinstance(error, urllib.error.HTTPError) and error.code < 500:
+                raise
+            if attempt == retries:
+                raise
+            print(f"Download interrupted ({error}), resuming", file=sys.stderr)
+
+    # The archive usually contains a folder named after the model
+    extracted = os.path.join(tmp_dir, model_name)
+    if not os.path.isdir(extracted):
+        extracted = tmp_dir
+    if os.path.exists(model_path):
+        shutil.rmtree(model_path)
+    os.rename(extracted, model_path)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.remove(journal_path)
 
-                output.write(buffer)
-                loop.update(len(buffer))
-    
-    with zipfile.ZipFile(download_target, 'r') as zip_ref:
-        zip_ref.extractall(root)
+    return model_path
 
-    os.remove(download_target)
 
-    return model_path
+
+_VOSK_MODEL_FILES = {
+    "final.dubm",
+    "final.ie",
+    "final.mat",
+    "final.mdl",
+    "global_cmvn.stats",
+    "mfcc.conf",
+    "online_cmvn.conf",
+    "splice.conf",
+    "word_boundary.int"
+}
 
 
 
-def _is_valid_vosk_model(dir) -> bool:
+# Other files whose modification changes the model
+_MODEL_STATE_FILES = _VOSK_MODEL_FILES | {
+    "HCLG.fst",
+    "HCLr.fst",
+    "Gr.fst",
+    "G.fst",
+    "words.txt",
+    "phones.txt",
+}
+
+_MAX_MODEL_SCANS = 64
+_model_scans: OrderedDict = OrderedDict()    # Scans of valid models, by absolute path
+_model_scans_lock = threading.Lock()
+
+
+
+def _model_state(dir: str, files: List[str]) -> Optional[tuple]:
+    """ Modification time of a folder and stats of the model files in it """
+    try:
+        state = [ os.stat(dir).st_mtime_ns ]
+        for path in files:
+            stat = os.stat(os.path.join(dir, path))
+            state.append((path, stat.st_size, stat.st_mtime_ns))
+        return tuple(state)
+    except OSError:
+        return None
+
+
+
+def scan_model_dir(dir: str) -> dict:
+    """
+    Scan a model folder
+
+    Returns a dictionary:
+        {
+            'valid': bool,      the folder holds a Vosk model
+            'size': int,        total size of its files, in bytes
+            'files': list,      relative paths of the known model files
+            'state': tuple,     modification time of the folder and stats
+                                (size, modification time) of the model files
+        }
+
+    The scans of valid models are cached: the model tree is not walked again
+    as long as the folder and its model files are not modified (only the
+    folder and the model files are stat'ed).
+    """
     if not os.path.isdir(dir):
-        return False
-    
-    vosk_model_files = {
-        "final.dubm",
-        "final.ie",
-        "final.mat",
-        "final.mdl",
-        "global_cmvn.stats",
-        "mfcc.conf",
-        "online_cmvn.conf",
-        "splice.conf",
-        "word_boundary.int"
+        return { "valid": False, "size": 0, "files": [], "state": None }
+    dir = os.path.abspath(dir)
+
+    with _model_scans_lock:
+        scan = _model_scans.get(dir)
+    if scan is not None and _model_state(dir, scan["files"]) == scan["state"]:
+        with _model_scans_lock:
+            if dir in _model_scans:
+                _model_scans.move_to_end(dir)
+        return scan
+
+    files = dict()
+    size = 0
+    for root, _, filenames in os.walk(dir):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            if filename in _MODEL_STATE_FILES and filename not in files:
+                files[filename] = os.path.relpath(path, dir)
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+    files = sorted(files.values())
+    scan = {
+        "valid": _VOSK_MODEL_FILES.issubset(os.path.basename(f) for f in files),
+        "size": size,
+        "files": files,
+        "state": _model_state(dir, files),
     }
 
-    files = set()
-    for item in os.walk(dir):
-        files.update(item[2])
-    return vosk_model_files.issubset(files)
+    # Invalid folders are not cached, as they can be a model being copied
+    if scan["valid"] and scan["state"] is not None:
+        with _model_scans_lock:
+            _model_scans[dir] = scan
+            _model_scans.move_to_end(dir)
+            while len(_model_scans) > _MAX_MODEL_SCANS:
+                _model_scans.popitem(last=False)
+    return scan
+
+
+
+def _is_valid_vosk_model(dir) -> bool:
+    return scan_model_dir(dir)["valid"]
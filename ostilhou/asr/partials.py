@@ -0,0 +1,136 @@
+"""
+Emission policy of partial results, for live transcription
+
+The partial result of a Vosk recognizer changes with every chunk of audio,
+and its last words are often rewritten as more audio comes in. Sending every
+change to a captioning UI makes it flicker. A `PartialPolicy` limits the rate
+of partial results and splits them into a stable prefix (the words that have
+not changed in the last partial results, which are never taken back until
+the end of the utterance) and an unstable tail:
+
+    {'partial': True, 'text': str, 'stable': str, 'unstable': str}
+
+It also measures the latency of every word: the time between the arrival of
+the audio of the word's end and the first emission of the word, as a stable
+partial word or in a final result.
+"""
+
+from typing import List, Optional, Callable
+from bisect import bisect_left
+import time
+
+
+
+class PartialPolicy:
+    """
+    Emission policy of partial results, for a single audio stream
+
+    Parameters
+    ----------
+        interval: float
+            Minimum time between two partial results, in seconds
+            (0 to emit every change)
+        stability: int
+            Number of consecutive partial results a word must appear in,
+            at the same position, to be considered stable
+        stable_only: bool
+            Emit partial results only when the stable prefix grows
+        sample_rate: int
+            Sample rate of the audio stream
+        clock: callable
+            Current time, in seconds
+    """
+
+    def __init__(
+            self,
+            interval=0.2,
+            stability=2,
+            stable_only=False,
+            sample_rate=16000,
+            clock: Callable[[], float] = time.monotonic
+        ):
+        self.interval = interval
+        self.stability = max(1, stability)
+        self.stable_only = stable_only
+        self.sample_rate = sample_rate
+        self.clock = clock
+        self.latencies: List[float] = []    # Latency of every emitted word, in seconds
+        self._audio_end = 0.0
+        self._arrivals: List[float] = []    # Arrival time of each chunk
+        self._arrival_ends: List[float] = []    # Audio position at the end of each chunk
+        self._reset_utterance()
+
+
+    def _reset_utterance(self) -> None:
+        self._history: List[List[str]] = []
+        self._stable: List[str] = []
+        self._stable_times: List[float] = []    # First emission of every stable word
+        self._last_text = ""
+        self._last_emit: Optional[float] = None
+
+
+    def __repr__(self) -> str:
+        return f"PartialPolicy(interval={self.interval}, stability={self.stability}, stable_only={self.stable_only})"
+
+
+    def chunk(self, n_bytes: int) -> None:
+        """ Record the arrival of a chunk of audio (16 bits mono) """
+        self._audio_end += n_bytes / 2 / self.sample_rate
+        self._arrivals.append(self.clock())
+        self._arrival_ends.append(self._audio_end)
+
+
+    def _update_stable(self, words: List[str]) -> None:
+        self._history.append(words)
+        if len(self._history) > self.stability:
+            self._history.pop(0)
+        if len(self._history) < self.stability:
+            return
+        n = min( len(w) for w in self._history )
+        prefix = 0
+        while prefix < n and all( w[prefix] == words[prefix] for w in self._history ):
+            prefix += 1
+        if prefix > len(self._stable) and words[:len(self._stable)] == self._stable:
+            self._stable = words[:prefix]
+
+
+    def partial(self, text: str) -> Optional[dict]:
+        """ Returns the partial result to emit, or None """
+        words = text.split()
+        self._update_stable(words)
+        if text == self._last_text and len(self._stable) == len(self._stable_times):
+            return None
+        now = self.clock()
+        if self._last_emit is not None and now - self._last_emit < self.interval:
+            return None
+        if self.stable_only and len(self._stable) == len(self._stable_times):
+            return None
+
+        self._last_text = text
+        self._last_emit = now
+        self._stable_times.extend([now] * (len(self._stable) - len(self._stable_times)))
+        return {
+            "partial": True,
+            "text": text,
+            "stable": ' '.join(self._stable),
+            "unstable": ' '.join(words[len(self._stable):]),
+        }
+
+
+    def final(self, result: dict) -> None:
+        """ Record the latency of the words of a final result (a Vosk result) """
+        now = self.clock()
+        for i, tok in enumerate(result.get("result", [])):
+            if i < len(self._stable_times) and self._stable[i] == tok["word"]:
+                emitted = self._stable_times[i]
+            else:
+                emitted = now
+            j = min(bisect_left(self._arrival_ends, tok["end"] - 1e-6), len(self._arrivals) - 1)
+            if j >= 0:
+                self.latencies.append(max(0.0, emitted - self._arrivals[j]))
+        if result.get("result"):
+            # Forget the arrival of audio before the end of the utterance
+            j = bisect_left(self._arrival_ends, result["result"][-1]["end"] - 1e-6)
+            del self._arrivals[:j]
+            del self._arrival_ends[:j]
+        self._reset_utterance()
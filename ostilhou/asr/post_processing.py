@@ -1,34 +1,113 @@
 import os
-from typing import List, Optional
-from ..text.inverse_normalizer import inverse_normalize_sentence, inverse_normalize_timecoded
+from typing import List, Optional, Tuple, Union
+from ..text.inverse_normalizer import (
+    inverse_normalize_sentence, inverse_normalize_timecoded,
+    breaks_number_chain,
+)
+from ..text.timecoded import TimecodedWords
 from ..text.definitions import is_noun, verbal_fillers
 from ..utils import read_file_drop_comments
 
 
 
-def load_postproc_dict(filepath: str) -> List[dict]:
+class SubstitutionTrie:
+    """ Token trie for n-gram substitutions
+
+        Keys are sequences of tokens of any length, treated uncased.
+        Values are the sequences of tokens to substitute.
+        `longest_match` walks the trie from a given position and returns
+        the longest key found, so a whole token list can be translated
+        in one left-to-right pass.
+    """
+
+    _VALUE = None   # Key of the substitution in a trie node
+
+    def __init__(self):
+        self.root = dict()
+        self.max_len = 0
+        self._size = 0
+
+
+    def add(self, key: List[str], value: List[str]) -> None:
+        node = self.root
+        for tok in key:
+            node = node.setdefault(tok.lower(), dict())
+        if self._VALUE not in node:
+            self._size += 1
+        node[self._VALUE] = tuple(value)
+        self.max_len = max(self.max_len, len(key))
+
+
+    def get(self, key: List[str]) -> Optional[tuple]:
+        node = self.root
+        for tok in key:
+            node = node.get(tok.lower())
+            if node is None:
+                return None
+        return node.get(self._VALUE)
+
+
+    def __len__(self) -> int:
+        return self._size
+
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+
+    def longest_match(self, lowered: List[str], idx: int) -> Tuple[int, Optional[tuple]]:
+        """ Find the longest key starting at position `idx`
+
+            Parameters
+            ----------
+                lowered (list of str): lowercased tokens
+
+            Returns the length of the matched key and its substitution,
+            or (0, None) if no key was found
+        """
+        node = self.root
+        match_len, match = 0, None
+        j = idx
+        tlen = len(lowered)
+        while j < tlen:
+            node = node.get(lowered[j])
+            if node is None:
+                break
+            j += 1
+            sub = node.get(self._VALUE)
+            if sub:
+                match_len, match = j - idx, sub
+        return match_len, match
+
+
+    def substitute(self, tokens: List[str]) -> List[str]:
+        lowered = [ t.lower() for t in tokens ]
+        translated = []
+        tlen = len(tokens)
+        idx = 0
+        while idx < tlen:
+            n, sub = self.longest_match(lowered, idx)
+            if n:
+                translated.extend(sub)  #XXX the translation is always lowercase
+                idx += n
+            else:
+                translated.append(tokens[idx])
+                idx += 1
+        return translated
+
+
+
+def load_postproc_dict(filepath: str) -> SubstitutionTrie:
     """ Load the post processing dictionary from a tsv file
         Keys are treated uncased
     """
 
-    trigrams = dict()
-    bigrams = dict()
-    monograms = dict()
+    trie = SubstitutionTrie()
     for l in read_file_drop_comments(filepath):
         k, v = l.split('\t')
-        k = tuple([t.lower() for t in k.split()])
-        v = tuple(v.split())
-        if len(k) == 1:
-            monograms[k] = v
-        elif len(k) == 2:
-            bigrams[k] = v
-        elif len(k) == 3:
-            trigrams[k] = v
-        else:
-            print("ERROR (postproc_dict): number of tokens should be between 1 and 3")
-            print(k)
+        trie.add(k.split(), v.split())
     
-    return [monograms, bigrams, trigrams]
+    return trie
 
 
 _postproc_dict_path = os.path.join(os.path.split(__file__)[0], "postproc_sub.tsv")
@@ -37,6 +116,8 @@ _postproc_dict = load_postproc_dict(_postproc_dict_path)
 _inorm_units_dict_path = os.path.join(os.path.split(__file__)[0], "inorm_units.tsv")
 _inorm_units_dict = load_postproc_dict(_inorm_units_dict_path)
 
+_INORM_WINDOW = 32  # Maximum number of tokens held back for inverse-normalization
+
 
 
 def post_process_text(sentence: str, normalize=False, keep_fillers=True) -> str:
@@ -76,115 +157,273 @@ def post_process_text(sentence: str, normalize=False, keep_fillers=True) -> str:
 
 
 def post_process_timecoded(
-        tokens: List[dict],
+        tokens: Union[List[dict], TimecodedWords],
         normalize=False,
-        keep_fillers=True) -> List[dict]:
+        keep_fillers=True) -> Union[List[dict], TimecodedWords]:
     """ Apply post-processing on Vosk formatted result (keeping timecodes)
         
         Add hypens (-se, -mañ)
         Common words substitution  (optional)
         Inverse-normalization      (optional)
+
+        Accepts either a list of Vosk tokens or a `TimecodedWords` object,
+        and returns the same type.
     """
     
+    columnar = isinstance(tokens, TimecodedWords)
+    tokens = TimecodedWords.from_vosk(tokens)
+
     # Verbal fillers removal
     if not keep_fillers:
-        parsed = []
-        for _, tok in enumerate(tokens):
-            if not tok["word"].lower() in verbal_fillers:
-                parsed.append(tok)
-        tokens = parsed
+        kept = [ i for i, word in enumerate(tokens.words) if not word.lower() in verbal_fillers ]
+        if len(kept) < len(tokens):
+            tokens = tokens.take(kept)
 
     tokens = apply_post_process_dict_timecoded(tokens, _postproc_dict)
 
     # Add hyphens for "-se" and "-mañ"
-    parsed = []
-    for _, tok in enumerate(tokens):
-        # if not keep_fillers and tok["word"].lower() in verbal_fillers:
-        #     continue
-        if tok["word"] in ("se", "mañ") and len(parsed) > 0 and is_noun(parsed[-1]["word"]):
-            word = parsed[-1]["word"] + '-' + tok["word"]
-            new_token = {
-                        "word": word,
-                        "start": parsed[-1]["start"],  # Use start from last parsed token
-                        "end": tok["end"],
-                        "conf": tok["conf"]
-                        }
-            parsed.pop()  # Remove the last word since we're joining it
-            parsed.append(new_token)
+    words, start, end, conf = [], [], [], []
+    for word, t_start, t_end, t_conf in zip(
+            tokens.words,
+            tokens.start.tolist(),
+            tokens.end.tolist(),
+            tokens.conf.tolist()
+        ):
+        if word in ("se", "mañ") and len(words) > 0 and is_noun(words[-1]):
+            # Join with the last parsed token, keeping its start time
+            words[-1] = words[-1] + '-' + word
+            end[-1] = t_end
+            conf[-1] = t_conf
         else:
-            parsed.append(tok)
-    tokens = parsed
+            words.append(word)
+            start.append(t_start)
+            end.append(t_end)
+            conf.append(t_conf)
+    tokens = TimecodedWords(words, start, end, conf)
 
     if normalize:
         tokens = apply_post_process_dict_timecoded(tokens, _inorm_units_dict)
         tokens = inverse_normalize_timecoded(tokens)
-    return tokens
+    return tokens if columnar else tokens.to_vosk()
 
 
 
-def apply_post_process_dict_text(sentence: str, ngram_dicts: List[dict]=_postproc_dict) -> str:
+def apply_post_process_dict_text(
+        sentence: str,
+        substitutions: SubstitutionTrie=_postproc_dict
+    ) -> str:
+    return ' '.join(substitutions.substitute(sentence.split()))
 
-    def check_ngram(n: int):
-        ngram_lowered = tuple( [ t.lower() for t in tokens[idx:idx+n] ] )
-        sub = ngram_dicts[n-1].get(ngram_lowered, None)
-        if sub:
-            for t in sub:
-                translated.append(t)    #XXX the translation is always lowercase
-            return True
-        return False
-    
-    tokens = sentence.split()
-    translated = []
-    tlen = len(tokens)
+
+
+def apply_post_process_dict_timecoded(
+        tokens: Union[List[dict], TimecodedWords],
+        substitutions: SubstitutionTrie=_postproc_dict
+    ) -> Union[List[dict], TimecodedWords]:
+    """ Accepts either a list of Vosk tokens or a `TimecodedWords` object,
+        and returns the same type.
+    """
+
+    columnar = isinstance(tokens, TimecodedWords)
+    tokens = TimecodedWords.from_vosk(tokens)
+
+    words = tokens.words
+    lowered = [ w.lower() for w in words ]
+    start = tokens.start.tolist()
+    end = tokens.end.tolist()
+    conf = tokens.conf.tolist()
+    out_words, out_start, out_end, out_conf = [], [], [], []
+    tlen = len(words)
     idx = 0
     while idx < tlen:
-        if idx <= tlen-3 and check_ngram(3):
-            idx += 3
-            continue
-        if idx <= tlen-2 and check_ngram(2):
-            idx += 2
-            continue
-        if idx <= tlen-1 and check_ngram(1):
-            pass
+        n, sub = substitutions.longest_match(lowered, idx)
+        if n:
+            # Spread the duration of the matched tokens over the substitution
+            t_start = start[idx]
+            t_dur = end[idx+n-1] - t_start
+            t_dur = t_dur / len(sub)
+            t_conf = conf[idx]
+            for t in sub:
+                out_words.append(t)
+                out_start.append(t_start)
+                out_end.append(t_start + t_dur)
+                out_conf.append(t_conf)
+                t_start += t_dur
+            idx += n
         else:
-            translated.append(tokens[idx])
-        idx += 1
+            out_words.append(words[idx])
+            out_start.append(start[idx])
+            out_end.append(end[idx])
+            out_conf.append(conf[idx])
+            idx += 1
 
-    return ' '.join(translated)
+    translated = TimecodedWords(out_words, out_start, out_end, out_conf)
+    return translated if columnar else translated.to_vosk()
 
 
 
-def apply_post_process_dict_timecoded(tokens: List[dict], ngram_dicts: List[dict]=_postproc_dict) -> List[dict]:
 
-    def check_ngram(n: int):
-        ngram = tuple( [ t["word"].lower() for t in tokens[idx:idx+n] ] )
-        sub = ngram_dicts[n-1].get(ngram, None)
-        if sub:
-            t_start = tokens[idx]["start"]
-            t_dur = tokens[idx+n-1]["end"] - t_start
-            t_dur = t_dur / len(sub)
-            conf = tokens[idx]["conf"]
-            for t in sub:
-                token = {"word": t, "start": t_start, "end": t_start + t_dur, "conf": conf}
-                translated.append(token)
-                t_start += t_dur
-            return True
-        return False
-    
-    translated = []
-    tlen = len(tokens)
-    idx = 0
-    while idx < tlen:
-        if idx <= tlen-3 and check_ngram(3):
-            idx += 3
-            continue
-        if idx <= tlen-2 and check_ngram(2):
-            idx += 2
-            continue
-        if idx <= tlen-1 and check_ngram(1):
-            pass
+class _SubstitutionStage:
+    """ Streaming n-gram substitution
+        Holds back the tokens where a substitution key could still start
+    """
+
+    def __init__(self, substitutions: SubstitutionTrie):
+        self.substitutions = substitutions
+        self.buffer = TimecodedWords()
+
+    def feed(self, tokens: TimecodedWords, final=False) -> TimecodedWords:
+        buffer = self.buffer + tokens
+        tlen = len(buffer)
+        if final:
+            cut = tlen
+        else:
+            # Follow the left-to-right longest-match walk as long as
+            # its decisions can't be changed by upcoming tokens
+            lowered = [ w.lower() for w in buffer.words ]
+            max_len = self.substitutions.max_len
+            cut = 0
+            while cut + max_len <= tlen:
+                n, _ = self.substitutions.longest_match(lowered, cut)
+                cut += n or 1
+            cut = min(cut, tlen)
+        self.buffer = buffer[cut:]
+        return apply_post_process_dict_timecoded(buffer[:cut], self.substitutions)
+
+
+
+class _HyphenStage:
+    """ Streaming "-se" and "-mañ" joining
+        Holds back the last token, which could be joined with the next one
+    """
+
+    def __init__(self):
+        self.last = None
+
+    def feed(self, tokens: TimecodedWords, final=False) -> TimecodedWords:
+        words, start, end, conf = [], [], [], []
+        if self.last:
+            for column, value in zip((words, start, end, conf), self.last):
+                column.append(value)
+        for word, t_start, t_end, t_conf in zip(
+                tokens.words,
+                tokens.start.tolist(),
+                tokens.end.tolist(),
+                tokens.conf.tolist()
+            ):
+            if word in ("se", "mañ") and len(words) > 0 and is_noun(words[-1]):
+                words[-1] = words[-1] + '-' + word
+                end[-1] = t_end
+                conf[-1] = t_conf
+            else:
+                words.append(word)
+                start.append(t_start)
+                end.append(t_end)
+                conf.append(t_conf)
+        
+        if final or not words:
+            self.last = None
+        else:
+            self.last = (words.pop(), start.pop(), end.pop(), conf.pop())
+        return TimecodedWords(words, start, end, conf)
+
+
+
+class _InverseNormalizationStage:
+    """ Streaming inverse-normalization
+        Holds back the tokens following the last word that breaks
+        numerical chains, `_INORM_WINDOW` tokens at most
+    """
+
+    def __init__(self):
+        self.buffer = TimecodedWords()
+        self.scanned = 0
+        self.previous = None    # Last token before the buffer
+
+    def feed(self, tokens: TimecodedWords, final=False) -> TimecodedWords:
+        buffer = self.buffer + tokens
+        tlen = len(buffer)
+        if final:
+            cut = tlen
         else:
-            translated.append(tokens[idx])
-        idx += 1
+            cut = 0
+            for i in range(self.scanned, tlen):
+                previous = buffer.words[i-1] if i > 0 else self.previous
+                if breaks_number_chain(buffer.words[i], previous):
+                    cut = i + 1
+            # Numbers are never this long, don't hold back tokens forever
+            cut = max(cut, tlen - _INORM_WINDOW)
+        if cut > 0:
+            self.previous = None if final else buffer.words[cut-1]
+        self.buffer = buffer[cut:]
+        self.scanned = len(self.buffer)
+        return inverse_normalize_timecoded(buffer[:cut])
+
+
+
+class StreamingPostProcessor:
+    """ Incremental post-processing of Vosk results, for live transcription
+
+        Give the new decoded words to `push` as they arrive. It returns the
+        words that are finalized, post-processed in the same way as
+        `post_process_timecoded` would. Only a short window of words that
+        could still be modified by upcoming words (hyphen joining, n-gram
+        substitutions, numbers) is held back.
+        Call `flush` at the end of the stream to get the remaining words.
+
+        The concatenation of all the returned words is identical to
+        the result of `post_process_timecoded` on the whole transcription.
+
+        Example
+        -------
+            post_processor = StreamingPostProcessor(normalize=True)
+            transcribe_file_timecoded_callback_ffmpeg(
+                path,
+                lambda words: display(post_processor.push(words))
+            )
+            display(post_processor.flush())
+    """
+
+    def __init__(self, normalize=False, keep_fillers=True):
+        self.normalize = normalize
+        self.keep_fillers = keep_fillers
+        self._columnar = False
+        self._postproc_stage = _SubstitutionStage(_postproc_dict)
+        self._hyphen_stage = _HyphenStage()
+        self._units_stage = _SubstitutionStage(_inorm_units_dict)
+        self._inorm_stage = _InverseNormalizationStage()
+
+
+    def _feed(self, tokens: TimecodedWords, final: bool) -> TimecodedWords:
+        # Verbal fillers removal
+        if not self.keep_fillers:
+            kept = [ i for i, word in enumerate(tokens.words) if not word.lower() in verbal_fillers ]
+            if len(kept) < len(tokens):
+                tokens = tokens.take(kept)
+        
+        tokens = self._postproc_stage.feed(tokens, final)
+        tokens = self._hyphen_stage.feed(tokens, final)
+        if self.normalize:
+            tokens = self._units_stage.feed(tokens, final)
+            tokens = self._inorm_stage.feed(tokens, final)
+        return tokens
+
+
+    def push(
+            self,
+            tokens: Union[List[dict], TimecodedWords]
+        ) -> Union[List[dict], TimecodedWords]:
+        """ Add new words to the stream and return the finalized words
+
+            Accepts either a list of Vosk tokens or a `TimecodedWords` object,
+            and returns the same type.
+        """
+        self._columnar = isinstance(tokens, TimecodedWords)
+        tokens = self._feed(TimecodedWords.from_vosk(tokens), final=False)
+        return tokens if self._columnar else tokens.to_vosk()
+
 
-    return translated
+    def flush(self) -> Union[List[dict], TimecodedWords]:
+        """ Return all the remaining words and reset the stream """
+        tokens = self._feed(TimecodedWords(), final=True)
+        return tokens if self._columnar else tokens.to_vosk()
@@ -1,40 +1,314 @@
-from typing import List
+from typing import List, Dict, Tuple, Iterator, AsyncIterator, Optional, Union
 import os
 import sys
 import subprocess
 import json
+import asyncio
+import threading
+import weakref
+from contextlib import contextmanager
+
+import numpy as np
 
 from vosk import Model, KaldiRecognizer
+try:
+    from vosk import _ffi as _vosk_ffi
+except ImportError:
+    _vosk_ffi = None
 from pydub import AudioSegment
 from tqdm import tqdm
 
-from .models import load_model
+from .models import load_model, get_loaded_model_name
+from .worker_pool import WorkerPool
+from .metrics import measure, CallMetrics, _no_metrics
+from .chunking import silence_cuts, window_cuts, stitch_chunks
+from .partials import PartialPolicy
+from .transcription_cache import (
+    get_transcription_cache,
+    hash_bytes, hash_file, model_identity, make_key,
+)
 from ..audio import get_audiofile_length
+from ..audio.ffmpeg import stream_audio_file
+from ..audio.audio_numpy import EnergyVAD, SpeechGate
+from ..text.timecoded import TimecodedWords
+
+
+
+def result_words(result: str, columnar=False) -> Union[List[dict], TimecodedWords]:
+    """ Parse the timecoded words of a Vosk JSON result """
+    if columnar:
+        return TimecodedWords.from_result(result)
+    return json.loads(result).get("result", [])
+
+
+def _join_result_words(parts: list, columnar=False) -> Union[List[dict], TimecodedWords]:
+    if columnar:
+        return TimecodedWords.concat(parts)
+    return [ tok for part in parts for tok in part ]
+
+
+
+class RecognizerPool:
+    """
+    Pool of reusable Vosk recognizers
+
+    Building a `KaldiRecognizer` has a cost, which adds up when transcribing
+    thousands of short segments. Recognizers are reset and kept aside when
+    released, to be handed out again for the same configuration
+    (model, sample rate, word timecodes).
+
+    Usage:
+        with recognizer_pool.recognizer(model) as recognizer:
+            recognizer.AcceptWaveform(data)
+            ...
+    """
+
+    def __init__(self, max_idle=4, factory=KaldiRecognizer):
+        """
+        Parameters
+        ----------
+            max_idle: int
+                Maximum number of idle recognizers kept for each configuration
+            factory: callable
+                Called with (model, sample_rate) to build a new recognizer
+        """
+        self.max_idle = max_idle
+        self._factory = factory
+        self._idle: Dict[Tuple[int, int, bool], list] = dict()
+        self._watched_models = set()
+        self._lock = threading.Lock()
+        self.created = 0    # Number of recognizers built so far
+
+
+    def _drop_model(self, model_id: int) -> None:
+        # Called when a model is garbage collected, so its id can be reused
+        with self._lock:
+            self._watched_models.discard(model_id)
+            for key in [ k for k in self._idle if k[0] == model_id ]:
+                del self._idle[key]
+
+
+    def acquire(self, model: Model, sample_rate=16000, words=True) -> KaldiRecognizer:
+        """ Get a recognizer ready to accept a new utterance """
+        key = (id(model), sample_rate, words)
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+            if key[0] not in self._watched_models:
+                self._watched_models.add(key[0])
+                weakref.finalize(model, self._drop_model, key[0])
+            self.created += 1
+        
+        recognizer = self._factory(model, sample_rate)
+        if words:
+            recognizer.SetWords(True)
+        return recognizer
+
+
+    def release(self, recognizer: KaldiRecognizer, model: Model, sample_rate=16000, words=True) -> None:
+        """ Give back a recognizer acquired with the same configuration """
+        recognizer.Reset()
+        key = (id(model), sample_rate, words)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(recognizer)
+
+
+    @contextmanager
+    def recognizer(self, model: Model, sample_rate=16000, words=True) -> Iterator[KaldiRecognizer]:
+        recognizer = self.acquire(model, sample_rate, words)
+        try:
+            yield recognizer
+        finally:
+            self.release(recognizer, model, sample_rate, words)
+
+
+    def clear(self) -> None:
+        """ Free every idle recognizer """
+        with self._lock:
+            self._idle.clear()
+
+
+recognizer_pool = RecognizerPool()
+
+
+
+# Number of bytes fed to the recognizer at a time.
+# Smaller chunks make partial results available sooner, at the cost
+# of more calls to the recognizer (see `scripts/benchmark_chunk_size.py`)
+DEFAULT_CHUNK_SIZE = 4000
+
+
+def _as_waveform(chunk: memoryview):
+    # `AcceptWaveform` only takes bytes, or a cffi buffer wrapping
+    # the memory of the chunk without copying it
+    if _vosk_ffi is None:
+        return bytes(chunk)
+    return _vosk_ffi.from_buffer(chunk)
+
+
+def decode_buffer(recognizer: KaldiRecognizer, data, chunk_size=DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Feed audio data to a recognizer, by chunks of `chunk_size` bytes.
+    Yield the JSON result of every detected utterance, the final result last.
+    """
+    view = memoryview(data).cast('B')
+    i = 0
+    while i + chunk_size < len(view):
+        if recognizer.AcceptWaveform(_as_waveform(view[i:i+chunk_size])):
+            yield recognizer.Result()
+        i += chunk_size
+    recognizer.AcceptWaveform(_as_waveform(view[i:]))
+    yield recognizer.FinalResult()
+
+
+def decode_stream(
+        recognizer: KaldiRecognizer,
+        stream,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        on_chunk: callable = None
+    ) -> Iterator[str]:
+    """
+    Feed audio data read from a binary stream to a recognizer.
+    The stream is read into a single reusable buffer of `chunk_size` bytes.
+    Yield the JSON result of every detected utterance, the final result last.
+
+    `on_chunk` is called with the number of bytes of every chunk read.
+    """
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    while True:
+        n = stream.readinto(buffer)
+        if not n:
+            break
+        if recognizer.AcceptWaveform(_as_waveform(view[:n])):
+            yield recognizer.Result()
+        if on_chunk:
+            on_chunk(n)
+    yield recognizer.FinalResult()
+
+
+
+def _decode_gated(
+        recognizer: KaldiRecognizer,
+        stream,
+        gate: SpeechGate,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        on_chunk: callable = None
+    ) -> Iterator[Tuple[float, str]]:
+    """
+    Feed only the speech regions kept by a `SpeechGate` to a recognizer.
+    The recognizer is reset between speech regions.
+    Yield (region start, JSON result) pairs, where the timecodes of the result
+    are relative to the start of its speech region (in seconds).
+
+    `on_chunk` is called with the number of bytes of every chunk read.
+    """
+    def frames():
+        while True:
+            data = stream.read(chunk_size)
+            if not data:
+                break
+            yield from gate.process(data)
+            if on_chunk:
+                on_chunk(len(data))
+        yield from gate.flush()
+
+    region = None
+    pending = bytearray()
+    for start, frame in frames():
+        if start != region:
+            if region is not None:
+                if pending:
+                    recognizer.AcceptWaveform(bytes(pending))
+                yield region, recognizer.FinalResult()
+                recognizer.Reset()
+            region = start
+            pending.clear()
+        pending += frame
+        if len(pending) >= chunk_size:
+            if recognizer.AcceptWaveform(bytes(pending)):
+                yield region, recognizer.Result()
+            pending.clear()
+    if region is not None:
+        if pending:
+            recognizer.AcceptWaveform(bytes(pending))
+        yield region, recognizer.FinalResult()
+
+
+
+def _decode_stream_partials(
+        recognizer: KaldiRecognizer,
+        stream,
+        policy: PartialPolicy,
+        chunk_size=DEFAULT_CHUNK_SIZE
+    ) -> Iterator[Tuple[bool, dict]]:
+    """
+    Feed audio data read from a binary stream to a recognizer,
+    emitting partial results according to `policy`.
+    Yield (is_partial, result) tuples: partial results as built by the
+    policy, and Vosk results of every detected utterance, the final result last.
+    """
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    while True:
+        n = stream.readinto(buffer)
+        if not n:
+            break
+        policy.chunk(n)
+        if recognizer.AcceptWaveform(_as_waveform(view[:n])):
+            result = json.loads(recognizer.Result())
+            policy.final(result)
+            yield False, result
+        else:
+            partial = policy.partial(json.loads(recognizer.PartialResult())["partial"])
+            if partial:
+                yield True, partial
+    result = json.loads(recognizer.FinalResult())
+    policy.final(result)
+    yield False, result
 
 
 
+def _cached_transcription(kind: str, audio_hash: callable, options: dict, transcribe: callable):
+    """
+    Return the stored result of a transcription, if the transcription cache
+    is enabled (see `enable_transcription_cache`), or run `transcribe` and
+    store its result.
+    `audio_hash` is only called when the cache is enabled.
+    """
+    cache = get_transcription_cache()
+    if cache is None:
+        return transcribe()
+    key = make_key(kind, audio_hash(), model_identity(get_loaded_model_name()), options)
+    result = cache.get(key)
+    if result is None:
+        result = transcribe()
+        cache.put(key, result)
+    return result
+
+
 
-def transcribe_segment(segment: AudioSegment) -> List[str]:
+def transcribe_segment(segment: AudioSegment, chunk_size=DEFAULT_CHUNK_SIZE) -> List[str]:
     """Transcribe a short AudioSegment"""
     assert segment.frame_rate == 16000, f"Wrong sample rate {segment.frame_rate=}"
     assert segment.sample_width == 2, f"Wrong sample width {segment.sample_width=}"
     assert segment.channels == 1, f"Wrong number of channels {segment.channels=}"
 
     model = load_model()
-    recognizer = KaldiRecognizer(model, 16000)
-    recognizer.SetWords(True)
     
-    data = segment.raw_data
-    text = []
-    i = 0
-    while i + 4000 < len(data):
-        if recognizer.AcceptWaveform(data[i:i+4000]):
-            text.append(json.loads(recognizer.Result())["text"])
-        i += 4000
-    recognizer.AcceptWaveform(data[i:])
-    text.append(json.loads(recognizer.FinalResult())["text"])
+    def transcribe():
+        with recognizer_pool.recognizer(model) as recognizer, measure("transcribe_segment") as metrics:
+            return [
+                json.loads(result)["text"]
+                for result in decode_buffer(metrics.wrap_recognizer(recognizer), segment.raw_data, chunk_size)
+            ]
 
-    return text
+    return _cached_transcription(
+        "segment", lambda: hash_bytes(segment.raw_data), {"chunk_size": chunk_size}, transcribe
+    )
 
 
 
@@ -42,7 +316,8 @@ def transcribe_segment_ffmpeg(
     input_file: str, 
     start_time: float, 
     duration: float,
-    model=None
+    model=None,
+    chunk_size=DEFAULT_CHUNK_SIZE
 ) -> str:
     """ 
     Transcribe a segment of an audio file by streaming from ffmpeg to Vosk
@@ -52,27 +327,25 @@ def transcribe_segment_ffmpeg(
         start_time: Start time in seconds
         duration: Duration of segment in seconds
         model: Optional pre-loaded Vosk model (will load default if None)
+        chunk_size: Number of bytes read from ffmpeg at a time
         
     Returns:
         Transcribed text from the segment
     """
-    from vosk import Model, KaldiRecognizer
-    
     # Load model if not provided
     if model is None:
         model = load_model()
     
-    recognizer = KaldiRecognizer(model, 16000)
-    recognizer.SetWords(True)
-    
     # Configure ffmpeg to output raw audio in the format we need
     ffmpeg_cmd = [
         'ffmpeg',
         '-loglevel', 'error',  # Reduce ffmpeg output
         '-hide_banner',
-        '-i', input_file,
+        # Input seeking: ffmpeg jumps to the start of the segment
+        # instead of decoding the file from the beginning
         '-ss', str(start_time),
         '-t', str(duration),
+        '-i', input_file,
         '-ar', '16000',  # 16kHz sample rate
         '-ac', '1',      # Mono
         '-f', 's16le',   # 16-bit signed little-endian PCM
@@ -86,20 +359,13 @@ def transcribe_segment_ffmpeg(
         stderr=subprocess.PIPE
     )
     
-    text = []
-    chunk_size = 4000  # Same chunk size as original function
-    
     # Process the audio stream in chunks
-    while True:
-        data = process.stdout.read(chunk_size)
-        if len(data) == 0:
-            break
-            
-        if recognizer.AcceptWaveform(data):
-            text.append(json.loads(recognizer.Result())["text"])
-    
-    # Get final result and clean up
-    text.append(json.loads(recognizer.FinalResult())["text"])
+    with recognizer_pool.recognizer(model) as recognizer, measure("transcribe_segment_ffmpeg") as metrics:
+        text = [
+            json.loads(result)["text"]
+            for result in decode_stream(
+                metrics.wrap_recognizer(recognizer), metrics.wrap_stream(process.stdout), chunk_size)
+        ]
     
     # Ensure the process is terminated properly
     process.terminate()
@@ -114,32 +380,190 @@ def transcribe_segment_ffmpeg(
 
 
 
+def _decode_segments(
+        stream,
+        ranges: List[Tuple[int, int]],
+        offset: int,
+        pool: RecognizerPool,
+        model: Model,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        metrics=_no_metrics
+    ) -> List[List[str]]:
+    """
+    Route the audio data of a binary stream to one recognizer per segment
+
+    Parameters
+    ----------
+        ranges: list of (start, end) tuples
+            Byte ranges of the segments in the audio stream
+        offset: int
+            Byte position of the beginning of the stream
+        metrics:
+            Metrics of the call (see `ostilhou.asr.metrics.measure`)
+    
+    Returns the JSON results of every segment, the final result last
+    """
+    results = [ [] for _ in ranges ]
+    order = sorted(range(len(ranges)), key=lambda i: ranges[i])
+    active = [] # (segment index, pooled recognizer, measured recognizer)
+    next_segment = 0
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    pos = offset
+    try:
+        while next_segment < len(order) or active:
+            n = stream.readinto(buffer)
+            if not n:
+                break
+            end = pos + n
+            while next_segment < len(order) and ranges[order[next_segment]][0] < end:
+                recognizer = pool.acquire(model)
+                active.append((order[next_segment], recognizer, metrics.wrap_recognizer(recognizer)))
+                next_segment += 1
+            
+            for entry in list(active):
+                i, recognizer, decoder = entry
+                seg_start, seg_end = ranges[i]
+                lo, hi = max(seg_start, pos) - pos, min(seg_end, end) - pos
+                if hi > lo and decoder.AcceptWaveform(_as_waveform(view[lo:hi])):
+                    results[i].append(decoder.Result())
+                if seg_end <= end:
+                    results[i].append(decoder.FinalResult())
+                    # Removed first, so it is never released twice
+                    active.remove(entry)
+                    pool.release(recognizer, model)
+            pos = end
+        
+        # Segments reaching beyond the end of the stream
+        for i in order[next_segment:]:
+            recognizer = pool.acquire(model)
+            active.append((i, recognizer, metrics.wrap_recognizer(recognizer)))
+        for i, _, decoder in active:
+            results[i].append(decoder.FinalResult())
+    finally:
+        for _, recognizer, _ in active:
+            pool.release(recognizer, model)
+    
+    return results
+
+
+
+def transcribe_segments_ffmpeg(
+    input_file: str,
+    segments: List[Tuple[float, float]],
+    model=None,
+    timecoded=False,
+    columnar=False,
+    chunk_size=DEFAULT_CHUNK_SIZE
+) -> list:
+    """
+    Transcribe many segments of an audio file, with a single ffmpeg decoding pass
+
+    The audio stream is decoded once, from the start of the first segment
+    to the end of the last one, and every chunk of audio is fed to the
+    recognizers of the segments it belongs to.
+    Segments may overlap.
+
+    Args:
+        input_file: Path to the audio file
+        segments: List of (start, end) tuples, in seconds
+        model: Optional pre-loaded Vosk model (will load default if None)
+        timecoded: Return timecoded words instead of text
+        columnar: Return `TimecodedWords` objects (with `timecoded` only)
+        chunk_size: Number of bytes read from ffmpeg at a time
+
+    Returns:
+        The transcription of every segment, in the given order.
+        Either a list of sentences (as with `transcribe_segment_ffmpeg`)
+        or, if `timecoded` is True, a list of Vosk tokens with timecodes
+        relative to the start of the segment.
+    """
+    if not segments:
+        return []
+
+    # Load model if not provided
+    if model is None:
+        model = load_model()
+    
+    sample_rate = 16000
+    # Byte ranges of the segments in the PCM stream
+    ranges = [ (round(s * sample_rate) * 2, round(e * sample_rate) * 2) for s, e in segments ]
+    first = min( a for a, _ in ranges )
+    last = max( b for _, b in ranges )
+
+    ffmpeg_cmd = [
+        "ffmpeg",
+        "-loglevel", "error",
+        "-hide_banner",
+        "-ss", str(first / 2 / sample_rate),
+        "-t", str((last - first) / 2 / sample_rate),
+        "-i", input_file,
+        "-ar", str(sample_rate),
+        "-ac", "1",
+        "-f", "s16le",
+        "-",
+    ]
+    process = subprocess.Popen(
+        ffmpeg_cmd, 
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+
+    try:
+        with measure("transcribe_segments_ffmpeg") as metrics:
+            results = _decode_segments(
+                metrics.wrap_stream(process.stdout), ranges, first,
+                recognizer_pool, model, chunk_size, metrics
+            )
+    finally:
+        process.terminate()
+        process.wait()
+    
+    error = process.stderr.read()
+    if error and len(error) > 0:
+        print(f"ffmpeg warning/error: {error.decode()}")
+
+    if timecoded:
+        return [
+            _join_result_words([ result_words(r, columnar) for r in seg_results ], columnar)
+            for seg_results in results
+        ]
+    return [ [ json.loads(r)["text"] for r in seg_results ] for seg_results in results ]
+
+
+
 def transcribe_file_timecoded_callback_ffmpeg(
     input_file: str,
     callback: callable,
-    model=None
+    model=None,
+    columnar=False,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    partial_callback: callable = None,
+    partial_policy: Optional[PartialPolicy] = None
 ):
     """ 
-    Transcribe a segment of an audio file by streaming from ffmpeg to Vosk
+    Transcribe an audio file by streaming from ffmpeg to Vosk,
+    sending the words of every detected utterance to a callback
     
     Args:
         input_file: Path to the audio file
-        start_time: Start time in seconds
-        duration: Duration of segment in seconds
+        callback: called with the timecoded words of every utterance
         model: Optional pre-loaded Vosk model (will load default if None)
+        columnar: send `TimecodedWords` objects to the callback instead
+            of lists of Vosk tokens
+        chunk_size: Number of bytes read from ffmpeg at a time
+        partial_callback: called with the partial results
+            (`{'partial': True, 'text', 'stable', 'unstable'}` dictionaries)
+        partial_policy: emission policy of the partial results
+            (a default `PartialPolicy` if None)
         
     Returns:
-        Transcribed text from the segment
+        None, results are only given to the callbacks
     """
-    from vosk import Model, KaldiRecognizer
-    
     # Load model if not provided
     if model is None:
         model = load_model()
     
-    recognizer = KaldiRecognizer(model, 16000)
-    recognizer.SetWords(True)
-    
     # Configure ffmpeg to output raw audio in the format we need
     ffmpeg_cmd = [
         "ffmpeg",
@@ -159,23 +583,23 @@ def transcribe_file_timecoded_callback_ffmpeg(
         stderr=subprocess.PIPE
     )
     
-    chunk_size = 4000  # Same chunk size as original function
-    
     # Process the audio stream in chunks
-    while True:
-        data = process.stdout.read(chunk_size)
-        if len(data) == 0:
-            break
-            
-        if recognizer.AcceptWaveform(data):
-            result = json.loads(recognizer.Result())
-            if "result" in result:
-                callback(result["result"])
-    
-    # Get final result and clean up
-    result = json.loads(recognizer.FinalResult())
-    if "result" in result:
-        callback(result["result"])
+    with recognizer_pool.recognizer(model) as recognizer, measure("transcribe_file_timecoded_callback_ffmpeg") as metrics:
+        if partial_callback is None:
+            for result in decode_stream(
+                    metrics.wrap_recognizer(recognizer), metrics.wrap_stream(process.stdout), chunk_size):
+                words = result_words(result, columnar)
+                if words:
+                    callback(words)
+        else:
+            policy = partial_policy or PartialPolicy()
+            for is_partial, result in _decode_stream_partials(
+                    metrics.wrap_recognizer(recognizer), metrics.wrap_stream(process.stdout), policy, chunk_size):
+                if is_partial:
+                    partial_callback(result)
+                elif result.get("result"):
+                    callback(TimecodedWords.from_vosk(result["result"]) if columnar else result["result"])
+            metrics.add_latencies(policy.latencies)
     
     # Ensure the process is terminated properly
     process.terminate()
@@ -188,7 +612,11 @@ def transcribe_file_timecoded_callback_ffmpeg(
 
 
 
-def transcribe_segment_timecoded(segment: AudioSegment) -> List[dict]:
+def transcribe_segment_timecoded(
+        segment: AudioSegment,
+        columnar=False,
+        chunk_size=DEFAULT_CHUNK_SIZE
+    ) -> Union[List[dict], TimecodedWords]:
     """ Transcribe a short AudioSegment, keeping the timecodes
 
         The resulting transcription is a list of Vosk tokens
@@ -196,33 +624,41 @@ def transcribe_segment_timecoded(segment: AudioSegment) -> List[dict]:
             {'word': str, 'start': float, 'end': float, 'conf': float}
         'start' and 'end' keys are in seconds
         'conf' is a normalized confidence score
+
+        If `columnar` is True, a `TimecodedWords` object is returned instead
     """
     assert segment.frame_rate == 16000
     assert segment.sample_width == 2
     assert segment.channels == 1
     
     model = load_model()
-    recognizer = KaldiRecognizer(model, 16000)
-    recognizer.SetWords(True)
     
-    data = segment.get_array_of_samples().tobytes()
-    timecoded_text = []
-    i = 0
-    while i + 4000 < len(data):
-        if recognizer.AcceptWaveform(data[i:i+4000]):
-            result = json.loads(recognizer.Result())
-            if "result" in result:
-                timecoded_text.extend(result["result"])
-        i += 4000
-    recognizer.AcceptWaveform(data[i:])
-    result = json.loads(recognizer.FinalResult())
-    if "result" in result:
-        timecoded_text.extend(result["result"])
-    return timecoded_text
+    def transcribe(columnar):
+        with recognizer_pool.recognizer(model) as recognizer, measure("transcribe_segment_timecoded") as metrics:
+            parts = [
+                result_words(result, columnar)
+                for result in decode_buffer(metrics.wrap_recognizer(recognizer), segment.raw_data, chunk_size)
+            ]
+        return _join_result_words(parts, columnar)
+    
+    if get_transcription_cache() is None:
+        return transcribe(columnar)
+    tokens = _cached_transcription(
+        "segment_timecoded",
+        lambda: hash_bytes(segment.raw_data),
+        {"chunk_size": chunk_size},
+        lambda: transcribe(False)
+    )
+    return TimecodedWords.from_vosk(tokens) if columnar else tokens
 
 
 
-def transcribe_segment_timecoded_callback(segment: AudioSegment, callback: callable):
+def transcribe_segment_timecoded_callback(
+        segment: AudioSegment,
+        callback: callable,
+        columnar=False,
+        chunk_size=DEFAULT_CHUNK_SIZE
+    ):
     """ Transcribe a short AudioSegment, keeping the timecodes,
         Send result to callback function for every detected utterances
 
@@ -231,68 +667,63 @@ def transcribe_segment_timecoded_callback(segment: AudioSegment, callback: calla
             {'word': str, 'start': float, 'end': float, 'conf': float}
         'start' and 'end' keys are in seconds
         'conf' is a normalized confidence score
+
+        If `columnar` is True, the callback receives `TimecodedWords` objects
     """
     assert segment.frame_rate == 16000, f"Wrong sampling rate {segment.frame_rate=} (should be 16000)"
     assert segment.sample_width == 2, f"Wrong sample width {segment.sample_width=} (should be 2)"
     assert segment.channels == 1, f"Wrong number of channels {segment.channels=} (should be 1)"
     
     model = load_model()
-    recognizer = KaldiRecognizer(model, 16000)
-    recognizer.SetWords(True)
     
-    data = segment.get_array_of_samples().tobytes()
-    i = 0
-    while i + 4000 < len(data):
-        if recognizer.AcceptWaveform(data[i:i+4000]):
-            result = json.loads(recognizer.Result())
-            if "result" in result:
-                callback(result["result"])
-        i += 4000
-    recognizer.AcceptWaveform(data[i:])
-    result = json.loads(recognizer.FinalResult())
-    if "result" in result:
-        callback(result["result"])
+    with recognizer_pool.recognizer(model) as recognizer, measure("transcribe_segment_timecoded_callback") as metrics:
+        for result in decode_buffer(metrics.wrap_recognizer(recognizer), segment.raw_data, chunk_size):
+            words = result_words(result, columnar)
+            if words:
+                callback(words)
 
 
 
-def transcribe_file(filepath: str) -> List[str]:
+def transcribe_file(filepath: str, chunk_size=DEFAULT_CHUNK_SIZE) -> List[str]:
     if not os.path.exists(filepath):
         print("Couldn't find {}".format(filepath), file=sys.stderr)
 
     model = load_model()
-    recognizer = KaldiRecognizer(model, 16000)
-    recognizer.SetWords(True)
-    
-    text = []
-
-    with subprocess.Popen([
-                            "ffmpeg",
-                            "-loglevel", "quiet",
-                            "-hide_banner",
-                            "-i", filepath,
-                            "-ar", "16000",
-                            "-ac", "1",
-                            "-f", "s16le",
-                            "-"],
-                            stdout=subprocess.PIPE) as process:
+    
+    def transcribe():
+        text = []
+        with subprocess.Popen([
+                                "ffmpeg",
+                                "-loglevel", "quiet",
+                                "-hide_banner",
+                                "-i", filepath,
+                                "-ar", "16000",
+                                "-ac", "1",
+                                "-f", "s16le",
+                                "-"],
+                                stdout=subprocess.PIPE) as process:
 
-        while True:
-            data = process.stdout.read(4000)
-            if len(data) == 0:
-                break
-            if recognizer.AcceptWaveform(data):
-                sentence = json.loads(recognizer.Result())["text"]
-                if sentence:
-                    text.append(sentence)
-        sentence = json.loads(recognizer.FinalResult())["text"]
-        if sentence:
-            text.append(sentence)
+            with recognizer_pool.recognizer(model) as recognizer, measure("transcribe_file") as metrics:
+                for result in decode_stream(
+                metrics.wrap_recognizer(recognizer), metrics.wrap_stream(process.stdout), chunk_size):
+                    sentence = json.loads(result)["text"]
+                    if sentence:
+                        text.append(sentence)
+        return text
     
-    return text
+    return _cached_transcription(
+        "file", lambda: hash_file(filepath), {"chunk_size": chunk_size}, transcribe
+    )
 
 
 
-def transcribe_file_timecoded(filepath: str, show_progress_bar=True) -> List[dict]:
+def transcribe_file_timecoded(
+        filepath: str,
+        show_progress_bar=True,
+        columnar=False,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        vad=None
+    ) -> Union[List[dict], TimecodedWords]:
     """ Return a list of decoded words with timecodes (vosk format)
 
         The resulting transcription is a list of Vosk tokens.
@@ -301,54 +732,457 @@ def transcribe_file_timecoded(filepath: str, show_progress_bar=True) -> List[dic
         where:
             'start' and 'end' are in seconds
             'conf' is a normalized confidence score (between 0.0 and 1.0)
-    """
 
-    def format_output(result) -> List[dict]:
-        jres = json.loads(result)
-        return jres.get("result", [])
+        If `columnar` is True, a `TimecodedWords` object is returned instead
+
+        With `vad` (True for an `audio.audio_numpy.EnergyVAD`, or any VAD
+        accepted by `audio.audio_numpy.SpeechGate`), long non-speech parts
+        of the audio are not fed to the recognizer. The duration of the
+        skipped audio is reported in the metrics ('skipped_duration').
+    """
+    if vad is True:
+        vad = EnergyVAD()
     
     if not os.path.exists(filepath):
         print("Couldn't find {}".format(filepath), file=sys.stderr)
 
     model = load_model()
-    recognizer = KaldiRecognizer(model, 16000)
-    recognizer.SetWords(True)
 
-    total_duration = get_audiofile_length(filepath)
-    progress = 0.0
-
-    if show_progress_bar:
-        progress_bar = tqdm(total=total_duration, unit='s', unit_scale=True)
-    
-    tokens = []
-    with subprocess.Popen(
-        [
-            "ffmpeg",
-            "-loglevel", "quiet",
-            "-hide_banner",
-            "-i", filepath,
-            "-ar", "16000",
-            "-ac", "1",
-            "-f", "s16le",
-            "-"
-        ], stdout=subprocess.PIPE) as process:
-
-        while True:
-            data = process.stdout.read(4000)
-            if len(data) == 0:
-                break
-            if recognizer.AcceptWaveform(data):
-                tokens.extend(format_output(recognizer.Result()))
-
-            progress += (len(data) // 2) / 16000
+    def transcribe(columnar):
+        total_duration = get_audiofile_length(filepath)
+        progress = 0.0
 
+        if show_progress_bar:
+            progress_bar = tqdm(total=total_duration, unit='s', unit_scale=True)
+    
+        def update_progress(n_bytes: int):
+            nonlocal progress
+            progress += (n_bytes // 2) / 16000
             if show_progress_bar:
                 progress_bar.n = min(progress, total_duration)
                 progress_bar.refresh()
-        
-        tokens.extend(format_output(recognizer.FinalResult()))
+
+        with subprocess.Popen(
+            [
+                "ffmpeg",
+                "-loglevel", "quiet",
+                "-hide_banner",
+                "-i", filepath,
+                "-ar", "16000",
+                "-ac", "1",
+                "-f", "s16le",
+                "-"
+            ], stdout=subprocess.PIPE) as process:
+
+            with recognizer_pool.recognizer(model) as recognizer, measure("transcribe_file_timecoded") as metrics:
+                if vad is None:
+                    parts = [
+                        result_words(result, columnar)
+                        for result in decode_stream(
+                            metrics.wrap_recognizer(recognizer),
+                            metrics.wrap_stream(process.stdout),
+                            chunk_size,
+                            update_progress
+                        )
+                    ]
+                else:
+                    gate = SpeechGate(vad)
+                    parts = []
+                    for offset, result in _decode_gated(
+                            metrics.wrap_recognizer(recognizer),
+                            metrics.wrap_stream(process.stdout),
+                            gate,
+                            chunk_size,
+                            update_progress
+                        ):
+                        words = result_words(result, columnar)
+                        if columnar:
+                            words.start += offset
+                            words.end += offset
+                        else:
+                            for tok in words:
+                                tok["start"] += offset
+                                tok["end"] += offset
+                        parts.append(words)
+                    metrics.skip(gate.total_bytes - gate.speech_bytes)
+    
+        if show_progress_bar:
+            progress_bar.close()
+    
+        return _join_result_words(parts, columnar)
+
+    if get_transcription_cache() is None:
+        return transcribe(columnar)
+    options = {"chunk_size": chunk_size}
+    if vad is not None:
+        options["vad"] = repr(vad)
+    tokens = _cached_transcription(
+        "file_timecoded", lambda: hash_file(filepath), options, lambda: transcribe(False)
+    )
+    return TimecodedWords.from_vosk(tokens) if columnar else tokens
+
+
+
+def transcribe_stream_timecoded(
+        stream,
+        columnar=False,
+        chunk_size=DEFAULT_CHUNK_SIZE
+    ) -> Union[List[dict], TimecodedWords]:
+    """
+    Return a list of decoded words with timecodes (see `transcribe_file_timecoded`)
+    from a binary stream of raw PCM data (16kHz, mono, 16 bits).
+
+    Can be used as a consumer of an `audio.hub.StreamHub`.
+    """
+    model = load_model()
+    with recognizer_pool.recognizer(model) as recognizer, measure("transcribe_stream_timecoded") as metrics:
+        parts = [
+            result_words(result, columnar)
+            for result in decode_stream(
+                metrics.wrap_recognizer(recognizer), metrics.wrap_stream(stream), chunk_size
+            )
+        ]
+    return _join_result_words(parts, columnar)
+
+
+
+def transcribe_stream_live(
+        stream,
+        callback: callable,
+        policy: Optional[PartialPolicy] = None,
+        model=None,
+        columnar=False,
+        chunk_size=DEFAULT_CHUNK_SIZE
+    ) -> PartialPolicy:
+    """
+    Transcribe raw PCM data (16kHz, mono, 16 bits) read from a binary stream
+    as it arrives (a microphone, a live broadcast...), for live captioning.
+
+    `callback` is called with partial results, at the rate set by `policy`
+    (see `PartialPolicy`):
+        {'partial': True, 'text': str, 'stable': str, 'unstable': str}
+    and with the result of every detected utterance:
+        {'partial': False, 'text': str, 'words': list of Vosk tokens}
+    (`words` is a `TimecodedWords` object if `columnar` is True)
+
+    Returns the policy, with the latency of every word (`policy.latencies`).
+    The mean and max latencies are recorded in the metrics as well.
+    """
+    if model is None:
+        model = load_model()
+    if policy is None:
+        policy = PartialPolicy()
+    with recognizer_pool.recognizer(model) as recognizer, measure("transcribe_stream_live") as metrics:
+        for is_partial, result in _decode_stream_partials(
+                metrics.wrap_recognizer(recognizer), metrics.wrap_stream(stream), policy, chunk_size):
+            if is_partial:
+                callback(result)
+            elif result.get("text"):
+                words = result.get("result", [])
+                if columnar:
+                    words = TimecodedWords.from_vosk(words)
+                callback({"partial": False, "text": result["text"], "words": words})
+        metrics.add_latencies(policy.latencies)
+    return policy
+
+
+
+def transcribe_chunk(task: Tuple[bytes, float, int]) -> List[dict]:
+    """
+    Transcribe a chunk of a longer audio buffer with the loaded model,
+    in the current process or a worker of a `WorkerPool`.
+
+    Parameters
+    ----------
+        task: tuple
+            Audio data (mono s16le PCM, 16kHz), position of the chunk
+            in the whole audio (in seconds) and size of the chunks fed
+            to the recognizer (in bytes)
+
+    Returns a list of Vosk tokens, timecoded relative to the whole audio
+    """
+    return _transcribe_chunk_measured(task)[0]
+
+
+def _transcribe_chunk_measured(task: Tuple[bytes, float, int]) -> Tuple[List[dict], dict]:
+    # Metrics are measured in the worker and merged in the calling process,
+    # where the sinks are registered (see `CallMetrics.merge`)
+    data, offset, chunk_size = task
+    model = load_model()
+    metrics = CallMetrics("transcribe_chunk")
+    with recognizer_pool.recognizer(model) as recognizer:
+        tokens = [
+            tok
+            for result in decode_buffer(metrics.wrap_recognizer(recognizer), data, chunk_size)
+            for tok in json.loads(result).get("result", [])
+        ]
+    for tok in tokens:
+        tok["start"] += offset
+        tok["end"] += offset
+    return tokens, metrics.counters()
+
+
+
+def transcribe_file_timecoded_parallel(
+        filepath: str,
+        workers: Optional[int] = None,
+        max_length: float = 30.0,
+        overlap: Optional[float] = None,
+        model_name: Optional[str] = None,
+        show_progress_bar=True,
+        columnar=False,
+        chunk_size=DEFAULT_CHUNK_SIZE
+    ) -> Union[List[dict], TimecodedWords]:
+    """ Transcribe an audio file by chunks, decoded in parallel
+
+        The audio file is cut in chunks of at most `max_length` seconds.
+        If `overlap` is None, chunks are cut in silences (see `split_to_segments`),
+        otherwise chunks are fixed windows overlapping by `overlap` seconds.
+        Workers share the model (see `WorkerPool`), there are as many of them
+        as CPUs if `workers` is None.
+
+        The result has the same format as `transcribe_file_timecoded`:
+        a list of Vosk tokens, or a `TimecodedWords` object if `columnar` is True.
+    """
+
+    if not os.path.exists(filepath):
+        print("Couldn't find {}".format(filepath), file=sys.stderr)
+
+    if model_name is None:
+        model_name = get_loaded_model_name() or None
+    workers = workers or os.cpu_count() or 1
+    
+    sample_rate = 16000
+    buffers = []
+    stream_audio_file(filepath, sample_rate, buffers.append, 64000)
+    samples = np.frombuffer(b''.join(buffers), dtype=np.int16)
+    del buffers
+
+    if overlap is None:
+        ranges = silence_cuts(samples, sample_rate, max_length)
+    else:
+        ranges = window_cuts(len(samples), sample_rate, max_length, overlap)
+    bounds = [ (a / sample_rate, b / sample_rate) for a, b in ranges ]
+    tasks = [ (samples[a:b].tobytes(), a / sample_rate, chunk_size) for a, b in ranges ]
+
+    if show_progress_bar:
+        progress_bar = tqdm(total=len(samples) / sample_rate, unit='s', unit_scale=True)
+    
+    chunks = []
+    with measure("transcribe_file_timecoded_parallel", sample_rate) as metrics:
+        if workers > 1 and len(tasks) > 1:
+            with WorkerPool(model_name, workers) as pool:
+                results = pool.imap(_transcribe_chunk_measured, tasks)
+                for (start, end), (tokens, counters) in zip(bounds, results):
+                    chunks.append(tokens)
+                    metrics.merge(counters)
+                    if show_progress_bar:
+                        progress_bar.update(end - start)
+        else:
+            load_model(model_name)
+            for (start, end), task in zip(bounds, tasks):
+                tokens, counters = _transcribe_chunk_measured(task)
+                chunks.append(tokens)
+                metrics.merge(counters)
+                if show_progress_bar:
+                    progress_bar.update(end - start)
     
     if show_progress_bar:
         progress_bar.close()
     
+    tokens = stitch_chunks(chunks, bounds)
+    if columnar:
+        return TimecodedWords.from_vosk(tokens)
     return tokens
+
+
+
+async def _recognize_stream_async(
+        stream,
+        recognizer: KaldiRecognizer,
+        partial_results=False,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        max_pending=8,
+        executor=None,
+        on_chunk: callable = None
+    ) -> AsyncIterator[Tuple[bool, str]]:
+    """
+    Feed audio data from an asyncio stream to a recognizer.
+    Decoding is done in `executor` (the event loop's default executor if None).
+    At most `max_pending` chunks are read ahead of the recognizer,
+    after which reading from the stream is paused.
+    `on_chunk` is called with the number of bytes of every chunk read.
+
+    The recognizer is not in use anymore when the generator is closed,
+    even if it was cancelled during decoding.
+
+    Yield (is_partial, JSON result) tuples, the final result last.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max_pending)
+
+    async def read_chunks():
+        try:
+            while True:
+                try:
+                    data = await stream.readexactly(chunk_size)
+                except asyncio.IncompleteReadError as e:
+                    data = e.partial
+                if data:
+                    if on_chunk:
+                        on_chunk(len(data))
+                    await queue.put(data)
+                if len(data) < chunk_size:
+                    break
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    pending = None  # Last call to the recognizer in the executor
+
+    async def decode(fn, *args):
+        nonlocal pending
+        pending = loop.run_in_executor(executor, fn, *args)
+        # Cancelling the caller must not cancel the future,
+        # which is awaited again before leaving
+        return await asyncio.shield(pending)
+
+    reader = asyncio.create_task(read_chunks())
+    try:
+        while True:
+            data = await queue.get()
+            if data is None:
+                break
+            if isinstance(data, Exception):
+                raise data
+            if await decode(recognizer.AcceptWaveform, data):
+                yield False, recognizer.Result()
+            elif partial_results:
+                yield True, recognizer.PartialResult()
+        yield False, await decode(recognizer.FinalResult)
+    finally:
+        reader.cancel()
+        # When cancelled, the executor may still be decoding: the recognizer
+        # can't be released or reset before it's done
+        while pending is not None and not pending.done():
+            try:
+                await asyncio.wait({pending})
+            except asyncio.CancelledError:
+                pass
+
+
+
+async def transcribe_stream_async(
+        stream,
+        model=None,
+        partial_results=False,
+        columnar=False,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        max_pending=8,
+        executor=None,
+        sample_rate=16000,
+        partial_policy: Optional[PartialPolicy] = None
+    ) -> AsyncIterator[dict]:
+    """ Transcribe raw audio (mono s16le PCM, 16kHz by default) read from an asyncio stream
+
+        `stream` can be any object with an `async readexactly(n)` method,
+        such as an `asyncio.StreamReader` or an aiohttp request content.
+
+        Yield a dictionary for every detected utterance:
+            {'partial': False, 'text': str, 'words': list of Vosk tokens}
+        (`words` is a `TimecodedWords` object if `columnar` is True)
+
+        If `partial_results` is True, the current partial transcription
+        is yielded as well whenever it changes:
+            {'partial': True, 'text': str}
+        
+        Decoding runs in `executor` (the event loop's default executor if None),
+        so many streams can be transcribed concurrently by a single event loop.
+        At most `max_pending` chunks of `chunk_size` bytes are read ahead of the
+        recognizer.
+
+        `sample_rate` is the sample rate of the audio stream.
+
+        With a `partial_policy` (see `PartialPolicy`), partial results (if
+        `partial_results` is True) are yielded at the rate set by the policy,
+        with their stable prefix:
+            {'partial': True, 'text': str, 'stable': str, 'unstable': str}
+        and the latency of the words is recorded in the metrics.
+    """
+    loop = asyncio.get_running_loop()
+    if model is None:
+        model = await loop.run_in_executor(executor, load_model)
+    policy = partial_policy
+
+    recognizer = recognizer_pool.acquire(model, sample_rate)
+    last_partial = ""
+    try:
+        with measure("transcribe_stream_async", sample_rate) as metrics:
+            async for is_partial, result in _recognize_stream_async(
+                stream, metrics.wrap_recognizer(recognizer),
+                partial_results, chunk_size, max_pending, executor,
+                policy.chunk if policy else None
+            ):
+                result = json.loads(result)
+                if is_partial:
+                    if policy:
+                        partial = policy.partial(result["partial"])
+                        if partial:
+                            yield partial
+                    elif result["partial"] != last_partial:
+                        last_partial = result["partial"]
+                        yield {"partial": True, "text": last_partial}
+                    continue
+                if policy:
+                    policy.final(result)
+                if result.get("text"):
+                    last_partial = ""
+                    words = result.get("result", [])
+                    if columnar:
+                        words = TimecodedWords.from_vosk(words)
+                    yield {"partial": False, "text": result["text"], "words": words}
+            if policy:
+                metrics.add_latencies(policy.latencies)
+    finally:
+        recognizer_pool.release(recognizer, model, sample_rate)
+
+
+
+async def transcribe_file_async(
+        filepath: str,
+        model=None,
+        partial_results=False,
+        columnar=False,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        max_pending=8,
+        executor=None
+    ) -> AsyncIterator[dict]:
+    """ Transcribe an audio file, streamed from an ffmpeg subprocess
+
+        Asynchronous counterpart of `transcribe_file_timecoded`,
+        see `transcribe_stream_async` for the format of the results.
+    """
+
+    if not os.path.exists(filepath):
+        print("Couldn't find {}".format(filepath), file=sys.stderr)
+
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg",
+        "-loglevel", "quiet",
+        "-hide_banner",
+        "-i", filepath,
+        "-ar", "16000",
+        "-ac", "1",
+        "-f", "s16le",
+        "-",
+        stdout=asyncio.subprocess.PIPE
+    )
+    try:
+        async for result in transcribe_stream_async(
+            process.stdout, model, partial_results, columnar, chunk_size, max_pending, executor
+        ):
+            yield result
+    finally:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
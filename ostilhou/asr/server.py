@@ -0,0 +1,399 @@
+"""
+Live transcription server
+
+Keeps a Vosk model loaded and transcribes audio streamed by many clients at
+once, over plain TCP or WebSocket (the latter requires the `websockets`
+package). Results are sent back as JSON objects, with post-processing and
+inverse normalization applied:
+
+    {"partial": "demat d'an"}                     (when partial results are enabled)
+    {"partial": "demat d'an", "stable": "demat"}  (with a partial results interval)
+    {"text": "demat d'an holl", "result": [...]}  (list of Vosk tokens)
+    {"error": "..."}
+
+Every session starts with an optional JSON configuration:
+
+    {
+        "format": "pcm",        "pcm" (mono s16le), or any container or codec
+                                read by ffmpeg ("wav", "mp3", "ogg"...)
+        "sample_rate": 16000,   sample rate of raw PCM audio
+        "partial": true,        send partial results
+        "partial_interval": null,   minimum time between partial results (seconds),
+                                    which include their stable prefix (null to
+                                    send every change of the partial result)
+        "words": true,          send timecoded words with final results
+        "normalize": true,      inverse normalization (numbers...)
+        "keep_fillers": true    keep verbal fillers
+    }
+
+TCP protocol: the configuration is sent on the first line (an empty line for
+the defaults), followed by the audio data. The client shuts down its side of
+the connection when all the audio is sent, the server sends the remaining
+results and closes the connection. Results are sent one per line.
+
+WebSocket protocol: the configuration is sent as the first text message
+(optional), audio data as binary messages, and `{"eof": 1}` ends the stream
+(closing the connection works as well).
+
+Concurrency: at most `max_sessions` clients are served at once, additional
+clients receive an error. Decoding runs in a pool of `workers` threads (Kaldi
+releases the GIL). At most `max_pending` chunks of audio are buffered per
+session: reading from a client is paused until the recognizer catches up,
+which slows down the client through TCP flow control.
+
+Usage:
+    ostilhou-serve --port 2700 --ws-port 2701
+"""
+
+from typing import Optional, Callable, Awaitable
+import sys
+import os
+import json
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from vosk import Model
+
+from .models import load_model
+from .recognizer import transcribe_stream_async, DEFAULT_CHUNK_SIZE
+from .partials import PartialPolicy
+from .post_processing import post_process_text, post_process_timecoded
+
+
+
+_DEFAULT_CONFIG = {
+    "format": "pcm",
+    "sample_rate": 16000,
+    "partial": True,
+    "partial_interval": None,
+    "words": True,
+    "normalize": True,
+    "keep_fillers": True,
+}
+
+_MAX_CONFIG_SIZE = 1 << 16
+
+
+
+class _MessageStream:
+    """
+    Stream of audio data received as WebSocket binary messages,
+    with the `readexactly` method expected by `transcribe_stream_async`
+    """
+
+    def __init__(self, websocket):
+        self._websocket = websocket
+        self._buffer = bytearray()
+        self._eof = False
+
+
+    def push(self, data: bytes) -> None:
+        self._buffer.extend(data)
+
+
+    async def _receive(self) -> None:
+        from websockets.exceptions import ConnectionClosed
+        try:
+            message = await self._websocket.recv()
+        except ConnectionClosed:
+            self._eof = True
+            return
+        if isinstance(message, str):
+            if json.loads(message).get("eof"):
+                self._eof = True
+        else:
+            self._buffer.extend(message)
+
+
+    async def readexactly(self, n: int) -> bytes:
+        while len(self._buffer) < n and not self._eof:
+            await self._receive()
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        if len(data) < n:
+            raise asyncio.IncompleteReadError(data, n)
+        return data
+
+
+    async def read(self, n: int) -> bytes:
+        if not self._buffer and not self._eof:
+            await self._receive()
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+
+
+class TranscriptionServer:
+    """
+    Transcription server, see the module documentation for the protocols
+
+    Parameters
+    ----------
+        model: vosk.Model
+            The model to use (the currently loaded model if None)
+        max_sessions: int
+            Maximum number of clients served at once
+        workers: int
+            Number of decoding threads
+        max_pending: int
+            Number of audio chunks buffered per session
+        chunk_size: int
+            Number of bytes fed to the recognizer at a time
+        config: dict
+            Default session configuration, overridden by clients
+    """
+
+    def __init__(
+            self,
+            model: Optional[Model] = None,
+            max_sessions: int = 8,
+            workers: Optional[int] = None,
+            max_pending: int = 8,
+            chunk_size: int = DEFAULT_CHUNK_SIZE,
+            config: Optional[dict] = None
+        ):
+        self.model = model or load_model()
+        self.max_sessions = max_sessions
+        self.max_pending = max_pending
+        self.chunk_size = chunk_size
+        self.config = dict(_DEFAULT_CONFIG, **(config or dict()))
+        self.sessions = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers or min(max_sessions, os.cpu_count()))
+        self._servers = []
+
+
+    def _format_result(self, result: dict, config: dict) -> dict:
+        normalize, keep_fillers = config["normalize"], config["keep_fillers"]
+        if result["partial"]:
+            message = { "partial": post_process_text(result["text"], normalize, keep_fillers) }
+            if "stable" in result:
+                message["stable"] = post_process_text(result["stable"], normalize, keep_fillers)
+            return message
+        message = { "text": post_process_text(result["text"], normalize, keep_fillers) }
+        if config["words"]:
+            message["result"] = post_process_timecoded(result["words"], normalize, keep_fillers)
+        return message
+
+
+    async def _feed_ffmpeg(self, stream, process) -> None:
+        try:
+            while True:
+                data = await stream.read(self.chunk_size)
+                if not data:
+                    break
+                process.stdin.write(data)
+                # Wait for ffmpeg to consume the data (backpressure)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            process.stdin.close()
+
+
+    async def transcribe(
+            self,
+            config: dict,
+            stream,
+            send: Callable[[dict], Awaitable[None]]
+        ) -> None:
+        """
+        Transcribe the audio data read from `stream` and send the results.
+        `stream` must have `async readexactly(n)` and `async read(n)` methods.
+        """
+        config = dict(self.config, **config)
+        unknown = set(config).difference(_DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError(f"Unknown configuration keys: {', '.join(sorted(unknown))}")
+
+        process = feeder = None
+        sample_rate = int(config["sample_rate"])
+        if config["format"] != "pcm":
+            # Decode the audio container with ffmpeg
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    "ffmpeg",
+                    "-loglevel", "quiet",
+                    "-hide_banner",
+                    "-i", "-",
+                    "-ar", "16000",
+                    "-ac", "1",
+                    "-f", "s16le",
+                    "-",
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE
+                )
+            except FileNotFoundError:
+                raise ValueError(f"Format '{config['format']}' is not supported (ffmpeg not found)")
+            feeder = asyncio.create_task(self._feed_ffmpeg(stream, process))
+            stream = process.stdout
+            sample_rate = 16000
+
+        policy = None
+        if config["partial"] and config["partial_interval"] is not None:
+            policy = PartialPolicy(float(config["partial_interval"]), sample_rate=sample_rate)
+
+        try:
+            async for result in transcribe_stream_async(
+                stream,
+                self.model,
+                partial_results=bool(config["partial"]),
+                chunk_size=self.chunk_size,
+                max_pending=self.max_pending,
+                executor=self._executor,
+                sample_rate=sample_rate,
+                partial_policy=policy
+            ):
+                await send(self._format_result(result, config))
+        finally:
+            if feeder is not None:
+                feeder.cancel()
+            if process is not None:
+                if process.returncode is None:
+                    process.kill()
+                await process.wait()
+
+
+    async def _session(self, config_loader, stream, send) -> None:
+        try:
+            config = await config_loader()
+        except (ValueError, TypeError) as e:
+            await send({ "error": str(e) })
+            return
+        if self.sessions >= self.max_sessions:
+            await send({ "error": "Too many clients, try again later" })
+            return
+        self.sessions += 1
+        try:
+            await self.transcribe(config, stream, send)
+        except (ValueError, TypeError) as e:
+            await send({ "error": str(e) })
+        finally:
+            self.sessions -= 1
+
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        async def load_config():
+            line = await reader.readline()
+            if len(line) > _MAX_CONFIG_SIZE:
+                raise ValueError("Configuration line is too long")
+            line = line.strip()
+            return json.loads(line) if line else dict()
+
+        async def send(message: dict):
+            writer.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b'\n')
+            await writer.drain()
+
+        try:
+            await self._session(load_config, reader, send)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+    async def _handle_websocket(self, websocket, *args) -> None:
+        from websockets.exceptions import ConnectionClosed
+        stream = _MessageStream(websocket)
+
+        async def load_config():
+            message = await websocket.recv()
+            if isinstance(message, str):
+                config = json.loads(message)
+                return config.get("config", config)
+            # No configuration, the first message is audio data
+            stream.push(message)
+            return dict()
+
+        async def send(message: dict):
+            await websocket.send(json.dumps(message, ensure_ascii=False))
+
+        try:
+            await self._session(load_config, stream, send)
+        except ConnectionClosed:
+            pass
+
+
+    async def start_tcp(self, host="127.0.0.1", port=2700) -> asyncio.AbstractServer:
+        """ Start listening for TCP clients, returns the asyncio server """
+        server = await asyncio.start_server(self._handle_tcp, host, port, limit=_MAX_CONFIG_SIZE)
+        self._servers.append(server)
+        return server
+
+
+    async def start_websocket(self, host="127.0.0.1", port=2701):
+        """ Start listening for WebSocket clients, returns the websockets server """
+        try:
+            import websockets
+        except ImportError:
+            raise ImportError("The WebSocket server requires the `websockets` package (pip install websockets)")
+        server = await websockets.serve(self._handle_websocket, host, port, max_queue=self.max_pending)
+        self._servers.append(server)
+        return server
+
+
+    async def close(self) -> None:
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers.clear()
+        self._executor.shutdown(wait=False)
+
+
+
+async def _serve(args) -> None:
+    model = load_model(args.model)
+    server = TranscriptionServer(
+        model,
+        max_sessions=args.max_sessions,
+        workers=args.workers,
+        max_pending=args.max_pending,
+        chunk_size=args.chunk_size,
+        config={
+            "normalize": not args.no_normalize,
+            "keep_fillers": not args.remove_fillers,
+        }
+    )
+    if args.port:
+        await server.start_tcp(args.host, args.port)
+        print(f"Listening for TCP clients on {args.host}:{args.port}", file=sys.stderr)
+    if args.ws_port:
+        await server.start_websocket(args.host, args.ws_port)
+        print(f"Listening for WebSocket clients on {args.host}:{args.ws_port}", file=sys.stderr)
+    try:
+        await asyncio.Future()  # Serve forever
+    finally:
+        await server.close()
+
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Live transcription server (TCP and WebSocket)")
+    parser.add_argument("-m", "--model", help="Vosk model to use")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=2700, help="TCP port (0 to disable)")
+    parser.add_argument("--ws-port", type=int, default=0, help="WebSocket port (disabled by default)")
+    parser.add_argument("--max-sessions", type=int, default=8, help="Maximum number of concurrent clients")
+    parser.add_argument("-j", "--workers", type=int, help="Number of decoding threads")
+    parser.add_argument("--max-pending", type=int, default=8,
+        help="Number of audio chunks buffered per client before reading is paused")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+        help="Number of bytes fed to the recognizer at a time")
+    parser.add_argument("--no-normalize", action="store_true", help="Disable inverse normalization")
+    parser.add_argument("--remove-fillers", action="store_true", help="Remove verbal fillers")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+On-disk cache of transcription results
+
+Transcription results are stored in a SQLite database, keyed by a hash of
+the audio (PCM data or file content), the model identity and the recognizer
+options. The cache is opt-in:
+
+    enable_transcription_cache()
+
+after which the transcription functions of `ostilhou.asr.recognizer`
+return stored results for audio they have already decoded.
+
+Many processes can use the same cache file at once.
+Least recently used entries are dropped when the cache grows
+larger than its size cap.
+"""
+
+from typing import Any, Optional, Tuple, Dict
+import os
+import time
+import json
+import sqlite3
+import hashlib
+
+from ..utils import get_cache_directory
+from .models import scan_model_dir
+
+
+
+_DEFAULT_MAX_SIZE = 1 << 30     # 1 GiB
+_EVICTION_INTERVAL = 64         # Check the cache size every N insertions
+
+
+
+def hash_bytes(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+_file_hashes: Dict[Tuple[str, int, int], str] = dict()
+
+def hash_file(path: str) -> str:
+    """ Hash of the content of a file, memoized until the file is modified """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _file_hashes[key] = h.hexdigest()
+    return _file_hashes[key]
+
+
+def model_identity(model_name: str) -> str:
+    """
+    Identify a model by its name or, for a model given as a local directory,
+    by its path and the size and modification time of its model files
+    (see `scan_model_dir`)
+    """
+    if not os.path.isdir(model_name):
+        return model_name
+    state = scan_model_dir(model_name)["state"]
+    return os.path.abspath(model_name) + ':' + hash_bytes(json.dumps(state).encode())
+
+
+def make_key(*parts) -> str:
+    """ Cache key from JSON-serializable parts """
+    return hash_bytes(json.dumps(parts, sort_keys=True).encode("utf-8"))
+
+
+
+class TranscriptionCache:
+    """
+    SQLite store of transcription results, with a size cap (in bytes)
+
+    Values can be any JSON-serializable object.
+    Connections are reopened in forked processes.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_size: int = _DEFAULT_MAX_SIZE):
+        self.path = path or os.path.join(get_cache_directory(), "transcriptions.sqlite")
+        self.max_size = max_size
+        self._conn = None
+        self._pid = None
+        self._n_puts = 0
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, atime REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)")
+
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            # SQLite connections must not be shared across processes
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._conn
+
+
+    def get(self, key: str) -> Optional[Any]:
+        conn = self._connection()
+        row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            with conn:
+                conn.execute("UPDATE entries SET atime = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.OperationalError:
+            pass    # Database locked by another writer, access time is not critical
+        return json.loads(row[0])
+
+
+    def put(self, key: str, value: Any) -> None:
+        data = json.dumps(value, ensure_ascii=False)
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, atime) VALUES (?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")) + len(key), time.time())
+            )
+        self._n_puts += 1
+        if self._n_puts % _EVICTION_INTERVAL == 1:
+            self.evict()
+
+
+    def size(self) -> int:
+        """ Total size of the stored entries, in bytes """
+        row = self._connection().execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return row[0]
+
+
+    def evict(self) -> None:
+        """ Drop the least recently used entries, until the cache fits in its size cap """
+        conn = self._connection()
+        with conn:
+            excess = self.size() - self.max_size
+            if excess <= 0:
+                return
+            # Leave some room, to avoid evicting on every insertion
+            excess += self.max_size // 10
+            to_delete = []
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY atime"):
+                to_delete.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM entries WHERE key = ?", to_delete)
+
+
+    def clear(self) -> None:
+        with self._connection() as conn:
+            conn.execute("DELETE FROM entries")
+
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+    def close(self) -> None:
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+
+
+_transcription_cache: Optional[TranscriptionCache] = None
+
+
+def enable_transcription_cache(path: Optional[str] = None, max_size: int = _DEFAULT_MAX_SIZE) -> TranscriptionCache:
+    """
+    Store transcription results on disk, in the user's cache directory by default.
+    Returns the cache in use.
+    """
+    global _transcription_cache
+    if _transcription_cache is not None:
+        _transcription_cache.close()
+    _transcription_cache = TranscriptionCache(path, max_size)
+    return _transcription_cache
+
+
+def disable_transcription_cache() -> None:
+    global _transcription_cache
+    if _transcription_cache is not None:
+        _transcription_cache.close()
+    _transcription_cache = None
+
+
+def get_transcription_cache() -> Optional[TranscriptionCache]:
+    return _transcription_cache
@@ -0,0 +1,98 @@
+"""
+Pool of worker processes sharing a Vosk model
+
+Loading a model takes seconds and gigabytes of memory.
+When processes are started by forking, the model is loaded once in the
+parent process and shared by all the workers (copy-on-write).
+With other start methods ('spawn', 'forkserver'), every worker loads the
+model when it starts.
+
+In both cases, `load_model()` (without argument) returns the shared model
+in the workers, so the transcription functions of `ostilhou.asr.recognizer`
+can be mapped directly:
+
+    with WorkerPool(workers=4) as pool:
+        transcriptions = pool.map(transcribe_segment, segments)
+"""
+
+from typing import List, Iterable, Iterator, Callable, Optional
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+
+from .models import load_model, get_loaded_model_name
+
+
+
+def _init_worker(model_name: Optional[str]):
+    load_model(model_name)
+
+
+
+class WorkerPool:
+    """
+    Pool of processes with a preloaded Vosk model
+
+    Parameters
+    ----------
+        model_name: str
+            Name or path of the model (see `load_model`),
+            the currently loaded model (or the default model) if None
+        workers: int
+            Number of worker processes
+        start_method: str
+            'fork', 'spawn' or 'forkserver',
+            the platform's default method if None
+    """
+
+    def __init__(
+            self,
+            model_name: Optional[str] = None,
+            workers: int = os.cpu_count(),
+            start_method: Optional[str] = None
+        ):
+        if model_name is None:
+            model_name = get_loaded_model_name() or None
+        self.model_name = model_name
+        self.workers = workers
+        context = multiprocessing.get_context(start_method)
+        self.start_method = context.get_start_method()
+
+        if self.start_method == "fork":
+            # Workers inherit the loaded model
+            load_model(model_name)
+            self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        else:
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(model_name,)
+            )
+
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """ Schedule a single call to `fn` """
+        return self._executor.submit(fn, *args)
+
+
+    def imap(self, fn: Callable, items: Iterable, chunksize=1) -> Iterator:
+        """ Apply `fn` to every item, yield the results in order """
+        return self._executor.map(fn, items, chunksize=chunksize)
+
+
+    def map(self, fn: Callable, items: Iterable, chunksize=1) -> List:
+        """ Apply `fn` to every item, return the list of results in order """
+        return list(self.imap(fn, items, chunksize))
+
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,3 +1,6 @@
+from typing import Iterator, Tuple
+from collections import deque
+
 import numpy as np
 
 from ostilhou.audio.ffmpeg import stream_audio_file
@@ -174,3 +177,148 @@ def split_to_segments(
 
     short_segments = [(start / sample_rate, end / sample_rate) for start, end in short_segments]
     return sorted(short_segments)
+
+
+class EnergyVAD:
+    """
+    Voice activity detection on the energy envelope, computed on the fly.
+
+    A frame is considered as speech when its RMS energy is above `threshold_ratio`
+    of the range between the lowest and highest energies seen so far
+    (as in `binary_split`), and above `min_energy`.
+
+    Any object with a `frame_length` attribute (in samples) and an
+    `is_speech(frame)` method, taking normalized float32 samples, can be
+    used as a VAD by `SpeechGate`.
+    """
+
+    def __init__(
+            self,
+            sample_rate=16000,
+            frame_duration=0.03,
+            threshold_ratio=0.1,
+            min_energy=0.003
+        ):
+        self.frame_length = int(frame_duration * sample_rate)
+        self.threshold_ratio = threshold_ratio
+        self.min_energy = min_energy
+        self.reset()
+
+
+    def reset(self) -> None:
+        self._min_e = np.inf
+        self._max_e = 0.0
+
+
+    def is_speech(self, frame: np.ndarray) -> bool:
+        if len(frame) == 0:
+            return False
+        rms = float(np.sqrt(np.mean(np.square(frame, dtype=np.float64))))
+        self._min_e = min(self._min_e, rms)
+        self._max_e = max(self._max_e, rms)
+        thresh = self._min_e + (self._max_e - self._min_e) * self.threshold_ratio
+        return rms >= max(thresh, self.min_energy)
+
+
+    def __repr__(self) -> str:
+        return (f"EnergyVAD(frame_length={self.frame_length}, "
+                f"threshold_ratio={self.threshold_ratio}, min_energy={self.min_energy})")
+
+
+class SpeechGate:
+    """
+    Keep the speech regions of a stream of PCM data (16 bits, mono),
+    as detected frame by frame by a VAD (see `EnergyVAD`).
+
+    Non-speech parts shorter than `min_silence` seconds are kept,
+    and speech regions are extended by `padding` seconds on both sides,
+    so that word boundaries are not cut.
+
+    Usage:
+        gate = SpeechGate(EnergyVAD())
+        for data in stream:
+            for region_start, frame in gate.process(data):
+                ...
+        for region_start, frame in gate.flush():
+            ...
+
+    `region_start` is the start time (in seconds) of the speech region
+    the frame belongs to.
+    """
+
+    def __init__(self, vad, sample_rate=16000, padding=0.3, min_silence=1.0):
+        if hasattr(vad, "reset"):
+            vad.reset()
+        self.vad = vad
+        self.sample_rate = sample_rate
+        self._frame_bytes = vad.frame_length * 2
+        self._padding = max(0, round(padding * sample_rate / vad.frame_length))
+        self._min_silence = max(1, round(min_silence * sample_rate / vad.frame_length))
+        self._buffer = bytearray()
+        self._preroll = deque(maxlen=self._padding)
+        self._silence = []
+        self._region = None
+        self.total_bytes = 0
+        self.speech_bytes = 0
+
+
+    @property
+    def skipped_duration(self) -> float:
+        """ Duration of the audio left out so far, in seconds """
+        return (self.total_bytes - self.speech_bytes) / 2 / self.sample_rate
+
+
+    def _emit(self, frames) -> Iterator[Tuple[float, bytes]]:
+        for _, frame in frames:
+            self.speech_bytes += len(frame)
+            yield self._region, frame
+
+
+    def _process_frame(self, frame: bytes) -> Iterator[Tuple[float, bytes]]:
+        t = self.total_bytes / 2 / self.sample_rate
+        self.total_bytes += len(frame)
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32) / 32768.0
+
+        if self.vad.is_speech(samples):
+            if self._region is None:
+                self._region = self._preroll[0][0] if self._preroll else t
+                frames = list(self._preroll)
+                self._preroll.clear()
+            else:
+                frames = self._silence
+            self._silence = []
+            frames.append((t, frame))
+            yield from self._emit(frames)
+        elif self._region is None:
+            self._preroll.append((t, frame))
+        else:
+            self._silence.append((t, frame))
+            if len(self._silence) >= self._min_silence:
+                yield from self._emit(self._silence[:self._padding])
+                self._preroll.extend(self._silence[self._padding:])
+                self._silence = []
+                self._region = None
+
+
+    def process(self, data: bytes) -> Iterator[Tuple[float, bytes]]:
+        """ Yield the frames of speech regions, as (region start, PCM data) pairs """
+        self._buffer += data
+        n_frames = len(self._buffer) // self._frame_bytes
+        if n_frames == 0:
+            return
+        frames = bytes(self._buffer[:n_frames * self._frame_bytes])
+        del self._buffer[:n_frames * self._frame_bytes]
+        for i in range(0, len(frames), self._frame_bytes):
+            yield from self._process_frame(frames[i:i+self._frame_bytes])
+
+
+    def flush(self) -> Iterator[Tuple[float, bytes]]:
+        """ Process the remaining data at the end of the stream """
+        if len(self._buffer) >= 2:
+            frame = bytes(self._buffer[:len(self._buffer) // 2 * 2])
+            yield from self._process_frame(frame)
+        self._buffer.clear()
+        if self._region is not None:
+            yield from self._emit(self._silence[:self._padding])
+            self._silence = []
+            self._region = None
@@ -0,0 +1,216 @@
+"""
+Fan-out of a decoded audio stream to several consumers
+
+An audio file is decoded once (by ffmpeg) and its PCM chunks (16 bits mono)
+are sent to every registered consumer. Each consumer runs in its own thread
+and reads the chunks from a bounded queue: the decoding waits for the slowest
+consumer, so memory use stays bounded whatever the length of the file.
+
+    hub = StreamHub()
+    hub.add_consumer("samples", collect_samples)
+    hub.add_consumer("peaks", waveform_peaks(0.1))
+    hub.add_consumer("words", transcribe_stream_timecoded)
+    results = hub.run("audio.mp3")
+
+A consumer is a function taking a `ChunkStream` (a readable binary stream
+of raw PCM data, which is also an iterator of chunks) and returning a result.
+"""
+
+from typing import Any, Callable, Dict, Iterator
+import threading
+import queue
+
+import numpy as np
+
+from .ffmpeg import stream_audio_file
+
+
+
+_END = None     # Sentinel sent to the consumers at the end of the stream
+
+
+
+class ChunkStream:
+    """
+    Binary stream of the PCM chunks sent to a consumer
+
+    Chunks can be read as a binary stream (`read`, `readinto`),
+    or iterated over as `bytes` objects.
+    """
+
+    def __init__(self, chunks: queue.Queue, sample_rate: int):
+        self.sample_rate = sample_rate
+        self._chunks = chunks
+        self._pending = memoryview(b'')
+        self._eof = False
+
+
+    def _next_chunk(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._chunks.get()
+        if chunk is _END:
+            self._eof = True
+            return False
+        self._pending = memoryview(chunk)
+        return True
+
+
+    def __iter__(self) -> Iterator[bytes]:
+        if self._pending:
+            chunk, self._pending = bytes(self._pending), memoryview(b'')
+            yield chunk
+        while self._next_chunk():
+            chunk, self._pending = self._pending.obj, memoryview(b'')
+            yield chunk
+
+
+    def readinto(self, buffer) -> int:
+        """ Read the data of a single chunk at most, returns 0 at the end of the stream """
+        if not self._pending and not self._next_chunk():
+            return 0
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+    def read(self, size=-1) -> bytes:
+        """ Read `size` bytes, less at the end of the stream, everything if `size` is negative """
+        parts = []
+        while size < 0 or size > 0:
+            if not self._pending and not self._next_chunk():
+                break
+            n = len(self._pending) if size < 0 else min(size, len(self._pending))
+            parts.append(self._pending[:n])
+            self._pending = self._pending[n:]
+            if size > 0:
+                size -= n
+        return b''.join(parts)
+
+
+
+class _Consumer:
+    def __init__(self, name: str, fn: Callable[[ChunkStream], Any], max_queued: int, sample_rate: int):
+        self.name = name
+        self.fn = fn
+        self.chunks = queue.Queue(maxsize=max_queued)
+        self.stream = ChunkStream(self.chunks, sample_rate)
+        self.result = None
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name=f"StreamHub-{name}", daemon=True)
+
+
+    def _run(self):
+        try:
+            self.result = self.fn(self.stream)
+        except BaseException as e:
+            self.error = e
+        # Keep emptying the queue so that the hub is never blocked
+        # by a consumer that stopped reading
+        while not self.stream._eof:
+            self.stream._next_chunk()
+
+
+
+class StreamHub:
+    """
+    Decode an audio stream once and send its chunks to several consumers
+
+    Parameters
+    ----------
+        sample_rate: int
+            Sample rate of the decoded audio (mono, 16 bits)
+        chunk_size: int
+            Number of bytes read from the decoder at a time
+        max_queued: int
+            Maximum number of chunks waiting in the queue of a consumer
+    """
+
+    def __init__(self, sample_rate=16000, chunk_size=8000, max_queued=32):
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.max_queued = max_queued
+        self.n_bytes = 0
+        self._consumers: Dict[str, Callable[[ChunkStream], Any]] = dict()
+
+
+    def add_consumer(self, name: str, consumer: Callable[[ChunkStream], Any]) -> None:
+        """ Register a function called with a `ChunkStream`, its result is returned by `run` """
+        if name in self._consumers:
+            raise ValueError(f"Consumer '{name}' is already registered")
+        self._consumers[name] = consumer
+
+
+    @property
+    def duration(self) -> float:
+        """ Duration of the last stream, in seconds """
+        return self.n_bytes / (2 * self.sample_rate)
+
+
+    def run(self, source) -> Dict[str, Any]:
+        """
+        Decode an audio file (a path, decoded with ffmpeg) or read a binary
+        stream of raw PCM data, and feed every consumer.
+
+        Returns a dictionary of the consumers' results, by name.
+        The first exception raised by a consumer is raised again.
+        """
+        consumers = [
+            _Consumer(name, fn, self.max_queued, self.sample_rate)
+            for name, fn in self._consumers.items()
+        ]
+        self.n_bytes = 0
+
+        def dispatch(chunk: bytes):
+            self.n_bytes += len(chunk)
+            for consumer in consumers:
+                consumer.chunks.put(chunk)
+
+        for consumer in consumers:
+            consumer.thread.start()
+        try:
+            if isinstance(source, str):
+                stream_audio_file(source, self.sample_rate, dispatch, self.chunk_size)
+            else:
+                while True:
+                    chunk = source.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    dispatch(chunk)
+        finally:
+            for consumer in consumers:
+                consumer.chunks.put(_END)
+            for consumer in consumers:
+                consumer.thread.join()
+
+        for consumer in consumers:
+            if consumer.error is not None:
+                raise consumer.error
+        return { consumer.name: consumer.result for consumer in consumers }
+
+
+
+def collect_samples(stream: ChunkStream) -> np.ndarray:
+    """ Consumer returning the normalized float32 samples of the stream (as `get_samples`) """
+    data = stream.read()
+    return np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+
+def waveform_peaks(window=0.1) -> Callable[[ChunkStream], np.ndarray]:
+    """
+    Consumer of a waveform preview: an array of the minimum and maximum
+    normalized sample values of every window of `window` seconds.
+    """
+    def consumer(stream: ChunkStream) -> np.ndarray:
+        window_size = max(1, int(window * stream.sample_rate)) * 2
+        peaks = []
+        while True:
+            data = stream.read(window_size)
+            if len(data) < 2:
+                break
+            samples = np.frombuffer(data[:len(data) // 2 * 2], dtype=np.int16)
+            peaks.append((samples.min(), samples.max()))
+        return np.array(peaks, dtype=np.float32).reshape(-1, 2) / 32768.0
+    return consumer
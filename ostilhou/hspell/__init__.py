@@ -1,6 +1,9 @@
 import os
 import sys
-from typing import Tuple
+from typing import Tuple, List, Dict, Iterable, Iterator, Optional
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import Executor, ProcessPoolExecutor
 from colorama import Fore
 
 from ..text.tokenizer import (
@@ -19,7 +22,10 @@ hs_aff_path = os.path.join(hspell_root, "hunspell-dictionary", "br_FR.aff")
 
 additional_words = ["add.txt", "add_gwe.txt"]
 
+wordforms_path = os.path.join(hspell_root, "br_FR.wordforms")
+
 _hs = None
+_wordforms = None
 
 
 def get_hunspell_dict():    
@@ -32,16 +38,45 @@ def get_hunspell_dict():
 
     _hs = hunspell.HunSpell(hs_dic_path+".dic", hs_aff_path)
     #hs = hunspell.Hunspell(HS_DIC_PATH) # for cyhunspell
+    for w in iter_additional_words():
+        _hs.add(w)
+    return _hs
+
+
+def iter_additional_words():
+    """ Words added to the Hunspell dictionary, without affixes """
     for path in additional_words:
         HS_ADD_PATH= os.path.join(hspell_root, path)
         with open(HS_ADD_PATH, 'r', encoding='utf-8') as f:
             for w in f.readlines():
-                if not w.startswith('#'):
-                    w = w.split()[0]
-                    _hs.add(w.strip())
+                if w.strip() and not w.startswith('#'):
+                    yield w.split()[0]
     for w in interjections:
-        _hs.add(w)
-    return _hs
+        yield w
+
+
+def get_wordforms():
+    """
+    Load the precompiled set of wordforms (see `scripts/build_hspell_wordforms.py`)
+    """
+    global _wordforms
+    if _wordforms is None:
+        from .wordforms import WordformSet
+        _wordforms = WordformSet(wordforms_path)
+    return _wordforms
+
+
+def get_speller():
+    """
+    Return the object used to check spelling, with a `spell` method:
+    the precompiled wordform set if it has been built,
+    the native Hunspell dictionary otherwise
+    """
+    if _hs is not None:
+        return _hs
+    if _wordforms is not None or os.path.exists(wordforms_path):
+        return get_wordforms()
+    return get_hunspell_dict()
 
 
 def get_hunspell_spylls():    
@@ -58,28 +93,138 @@ def get_hunspell_spylls():
 
 
 
-def get_hspell_mistakes(sentence: str, autocorrected=True) -> Tuple[str, int, set]:
+_SPELL_CACHE_SIZE = 500_000
+_spell_cache: "OrderedDict[str, bool]" = OrderedDict()
+
+
+def _cache_lookup(word: str) -> Optional[bool]:
+    verdict = _spell_cache.get(word)
+    if verdict is not None:
+        _spell_cache.move_to_end(word)
+    return verdict
+
+
+def _cache_store(word: str, verdict: bool) -> None:
+    _spell_cache[word] = verdict
+    if len(_spell_cache) > _SPELL_CACHE_SIZE:
+        _spell_cache.popitem(last=False)
+
+
+def spell(word: str) -> bool:
+    """ Check the spelling of a single word, memoizing the verdict """
+    verdict = _cache_lookup(word)
+    if verdict is None:
+        verdict = bool(get_speller().spell(word))
+        _cache_store(word, verdict)
+    return verdict
+
+
+def clear_spell_cache() -> None:
+    _spell_cache.clear()
+
+
+def _init_spell_worker():
+    # Each worker process loads its own Hunspell instance
+    get_speller()
+
+
+def _spell_words(words: List[str]) -> List[bool]:
+    hs = get_speller()
+    return [ bool(hs.spell(w)) for w in words ]
+
+
+def speller_pool(workers: int) -> ProcessPoolExecutor:
     """
-    Return a string which is a colored correction of the sentence
-    and the number of spelling mistakes in the sentence.
+    Start a pool of spell checking processes, each one with its own Hunspell
+    instance, to be given to `spell_batch` or `get_hspell_mistakes_batch`.
+    Loading a dictionary is slow, so the same pool should be reused
+    for every batch, and shut down when done (it is a context manager).
 
     Parameters
     ----------
-        autocorrect: bool
-            Apply autocorrection before counting errors
+        workers: int
+            Number of processes in the pool
     """
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_spell_worker)
+
 
-    hs = get_hunspell_dict()
+def spell_batch(
+        words: Iterable[str],
+        workers=1,
+        chunk_size=2000,
+        executor: Optional[Executor] = None
+    ) -> Dict[str, bool]:
+    """
+    Check the spelling of many words at once.
+    Each unique word is checked only once, and verdicts are memoized
+    between calls.
 
+    Parameters
+    ----------
+        workers: int
+            Number of processes to spread the unknown words over,
+            each one with its own Hunspell instance.
+            Ignored when an executor is given
+        chunk_size: int
+            Number of words sent to a worker at a time
+        executor: Executor
+            Pool of workers to check the unknown words with (see `speller_pool`),
+            kept running after the call
+    
+    Returns a dictionary of words to spelling verdicts
+    """
+
+    verdicts = dict()
+    unknown = []
+    for word in words:
+        if word in verdicts:
+            continue
+        verdict = _cache_lookup(word)
+        verdicts[word] = verdict
+        if verdict is None:
+            unknown.append(word)
+
+    if (executor is not None or workers > 1) and len(unknown) > chunk_size:
+        chunks = [ unknown[i:i+chunk_size] for i in range(0, len(unknown), chunk_size) ]
+        # A pool given by the caller is left running for its next batches
+        with nullcontext(executor) if executor is not None else speller_pool(workers) as pool:
+            results = [ v for chunk_verdicts in pool.map(_spell_words, chunks) for v in chunk_verdicts ]
+    else:
+        results = _spell_words(unknown)
+    
+    for word, verdict in zip(unknown, results):
+        verdicts[word] = verdict
+        _cache_store(word, verdict)
+    
+    return verdicts
+
+
+
+def _words_to_check(tokens: List[Token]) -> Iterator[str]:
+    """ Words of a tokenized sentence that must be checked by Hunspell """
+    for tok in tokens:
+        if tok.type == TokenType.WORD:
+            if Flag.INCLUSIVE in tok.flags:
+                head, *_ = tok.data.split('·')
+                yield head
+            elif Flag.CORRECTED in tok.flags:
+                continue
+            elif tok.data.lower() in lexicon_sub:
+                continue
+            else:
+                yield tok.data
+
+
+def _color_mistakes(tokens: List[Token], verdicts: Dict[str, bool]) -> Tuple[str, int, set]:
     mistakes = set()
     n_mistakes = 0
     colored_tokens = []
 
-    for tok in tokenize(sentence, autocorrect=autocorrected):
+    for tok in tokens:
         if tok.type == TokenType.WORD:
             if Flag.INCLUSIVE in tok.flags:
                 head, *_ = tok.data.split('·')
-                if not hs.spell(head):
+                if not verdicts[head]:
                     mistakes.add(head)
                     n_mistakes += 1
                     tok.data = Fore.RED + tok.data + Fore.RESET
@@ -87,7 +232,7 @@ def get_hspell_mistakes(sentence: str, autocorrected=True) -> Tuple[str, int, se
                 tok.data = Fore.YELLOW + tok.data + Fore.RESET
             elif tok.data.lower() in lexicon_sub:
                 tok.data = Fore.YELLOW + tok.data + Fore.RESET
-            elif not hs.spell(tok.data):
+            elif not verdicts[tok.data]:
                 mistakes.add(tok.data)
                 n_mistakes += 1
                 tok.data = Fore.RED + tok.data + Fore.RESET
@@ -111,4 +256,56 @@ def get_hspell_mistakes(sentence: str, autocorrected=True) -> Tuple[str, int, se
             n_mistakes += 1
         colored_tokens.append(tok)
     
-    return detokenize(colored_tokens), n_mistakes, mistakes
\ No newline at end of file
+    return detokenize(colored_tokens), n_mistakes, mistakes
+
+
+
+def get_hspell_mistakes(sentence: str, autocorrected=True) -> Tuple[str, int, set]:
+    """
+    Return a string which is a colored correction of the sentence
+    and the number of spelling mistakes in the sentence.
+
+    Parameters
+    ----------
+        autocorrect: bool
+            Apply autocorrection before counting errors
+    """
+
+    tokens = list(tokenize(sentence, autocorrect=autocorrected))
+    verdicts = { word: spell(word) for word in _words_to_check(tokens) }
+    return _color_mistakes(tokens, verdicts)
+
+
+
+def get_hspell_mistakes_batch(
+        sentences: Iterable[str],
+        autocorrected=True,
+        workers=1,
+        executor: Optional[Executor] = None
+    ) -> List[Tuple[str, int, set]]:
+    """
+    Same as `get_hspell_mistakes`, for many sentences at once.
+    Words are deduplicated across the whole batch, so that the spell checking
+    cost depends on the number of unique words rather than the total number
+    of words.
+
+    Parameters
+    ----------
+        autocorrect: bool
+            Apply autocorrection before counting errors
+        workers: int
+            Number of processes used to check the unique words
+        executor: Executor
+            Pool of spell checking processes reused between calls (see `speller_pool`)
+    
+    Returns a list of (colored sentence, number of mistakes, mistakes),
+    in the same order as the given sentences
+    """
+
+    tokenized = [ list(tokenize(s, autocorrect=autocorrected)) for s in sentences ]
+    verdicts = spell_batch(
+        (word for tokens in tokenized for word in _words_to_check(tokens)),
+        workers=workers,
+        executor=executor
+    )
+    return [ _color_mistakes(tokens, verdicts) for tokens in tokenized ]
@@ -0,0 +1,292 @@
+"""
+Precompiled set of all the wordforms accepted by a Hunspell dictionary
+
+The affix rules of the dictionary are expanded offline (see
+`scripts/build_hspell_wordforms.py`) and the resulting wordforms are stored
+in a binary file holding the sorted wordforms and a hash table.
+At runtime the file is memory-mapped, so checking a word is a constant-time
+lookup, with no native dependency.
+
+File layout (little-endian uint32 integers):
+    magic, version, number of wordforms, number of hash slots
+    offsets of the wordforms in the blob (number of wordforms + 1)
+    hash slots (0 for an empty slot, wordform index + 1 otherwise)
+    blob of UTF-8 encoded wordforms, in sorted order
+"""
+
+from typing import List, Dict, Iterable, Iterator, Tuple, Optional
+import os
+import re
+import mmap
+import zlib
+
+import numpy as np
+
+
+
+_MAGIC = 0x46575348  # "HSWF"
+_VERSION = 1
+_HEADER_SIZE = 16
+
+_NUMBER_PATTERN = re.compile(r"[0-9]+([.,-][0-9]+)*")
+
+
+
+def _parse_flags(flags: str, flag_type: str) -> List[str]:
+    if flag_type == "long":
+        return [ flags[i:i+2] for i in range(0, len(flags), 2) ]
+    if flag_type == "num":
+        return flags.split(',')
+    return list(flags)
+
+
+def _condition_to_regex(condition: str, suffix: bool) -> Optional[re.Pattern]:
+    """ Convert a Hunspell affix condition to a regular expression """
+    if condition == '.':
+        return None
+    parts = []
+    i = 0
+    while i < len(condition):
+        c = condition[i]
+        if c == '[':
+            j = condition.index(']', i)
+            group = condition[i+1:j]
+            if group.startswith('^'):
+                parts.append("[^" + re.escape(group[1:]) + ']')
+            else:
+                parts.append('[' + re.escape(group) + ']')
+            i = j + 1
+            continue
+        parts.append('.' if c == '.' else re.escape(c))
+        i += 1
+    pattern = ''.join(parts)
+    return re.compile(pattern + '$' if suffix else '^' + pattern)
+
+
+
+class _AffixRule:
+    __slots__ = ("strip", "add", "condition", "suffix")
+
+    def __init__(self, strip: str, add: str, condition: str, suffix: bool):
+        self.strip = '' if strip == '0' else strip
+        # Continuation classes (after a '/') are not supported
+        add = add.split('/')[0]
+        self.add = '' if add == '0' else add
+        self.condition = _condition_to_regex(condition, suffix)
+        self.suffix = suffix
+
+    def matches(self, word: str) -> bool:
+        if self.suffix and not word.endswith(self.strip):
+            return False
+        if not self.suffix and not word.startswith(self.strip):
+            return False
+        return self.condition is None or self.condition.search(word) is not None
+
+    def apply(self, word: str) -> str:
+        if self.suffix:
+            return word[:len(word)-len(self.strip)] + self.add
+        return self.add + word[len(self.strip):]
+
+
+
+def load_affixes(aff_path: str) -> Tuple[str, Dict[str, Tuple[bool, bool, List[_AffixRule]]]]:
+    """
+    Parse the prefix and suffix rules of a Hunspell affix file
+
+    Returns the flag type and a dictionary of affix flags to
+    (is_suffix, cross_product, rules)
+    """
+    flag_type = "char"
+    affixes = dict()
+    with open(aff_path, 'r', encoding='utf-8') as f:
+        for line in f.readlines():
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if fields[0] == "FLAG":
+                flag_type = fields[1]
+            elif fields[0] in ("PFX", "SFX"):
+                suffix = fields[0] == "SFX"
+                flag = fields[1]
+                if flag not in affixes:
+                    # Header line
+                    affixes[flag] = (suffix, fields[2] == 'Y', [])
+                else:
+                    strip, add = fields[2], fields[3]
+                    condition = fields[4] if len(fields) > 4 else '.'
+                    affixes[flag][2].append(_AffixRule(strip, add, condition, suffix))
+    return flag_type, affixes
+
+
+
+def expand_hunspell_dictionary(dic_path: str, aff_path: str) -> Iterator[str]:
+    """
+    Generate every wordform of a Hunspell dictionary (with duplicates),
+    by applying the affix rules to each stem
+    """
+    flag_type, affixes = load_affixes(aff_path)
+
+    with open(dic_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    for line in lines[1:]:   # First line is the number of entries
+        fields = line.split()
+        if not fields:
+            continue
+        entry = fields[0]
+        slash = entry.find('/')
+        while slash > 0 and entry[slash-1] == '\\':
+            slash = entry.find('/', slash + 1)
+        if slash > 0:
+            word, flags = entry[:slash], _parse_flags(entry[slash+1:], flag_type)
+        else:
+            word, flags = entry, []
+        word = word.replace("\\/", '/')
+        yield word
+
+        prefixes = []
+        suffixed = []
+        for flag in flags:
+            if flag not in affixes:
+                continue
+            is_suffix, cross, rules = affixes[flag]
+            for rule in rules:
+                if not rule.matches(word):
+                    continue
+                form = rule.apply(word)
+                yield form
+                if cross:
+                    (suffixed if is_suffix else prefixes).append((rule, form))
+
+        # Cross products, prefix conditions apply to the stem
+        for prefix, _ in prefixes:
+            for _, form in suffixed:
+                if form.startswith(prefix.strip):
+                    yield prefix.apply(form)
+
+
+
+def write_wordforms(wordforms: Iterable[str], path: str) -> int:
+    """
+    Write a set of wordforms to a binary file, to be used with `WordformSet`
+    Returns the number of unique wordforms written
+    """
+    encoded = sorted({ w.encode("utf-8") for w in wordforms if w })
+    n = len(encoded)
+    n_slots = 1
+    while n_slots < 2 * n:
+        n_slots *= 2
+
+    offsets = np.zeros(n + 1, dtype="<u4")
+    np.cumsum([ len(w) for w in encoded ], out=offsets[1:])
+
+    # Open addressing with linear probing
+    slots = [0] * n_slots
+    mask = n_slots - 1
+    for i, w in enumerate(encoded):
+        h = zlib.crc32(w) & mask
+        while slots[h]:
+            h = (h + 1) & mask
+        slots[h] = i + 1
+    slots = np.array(slots, dtype="<u4")
+
+    header = np.array([_MAGIC, _VERSION, n, n_slots], dtype="<u4")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.tobytes())
+        f.write(offsets.tobytes())
+        f.write(slots.tobytes())
+        f.write(b''.join(encoded))
+    os.replace(tmp_path, path)
+    return n
+
+
+
+class WordformSet:
+    """
+    Memory-mapped set of wordforms, written by `write_wordforms`
+
+    The `spell` method follows Hunspell's verdicts regarding
+    capitalization, numbers, hyphenated words and trailing dots.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n, n_slots = np.frombuffer(self._mm, dtype="<u4", count=4).tolist()
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not a valid wordform file")
+        self._n = int(n)
+        self._mask = int(n_slots) - 1
+        self._offsets = np.frombuffer(self._mm, dtype="<u4", count=n+1, offset=_HEADER_SIZE)
+        self._slots = np.frombuffer(
+            self._mm, dtype="<u4", count=n_slots, offset=_HEADER_SIZE + 4*(n+1)
+        )
+        self._blob_start = _HEADER_SIZE + 4*(n+1) + 4*n_slots
+
+
+    def _get(self, i: int) -> bytes:
+        start = self._blob_start + int(self._offsets[i])
+        end = self._blob_start + int(self._offsets[i+1])
+        return self._mm[start:end]
+
+
+    def __contains__(self, word: str) -> bool:
+        encoded = word.encode("utf-8")
+        h = zlib.crc32(encoded) & self._mask
+        while True:
+            slot = int(self._slots[h])
+            if slot == 0:
+                return False
+            if self._get(slot - 1) == encoded:
+                return True
+            h = (h + 1) & self._mask
+
+
+    def __len__(self) -> int:
+        return self._n
+
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self._n):
+            yield self._get(i).decode("utf-8")
+
+
+    def _spell_cased(self, word: str) -> bool:
+        if word in self:
+            return True
+        if word[:1].isupper():
+            if word[1:].islower() or not any(c.isalpha() for c in word[1:]):
+                # Capitalized word
+                return word.lower() in self
+            if word.isupper():
+                # All-caps word
+                lowered = word.lower()
+                return lowered in self or lowered.capitalize() in self
+        return False
+
+
+    def spell(self, word: str) -> bool:
+        if not word:
+            return True
+        if _NUMBER_PATTERN.fullmatch(word):
+            return True
+        if self._spell_cased(word):
+            return True
+        if word.endswith('.'):
+            stripped = word.rstrip('.')
+            if stripped and (self._spell_cased(stripped) or self._spell_cased(stripped + '.')):
+                return True
+        if '-' in word:
+            # Hunspell's default word breaking at hyphens
+            parts = [ part for part in word.split('-') if part ]
+            return len(parts) > 0 and all( self.spell(part) for part in parts )
+        return False
+
+
+    def close(self) -> None:
+        # Arrays must be released before unmapping the file
+        del self._offsets
+        del self._slots
+        self._mm.close()
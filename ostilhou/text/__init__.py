@@ -9,6 +9,7 @@ from .tokenizer import (
 )
 from .normalizer import normalize, normalize_sentence
 from .inverse_normalizer import inverse_normalize_sentence, inverse_normalize_timecoded
+from .timecoded import TimecodedWords
 from .utils import (
     strip_punct, filter_out_chars, filter_in_chars, capitalize, pre_process,
     extract_parenthesis_content, sentence_stats,
@@ -1,5 +1,6 @@
-from typing import List
+from typing import List, Union
 from .definitions import is_noun
+from .timecoded import TimecodedWords
 
 
 
@@ -82,6 +83,29 @@ numtok_chain = {
 
 
 
+_numerical_words = set(token_value).union(numtok_chain, *numtok_chain.values())
+
+
+def breaks_number_chain(word: str, previous: str = None) -> bool:
+    """ Returns True if a chain of words describing a number can't go
+        through or past this word, so that `inverse_normalize_timecoded`
+        treats everything up to it independently of the following words
+
+        A noun is part of a chain only after a number word ("tri den"),
+        it breaks the chain when the `previous` word can't be followed by a noun.
+    """
+    if word in _numerical_words or word == '%':
+        return False
+    if word.endswith("-ugent") or word == "hanter-kant":
+        return False
+    if is_noun(word):
+        return previous is not None and not (
+            '*' in numtok_chain.get(previous, ()) or previous.endswith("-ugent") or previous == "hanter-kant"
+        )
+    return True
+
+
+
 def solve_num_tokens(numerical_tokens: List[float]) -> float:
     # Token 0.5 ("hanter") takes precedence and is applied to next closest token
     while 0.5 in numerical_tokens:
@@ -222,11 +246,17 @@ def inverse_normalize_sentence(sentence: str, min_num=5) -> str:
 
 
 
-def inverse_normalize_timecoded(tokens: List[dict], min_num=5) -> List[dict]:
+def inverse_normalize_timecoded(
+        tokens: Union[List[dict], TimecodedWords],
+        min_num=5
+    ) -> Union[List[dict], TimecodedWords]:
     """ Translate spelled numbers to more readable numbers
         Same functionality as the function `inverse_normalise_sentence` but
         works with vosk token (embedding timecodes and confidence values)
 
+        Accepts either a list of Vosk tokens or a `TimecodedWords` object,
+        and returns the same type.
+
         Parameter
         ---------
             min_num (int):
@@ -236,114 +266,136 @@ def inverse_normalize_timecoded(tokens: List[dict], min_num=5) -> List[dict]:
     def flush_number():
         nonlocal num_tokens
         nonlocal noun
-        num = solve_num_tokens( [token_value[t["word"]] for t in num_tokens] )
+        num = solve_num_tokens( [token_value[words[i]] for i in num_tokens] )
         if num >= min_num:
             # Create a new token for this number
-            t_start = num_tokens[0]["start"]
-            t_end = num_tokens[-1]["end"]
-            word = str(int(num))
-            vosk_token = {"word": word, "start": t_start, "end": t_end, "conf": 1.0}
-            translated.append(vosk_token)
+            out_words.append(str(int(num)))
+            out_start.append(start[num_tokens[0]])
+            out_end.append(end[num_tokens[-1]])
+            out_conf.append(1.0)
         else:
-            translated.extend(num_tokens)
-        if noun:
-            if noun["start"] < translated[-1]["end"]:
+            for i in num_tokens:
+                out_words.append(words[i])
+                out_start.append(start[i])
+                out_end.append(end[i])
+                out_conf.append(conf[i])
+        if noun is not None:
+            noun_start, noun_end = start[noun], end[noun]
+            if noun_start < out_end[-1]:
                 # Order of tokens has been changed, correct timecodes
-                dur = noun["end"] - noun["start"]
-                translated[-1]["end"] -= dur
-                noun["start"] = translated[-1]["end"]
-                noun["end"] = noun["start"] + dur
-            translated.append(noun)
+                dur = noun_end - noun_start
+                out_end[-1] -= dur
+                noun_start = out_end[-1]
+                noun_end = noun_start + dur
+            out_words.append(words[noun])
+            out_start.append(noun_start)
+            out_end.append(noun_end)
+            out_conf.append(conf[noun])
             noun = None
         num_tokens = []
     
+    def append_token(i: int):
+        out_words.append(words[i])
+        out_start.append(start[i])
+        out_end.append(end[i])
+        out_conf.append(conf[i])
+
+
+    columnar = isinstance(tokens, TimecodedWords)
+    tokens = TimecodedWords.from_vosk(tokens)
 
     # Start by splitting numerical words containing hyphens
-    parsed_tokens = []
-    for tok in tokens:
-        word = tok["word"]
+    words, start, end, conf = [], [], [], []
+    for word, t_start, t_end, t_conf in zip(
+            tokens.words,
+            tokens.start.tolist(),
+            tokens.end.tolist(),
+            tokens.conf.tolist()
+        ):
         if word.endswith("-ugent") or word == "hanter-kant":
             w1, w2 = word.split('-')
-            t_start = tok["start"]
-            t_end = tok["end"]
             dur = (t_end - t_start) / 2
-            t1 = {"word": w1, "start": t_start, "end": t_start+dur, "conf": tok["conf"]}
-            t2 = {"word": w2, "start": t_start+dur, "end": t_end, "conf": tok["conf"]}
-            parsed_tokens.append(t1)
-            parsed_tokens.append(t2)
+            words.extend((w1, w2))
+            start.extend((t_start, t_start+dur))
+            end.extend((t_start+dur, t_end))
+            conf.extend((t_conf, t_conf))
         else:
-            parsed_tokens.append(tok)
-    tokens = parsed_tokens
+            words.append(word)
+            start.append(t_start)
+            end.append(t_end)
+            conf.append(t_conf)
 
 
+    # Tokens are referred to by their index in the columns
     starters = numtok_chain['[']
     num_tokens = []
-    translated = []
+    out_words, out_start, out_end, out_conf = [], [], [], []
     in_chain = False
     noun = None
-    for idx, tok in enumerate(tokens):
-        if not in_chain and tok["word"] in starters:
+    for idx, word in enumerate(words):
+        if not in_chain and word in starters:
             # Beginning of a chain of words describing a number
             in_chain = True
-            num_tokens = [tok]
+            num_tokens = [idx]
 
         elif in_chain:
-            prev = num_tokens[-1]["word"]
-            if tok["word"] in numtok_chain[prev]:
+            prev = words[num_tokens[-1]]
+            if word in numtok_chain[prev]:
                 # Follow the chain of words describing a number
-                num_tokens.append(tok)
+                num_tokens.append(idx)
             
-            elif tok["word"] in starters:
+            elif word in starters:
                 # Could be the beginning of a new chain
                 # Check for ill-formed numerical sequences
                 if ']' not in numtok_chain[prev]:
                     # treat as 2 numerical sequence in that case
                     # rewind and flush the first part
                     i = len(num_tokens)-1
-                    while i >= 0 and num_tokens[i]["word"] not in ("ha", "hag"):
+                    while i >= 0 and words[num_tokens[i]] not in ("ha", "hag"):
                         i -= 1
                     next_num_tokens = num_tokens[i+1:]
                     conj = num_tokens[i]
                     num_tokens = num_tokens[:i]
                     flush_number()
-                    translated.append(conj)
-                    num_tokens = next_num_tokens + [tok]
+                    append_token(conj)
+                    num_tokens = next_num_tokens + [idx]
                 else:
                     flush_number()
-                    num_tokens = [tok]
+                    num_tokens = [idx]
             
-            elif  '*' in numtok_chain[prev] and is_noun(tok["word"]) or tok["word"] in ('%',):
-                if noun:
+            elif  '*' in numtok_chain[prev] and is_noun(word) or word in ('%',):
+                if noun is not None:
                     # There could be an ambiguity if another noun has already been found
                     # ex: "tri kazh ha daou besk"
                     # In that case, flush the first part
                     i = len(num_tokens)-1
-                    while i >= 0 and num_tokens[i]["word"] not in ("ha", "hag"):
+                    while i >= 0 and words[num_tokens[i]] not in ("ha", "hag"):
                         i -= 1
                     next_num_tokens = num_tokens[i+1:]
                     conj = num_tokens[i]
                     num_tokens = num_tokens[:i]
                     flush_number()
-                    translated.append(conj)
+                    append_token(conj)
                     num_tokens = next_num_tokens
-                    noun = tok
-                elif len(tokens) > idx+1 and tokens[idx+1]["word"] in ('ha', 'hag', 'warn'):
-                    noun = tok
+                    noun = idx
+                elif len(words) > idx+1 and words[idx+1] in ('ha', 'hag', 'warn'):
+                    noun = idx
                 else:
                     # final noun
-                    noun = tok
+                    noun = idx
                     flush_number()
                     in_chain = False
             
             else:
                 flush_number()
-                translated.append(tok)
+                append_token(idx)
                 in_chain = False
 
         else:
-            translated.append(tok)
+            append_token(idx)
     
     if in_chain:
         flush_number()
 
-    return translated
+    translated = TimecodedWords(out_words, out_start, out_end, out_conf)
+    return translated if columnar else translated.to_vosk()
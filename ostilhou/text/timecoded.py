@@ -0,0 +1,173 @@
+"""
+Columnar representation of Vosk timecoded words
+
+Vosk results are lists of tokens of the form:
+    {'word': str, 'start': float, 'end': float, 'conf': float}
+
+A `TimecodedWords` object stores the same information column-wise:
+a list of words and three NumPy arrays for the start times, end times
+and confidence scores.
+"""
+
+from typing import List, Iterator, Iterable, Union
+import json
+
+import numpy as np
+
+
+
+def _as_column(values, size: int, default: float) -> np.ndarray:
+    if values is None:
+        return np.full(size, default, dtype=np.float64)
+    return np.asarray(values, dtype=np.float64)
+
+
+
+class TimecodedWords:
+    """
+    A sequence of timecoded words
+
+    Attributes
+    ----------
+        words (list of str)
+        start (np.ndarray): start times, in seconds
+        end (np.ndarray): end times, in seconds
+        conf (np.ndarray): normalized confidence scores
+
+    Slicing returns a new `TimecodedWords` whose arrays are views
+    on the original arrays.
+    Indexing with an integer or iterating returns Vosk tokens (dicts),
+    for compatibility with code expecting the Vosk format.
+    """
+
+    __slots__ = ("words", "start", "end", "conf")
+
+    def __init__(self, words=None, start=None, end=None, conf=None):
+        self.words: List[str] = list(words) if words is not None else []
+        n = len(self.words)
+        self.start = _as_column(start, n, 0.0)
+        self.end = _as_column(end, n, 0.0)
+        self.conf = _as_column(conf, n, 1.0)
+        if not (len(self.start) == len(self.end) == len(self.conf) == n):
+            raise ValueError("All columns must have the same length")
+
+
+    @classmethod
+    def _from_columns(cls, words: List[str], start, end, conf) -> "TimecodedWords":
+        # No copy nor validation, for internal use
+        obj = cls.__new__(cls)
+        obj.words = words
+        obj.start = start
+        obj.end = end
+        obj.conf = conf
+        return obj
+
+
+    @classmethod
+    def from_vosk(cls, tokens: Union[List[dict], "TimecodedWords"]) -> "TimecodedWords":
+        """ Build from a list of Vosk tokens (dicts) """
+        if isinstance(tokens, TimecodedWords):
+            return tokens
+        n = len(tokens)
+        return cls._from_columns(
+            [ t["word"] for t in tokens ],
+            np.fromiter((t["start"] for t in tokens), dtype=np.float64, count=n),
+            np.fromiter((t["end"] for t in tokens), dtype=np.float64, count=n),
+            np.fromiter((t.get("conf", 1.0) for t in tokens), dtype=np.float64, count=n),
+        )
+
+
+    @classmethod
+    def from_result(cls, result: Union[str, dict]) -> "TimecodedWords":
+        """ Build from a Vosk JSON result (`Result()` or `FinalResult()`) """
+        if isinstance(result, str):
+            result = json.loads(result)
+        return cls.from_vosk(result.get("result", []))
+
+
+    @classmethod
+    def concat(cls, parts: Iterable["TimecodedWords"]) -> "TimecodedWords":
+        """ Concatenate many `TimecodedWords` into a new one """
+        parts = [ cls.from_vosk(p) for p in parts ]
+        if not parts:
+            return cls()
+        words = []
+        for p in parts:
+            words.extend(p.words)
+        return cls._from_columns(
+            words,
+            np.concatenate([ p.start for p in parts ]),
+            np.concatenate([ p.end for p in parts ]),
+            np.concatenate([ p.conf for p in parts ]),
+        )
+
+
+    def to_vosk(self) -> List[dict]:
+        """ Convert back to a list of Vosk tokens (dicts) """
+        return [
+            {"word": w, "start": s, "end": e, "conf": c}
+            for w, s, e, c in zip(
+                self.words, self.start.tolist(), self.end.tolist(), self.conf.tolist()
+            )
+        ]
+
+
+    def take(self, indices) -> "TimecodedWords":
+        """ Return a new `TimecodedWords` with the words at the given indices """
+        indices = np.asarray(indices, dtype=np.intp)
+        return TimecodedWords._from_columns(
+            [ self.words[i] for i in indices.tolist() ],
+            self.start[indices],
+            self.end[indices],
+            self.conf[indices],
+        )
+
+
+    @property
+    def text(self) -> str:
+        return ' '.join(self.words)
+
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return TimecodedWords._from_columns(
+                self.words[key],
+                self.start[key],
+                self.end[key],
+                self.conf[key],
+            )
+        return {
+            "word": self.words[key],
+            "start": float(self.start[key]),
+            "end": float(self.end[key]),
+            "conf": float(self.conf[key]),
+        }
+
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self.to_vosk())
+
+
+    def __add__(self, other) -> "TimecodedWords":
+        return TimecodedWords.concat([self, other])
+
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, list):
+            other = TimecodedWords.from_vosk(other)
+        if not isinstance(other, TimecodedWords):
+            return NotImplemented
+        return (
+            self.words == other.words
+            and np.array_equal(self.start, other.start)
+            and np.array_equal(self.end, other.end)
+            and np.array_equal(self.conf, other.conf)
+        )
+
+
+    def __repr__(self) -> str:
+        return f"TimecodedWords({len(self)} words: {self.text[:50]!r})"
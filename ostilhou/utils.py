@@ -1,10 +1,33 @@
 from typing import Union, List
 import os
+import platform
 
 from colorama import Fore
 
 
 
+def get_cache_directory(*subfolders: str) -> str:
+    """
+    Return the cache directory of the anaouder tools (models, lexicons,
+    transcriptions...), or one of its subfolders, creating it if needed.
+    The base directory is `XDG_CACHE_HOME` if set, the platform's default
+    cache directory otherwise.
+    """
+    if platform.system() in ("Linux", "Darwin"):
+        default = os.path.join(os.path.expanduser("~"), ".cache")
+    elif platform.system() == "Windows":
+        default = os.getenv("LOCALAPPDATA")
+    else:
+        raise OSError("Unsupported operating system")
+    cache_dir = os.path.join(os.getenv("XDG_CACHE_HOME", default), "anaouder", *subfolders)
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    return cache_dir
+
+
+
 def green(s:str) -> str:
     return Fore.GREEN + s + Fore.RESET
 
@@ -6,8 +6,10 @@ Score every utterance of every data item in a given TSV file
 
 The "all" dataset (for training) is made of "train.tsv", "other.tsv" and "invalidated.tsv"
 
+Clips are transcribed in batches by a pool of decoding processes (see `iter_transcribe_files`)
+
 Usage:
-    $ ./score_cv_utterances.py dataset.tsv
+    $ ./score_cv_utterances.py dataset.tsv [-j WORKERS] [--batch-size 32]
 """
 
 
@@ -18,7 +20,9 @@ import os
 from ostilhou.utils import list_files_with_extension
 from ostilhou.text import pre_process, filter_out_chars, normalize_sentence, PUNCTUATION
 from ostilhou.asr import load_segments_data, load_text_data
-from ostilhou.asr.recognizer import transcribe_file, load_model
+from ostilhou.asr.recognizer import load_model
+from ostilhou.asr.batch import iter_transcribe_files
+from ostilhou.asr.transcription_cache import enable_transcription_cache
 from ostilhou.audio import load_audiofile, get_audio_segment
 from jiwer import wer, cer
 
@@ -30,6 +34,9 @@ if __name__ == "__main__":
     parser.add_argument("-m", "--model", help="Specify a VOSK model")
     parser.add_argument("-v", "--mcv-version", help="Version of Mozilla Common Voice", type=int)
     # parser.add_argument("-he", "--higher", help="Keeps only over a given CER", default=1.0)
+    parser.add_argument("--cache", help="Reuse the transcriptions of previously decoded clips", action="store_true")
+    parser.add_argument("-j", "--workers", help="Number of decoding processes", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", help="Number of clips sent to a decoding process at a time", type=int, default=32)
     args = parser.parse_args()
 
     all_references = []
@@ -52,6 +59,11 @@ if __name__ == "__main__":
     n_dup = 0
     
     load_model(args.model)
+    if args.cache:
+        enable_transcription_cache()
+
+    clips = []
+    references = []
 
     # print(args.data_folder)
     for tsv_file in args.tsv_files:
@@ -87,15 +99,21 @@ if __name__ == "__main__":
             text_gt = normalize_sentence(text_gt, autocorrect=True)
             text_gt = pre_process(text_gt).replace('-', ' ').lower()
             
-            text_hyp = ' '.join(transcribe_file(clip_full_path))
-            text_hyp = text_hyp.replace('-', ' ').lower()
-            
-            score_wer = wer(text_gt, text_hyp)
-            score_cer = cer(text_gt, text_hyp)
-            
-            print(f"{clip_path}\t{score_wer:0.3}\t{score_cer:0.3}\t{text_gt}\t{text_hyp}")
-            
+            clips.append(clip_full_path)
+            references.append((clip_path, text_gt))
             already_seen.add(clip_path)
     
+    results = iter_transcribe_files(clips, args.workers, args.batch_size, args.model)
+    for (clip_path, text_gt), result in zip(references, results):
+        if result["error"]:
+            print(f"{clip_path}: {result['error']}", file=sys.stderr)
+        text_hyp = ' '.join(result["text"])
+        text_hyp = text_hyp.replace('-', ' ').lower()
+        
+        score_wer = wer(text_gt, text_hyp)
+        score_cer = cer(text_gt, text_hyp)
+        
+        print(f"{clip_path}\t{score_wer:0.3}\t{score_cer:0.3}\t{text_gt}\t{text_hyp}")
+    
     print(f"Number of blacklisted sentences found: {n_bl}", file=sys.stderr)
     print(f"Number of duplicate sentences found: {n_dup}", file=sys.stderr)
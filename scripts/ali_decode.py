@@ -36,6 +36,7 @@ from ostilhou.text import (
 )
 from ostilhou.asr.models import load_model, get_loaded_model_name
 from ostilhou.asr.recognizer import transcribe_segment
+from ostilhou.asr.transcription_cache import enable_transcription_cache
 from ostilhou.asr.dataset import format_timecode, read_ali_file
 from ostilhou.audio import (
     load_audiofile, get_audio_segment,
@@ -55,9 +56,13 @@ if __name__ == "__main__":
     parser.add_argument("-o", "--output", type=str, help="Results file")
     parser.add_argument("--noise", type=float, help="Add white noise to audio (dB)")
     parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--cache", action="store_true",
+        help="Reuse the transcriptions of previously decoded segments")
     args = parser.parse_args()
     
     load_model(args.model)
+    if args.cache:
+        enable_transcription_cache()
 
     if os.path.isdir(args.data_folder):
         ali_files = list_files_with_extension('ali', args.data_folder)
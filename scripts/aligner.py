@@ -22,7 +22,7 @@ import os.path
 import json
 
 from ostilhou.asr.aligner import (
-    align,
+    align, transcribe_file_constrained,
     add_reliability_score,
     resolve_boundaries,
     get_prev_word_idx, get_next_word_idx,
@@ -31,6 +31,8 @@ from ostilhou.asr.aligner import (
 )
 from ostilhou.asr.recognizer import transcribe_file_timecoded
 from ostilhou.asr.models import load_model
+from ostilhou.asr.transcription_cache import enable_transcription_cache
+from ostilhou.asr.metrics import MemorySink, add_metrics_sink, remove_metrics_sink
 from ostilhou.asr.dataset import format_timecode, METADATA_PATTERN, extract_metadata
 from ostilhou.text import split_sentences, sentence_stats, normalize_sentence
 from ostilhou.utils import read_file_drop_comments
@@ -152,6 +154,12 @@ def get_args():
         help="Don't output ill-aligned sentences")
     parser.add_argument("--force-timecodes", action="store_true",
         help="Outputs the time segment to ill-aligned utterances")
+    parser.add_argument("--cache", action="store_true",
+        help="Reuse the transcription of a previously decoded audio file")
+    parser.add_argument("-c", "--constrained", action="store_true",
+        help="Decode the audio with the vocabulary of the expected sentences only (faster)")
+    parser.add_argument("--vad", action="store_true",
+        help="Don't decode long silences (faster on recordings with long pauses)")
 
     return parser.parse_args()
 
@@ -179,7 +187,8 @@ if __name__ == "__main__":
     # To reinsert them after the alignment
     # (the aligner cannot match unpronunciable text)
 
-    json_path = os.path.splitext(args.output)[0] + ".json" # caching transcript
+    json_path = os.path.splitext(args.output)[0] # caching transcript
+    json_path += ".constrained.json" if args.constrained else ".json"
     if os.path.exists(json_path):
         print("Reading transcript from cache")
         with open(json_path, 'r') as _f:
@@ -187,7 +196,21 @@ if __name__ == "__main__":
     else:
         load_model(args.model)
         print(f"Transcribing...", file=sys.stderr)
-        hyp = transcribe_file_timecoded(args.audio_file)
+        if args.constrained:
+            hyp = transcribe_file_constrained(
+                args.audio_file, lines, progress_bar=SHOW_PROGRESS_BAR
+            )
+        else:
+            if args.cache:
+                enable_transcription_cache()
+            if args.vad:
+                sink = add_metrics_sink(MemorySink())
+            hyp = transcribe_file_timecoded(args.audio_file, vad=args.vad or None)
+            if args.vad:
+                remove_metrics_sink(sink)
+                summary = sink.summary()
+                print(f"Skipped {summary['skipped_duration']:.1f}s of non-speech audio, "
+                      f"decoded {summary['audio_duration']:.1f}s", file=sys.stderr)
 
     with open(json_path, 'w') as _f:
         json.dump(hyp, _f)
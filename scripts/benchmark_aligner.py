@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File: benchmark_aligner.py
+
+Compare forced alignment with an open-vocabulary transcription
+(`transcribe_file_timecoded` then `align`) and with a transcription
+constrained to the vocabulary of the reference text
+(`transcribe_file_constrained` then `align`), on aligned ALI files.
+
+The sentences of each ALI file are re-aligned with both methods and
+the resulting timecodes are compared with the timecodes of the file.
+For every method, prints the processing time, the number of reliable
+alignments, the mean boundary error and the proportion of sentences
+whose boundaries are within a tolerance of the reference.
+
+Usage: ./benchmark_aligner.py FILE_OR_FOLDER [-m MODEL] [--tolerance 0.5]
+
+Author: Gweltaz Duval-Guennoc
+"""
+
+
+import sys
+import os
+import argparse
+import time
+
+import numpy as np
+
+from ostilhou.asr import load_model
+from ostilhou.asr.recognizer import transcribe_file_timecoded
+from ostilhou.asr.aligner import align, add_reliability_score, transcribe_file_constrained
+from ostilhou.asr.dataset import read_ali_file
+from ostilhou.utils import list_files_with_extension
+
+
+
+POSITIONAL_WEIGHT = 0.1
+
+
+
+def evaluate(matches, hyp, sentences, segments):
+    """ Returns the boundary errors and the number of reliable alignments """
+    reference = dict(zip(sentences, segments))
+    errors = []
+    n_reliable = 0
+    for match in matches:
+        if match["reliability"] == 'O':
+            n_reliable += 1
+        if match["sentence"] not in reference:
+            continue
+        ref_start, ref_end = reference[match["sentence"]]
+        span = match["span"]
+        errors.append(abs(hyp[span[0]]["start"] - ref_start))
+        errors.append(abs(hyp[span[1]-1]["end"] - ref_end))
+    return errors, n_reliable
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark constrained decoding for forced alignment")
+    parser.add_argument("data", metavar='FILE_OR_FOLDER', help="ALI file or folder of ALI files")
+    parser.add_argument("-m", "--model", help="Vosk model to use")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+        help="Max boundary error of a correct alignment (seconds)")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.data):
+        ali_files = sorted(list_files_with_extension("ali", args.data))
+    else:
+        ali_files = [args.data]
+
+    load_model(args.model)
+    methods = {
+        "open vocabulary": lambda audio, sentences: transcribe_file_timecoded(audio),
+        "constrained": lambda audio, sentences: transcribe_file_constrained(
+            audio, sentences, progress_bar=False
+        ),
+    }
+    results = { name: { "time": 0.0, "errors": [], "reliable": 0, "sentences": 0 } for name in methods }
+
+    for filepath in ali_files:
+        ali_data = read_ali_file(filepath)
+        audio_path = ali_data["audio_path"]
+        sentences, segments = ali_data["sentences"], ali_data["segments"]
+        if not audio_path or not sentences:
+            continue
+        print(f"==== {os.path.basename(filepath)} ====", file=sys.stderr)
+
+        for name, transcribe in methods.items():
+            t0 = time.perf_counter()
+            hyp = transcribe(audio_path, sentences)
+            matches = align(sentences, hyp, 0, len(hyp), POSITIONAL_WEIGHT, progress_bar=False)
+            add_reliability_score(matches, hyp)
+            elapsed = time.perf_counter() - t0
+
+            errors, n_reliable = evaluate(matches, hyp, sentences, segments)
+            results[name]["time"] += elapsed
+            results[name]["errors"].extend(errors)
+            results[name]["reliable"] += n_reliable
+            results[name]["sentences"] += len(sentences)
+            print(f"{name:>16}: {elapsed:.1f}s, {n_reliable}/{len(sentences)} reliable", file=sys.stderr)
+
+    print(f"{'':>16}{'time':>10}{'reliable':>10}{'mean err':>10}{'correct':>10}")
+    for name, r in results.items():
+        errors = np.array(r["errors"])
+        mean_error = errors.mean() if len(errors) else float("nan")
+        correct = (errors <= args.tolerance).mean() if len(errors) else float("nan")
+        reliable = r["reliable"] / r["sentences"] if r["sentences"] else float("nan")
+        print(f"{name:>16}{r['time']:>9.1f}s{reliable:>10.1%}{mean_error:>9.2f}s{correct:>10.1%}")
@@ -0,0 +1,74 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File: benchmark_chunk_size.py
+
+Measure the effect of the chunk size (number of bytes fed to the recognizer
+at a time) on throughput and latency.
+
+Throughput is given as the real-time factor (processing time / audio duration).
+Latency is the time before a chunk's audio gets decoded: the duration of
+the chunk itself (audio must be buffered before being fed) plus the mean
+processing time of a chunk.
+
+Usage: ./benchmark_chunk_size.py [--audio FILE] [-d 60] [-m MODEL]
+
+Author: Gweltaz Duval-Guennoc
+"""
+
+
+import argparse
+import time
+
+import numpy as np
+
+from ostilhou.asr import load_model
+from ostilhou.asr.recognizer import recognizer_pool, _as_waveform
+from ostilhou.audio import load_audiofile
+
+
+
+CHUNK_SIZES = [ 1000, 2000, 4000, 8000, 16000, 32000, 64000 ]
+
+
+
+def decode(model, data: bytes, chunk_size: int):
+    """ Returns the total processing time and the number of chunks """
+    view = memoryview(data)
+    n_chunks = 0
+    t0 = time.perf_counter()
+    with recognizer_pool.recognizer(model) as recognizer:
+        for i in range(0, len(view), chunk_size):
+            if recognizer.AcceptWaveform(_as_waveform(view[i:i+chunk_size])):
+                recognizer.Result()
+            n_chunks += 1
+        recognizer.FinalResult()
+    return time.perf_counter() - t0, n_chunks
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark recognizer chunk sizes")
+    parser.add_argument("--audio", help="Audio file to decode (white noise otherwise)")
+    parser.add_argument("-d", "--duration", help="Max audio duration (seconds)", type=float, default=60.0)
+    parser.add_argument("-m", "--model", help="Vosk model to use")
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    if args.audio:
+        data = load_audiofile(args.audio, 16000)[:int(args.duration * 1000)].raw_data
+    else:
+        rng = np.random.default_rng(0)
+        data = rng.normal(0, 1000, int(args.duration * 16000)).astype(np.int16).tobytes()
+    audio_duration = len(data) / 32000
+    print(f"Audio: {audio_duration:.1f}s")
+
+    decode(model, data[:32000], 4000)   # Warm-up
+
+    print(f"{'chunk size':>12}{'chunk (ms)':>12}{'RTF':>10}{'latency (ms)':>16}")
+    for chunk_size in CHUNK_SIZES:
+        duration, n_chunks = decode(model, data, chunk_size)
+        chunk_ms = chunk_size / 32
+        latency = chunk_ms + duration / n_chunks * 1000
+        print(f"{chunk_size:>12}{chunk_ms:>12.1f}{duration / audio_duration:>10.3f}{latency:>16.1f}")
@@ -0,0 +1,93 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File: benchmark_phonetizer.py
+
+Measure the throughput of `phonetize_word` on a large vocabulary.
+The vocabulary is read from a text file (one word per line, or the first
+column of a tsv file) or, by default, generated from the words of the
+bundled dictionaries and random compounds.
+
+Compares:
+  * the sliced grapheme parser (substrings of length 4, 3, 2, 1 at each position)
+  * the graphemes trie walk
+  * `phonetize_word`, cold and with a warm cache
+
+Usage: ./benchmark_phonetizer.py [-n 100000] [--vocab FILE]
+
+Author: Gweltaz Duval-Guennoc
+"""
+
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import time
+
+import ostilhou.asr as asr
+from ostilhou.asr import phonetize_word, clear_phonetize_cache
+from ostilhou.dicts import nouns_f, nouns_m, dicts
+
+
+
+def build_vocabulary(size: int) -> list:
+    words = sorted(nouns_f | nouns_m | set(dicts["first_names"]) | set(dicts["places"]))
+    words.extend(sorted(asr.lexicon_add))
+    hspell_root = os.path.join(os.path.dirname(asr.__file__), os.pardir, "hspell")
+    for filename in ("add.txt", "add_gwe.txt"):
+        with open(os.path.join(hspell_root, filename), 'r', encoding='utf-8') as f:
+            words.extend(l.split()[0] for l in f.readlines() if l.strip() and not l.startswith('#'))
+    vocabulary = list(dict.fromkeys(words))
+    
+    # Complete with compound words, until the requested size
+    rng = random.Random(0)
+    seen = set(vocabulary)
+    while len(vocabulary) < size:
+        w = '-'.join(rng.sample(words, 2)) if rng.random() < 0.3 else rng.choice(words) + rng.choice(words)
+        if w not in seen:
+            seen.add(w)
+            vocabulary.append(w)
+    return vocabulary[:size]
+
+
+def timeit(fn, words) -> float:
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for w in words:
+            fn(w)
+    return time.perf_counter() - t0
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the phonetizer")
+    parser.add_argument("-n", "--size", help="Vocabulary size", type=int, default=100_000)
+    parser.add_argument("--vocab", help="Vocabulary file")
+    args = parser.parse_args()
+
+    if args.vocab:
+        with open(args.vocab, 'r', encoding='utf-8') as f:
+            vocabulary = [ l.split()[0] for l in f.readlines() if l.strip() ][:args.size]
+    else:
+        vocabulary = build_vocabulary(args.size)
+    n = len(vocabulary)
+    print(f"Vocabulary: {n} words")
+
+    # Both grapheme parsers must agree
+    for w in vocabulary:
+        w = w.replace('-', '')
+        assert asr._phonetize_graphemes(w) == asr._phonetize_graphemes_sliced(w), w
+
+    results = [
+        ("graphemes, sliced", timeit(asr._phonetize_graphemes_sliced, vocabulary)),
+        ("graphemes, trie", timeit(asr._phonetize_graphemes, vocabulary)),
+    ]
+    clear_phonetize_cache()
+    results.append(("phonetize_word, cold", timeit(phonetize_word, vocabulary)))
+    results.append(("phonetize_word, warm", timeit(phonetize_word, vocabulary)))
+
+    for name, duration in results:
+        print(f"{name:24}{duration:8.3f}s{n / duration:12.0f} words/s")
@@ -0,0 +1,89 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File: benchmark_recognizer_pool.py
+
+Measure the cost of building a new Vosk recognizer for every segment,
+compared to reusing recognizers from `recognizer_pool`.
+Segments are cut from an audio file, or generated (white noise).
+Transcriptions from both methods are checked to be identical.
+
+Usage: ./benchmark_recognizer_pool.py [-n 200] [-d 2.0] [--audio FILE] [-m MODEL]
+
+Author: Gweltaz Duval-Guennoc
+"""
+
+
+import argparse
+import json
+import time
+
+import numpy as np
+from pydub import AudioSegment
+from vosk import KaldiRecognizer
+
+from ostilhou.asr import load_model
+from ostilhou.asr.recognizer import recognizer_pool, transcribe_segment_timecoded
+from ostilhou.audio import load_audiofile
+
+
+
+def transcribe_fresh(segment: AudioSegment, model) -> list:
+    """ Reference implementation, with a new recognizer for every segment """
+    recognizer = KaldiRecognizer(model, 16000)
+    recognizer.SetWords(True)
+    data = segment.get_array_of_samples().tobytes()
+    tokens = []
+    i = 0
+    while i + 4000 < len(data):
+        if recognizer.AcceptWaveform(data[i:i+4000]):
+            tokens.extend(json.loads(recognizer.Result()).get("result", []))
+        i += 4000
+    recognizer.AcceptWaveform(data[i:])
+    tokens.extend(json.loads(recognizer.FinalResult()).get("result", []))
+    return tokens
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the recognizer pool")
+    parser.add_argument("-n", "--segments", help="Number of segments", type=int, default=200)
+    parser.add_argument("-d", "--duration", help="Segment duration (seconds)", type=float, default=2.0)
+    parser.add_argument("--audio", help="Audio file to cut segments from")
+    parser.add_argument("-m", "--model", help="Vosk model to use")
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    seg_len = int(args.duration * 1000)
+    if args.audio:
+        audio = load_audiofile(args.audio, 16000)
+        n_cuts = max(1, len(audio) // seg_len)
+        segments = [ audio[(i % n_cuts) * seg_len:(i % n_cuts + 1) * seg_len] for i in range(args.segments) ]
+    else:
+        rng = np.random.default_rng(0)
+        segments = []
+        for _ in range(args.segments):
+            samples = rng.normal(0, 1000, int(args.duration * 16000)).astype(np.int16)
+            segments.append(AudioSegment(samples.tobytes(), frame_rate=16000, sample_width=2, channels=1))
+    print(f"{len(segments)} segments of {args.duration}s")
+
+    t_build = 0.0
+    for _ in segments:
+        t = time.perf_counter()
+        KaldiRecognizer(model, 16000).SetWords(True)
+        t_build += time.perf_counter() - t
+    print(f"{'recognizer construction':28}{t_build / len(segments) * 1000:8.2f} ms/segment")
+
+    t0 = time.perf_counter()
+    fresh = [ transcribe_fresh(seg, model) for seg in segments ]
+    t_fresh = time.perf_counter() - t0
+
+    recognizer_pool.clear()
+    t0 = time.perf_counter()
+    pooled = [ transcribe_segment_timecoded(seg) for seg in segments ]
+    t_pooled = time.perf_counter() - t0
+
+    assert fresh == pooled, "Pooled recognizers gave different results"
+    print(f"{'fresh recognizers':28}{t_fresh:8.3f}s")
+    print(f"{'pooled recognizers':28}{t_pooled:8.3f}s ({recognizer_pool.created} recognizers built)")
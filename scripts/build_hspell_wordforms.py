@@ -0,0 +1,39 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File: build_hspell_wordforms.py
+
+Expand the Breton Hunspell dictionary (`br_FR.dic` and `br_FR.aff`),
+along with the additional words (`add.txt`, `add_gwe.txt`) and the
+interjections, to the set of all accepted wordforms.
+The result is written to a binary file that is memory-mapped at runtime,
+so that spell checking no longer needs the native `hunspell` library.
+
+Usage: ./build_hspell_wordforms.py [-o OUTPUT_FILE]
+
+Author: Gweltaz Duval-Guennoc
+"""
+
+
+import argparse
+import time
+
+from ostilhou.hspell import (
+    hs_dic_path, hs_aff_path,
+    wordforms_path, iter_additional_words,
+)
+from ostilhou.hspell.wordforms import expand_hunspell_dictionary, write_wordforms
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompile the Hunspell wordforms set")
+    parser.add_argument("-o", "--output", help="Output file", default=wordforms_path)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    wordforms = set(expand_hunspell_dictionary(hs_dic_path + ".dic", hs_aff_path))
+    wordforms.update(iter_additional_words())
+    n = write_wordforms(wordforms, args.output)
+    print(f"{n} wordforms written to {args.output} in {time.time() - t0:.1f}s")
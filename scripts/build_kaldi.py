@@ -37,7 +37,10 @@ Main steps performed:
      passed via --lm-corpus.
   3. Build the pronunciation lexicon (`dict_nosp/lexicon.txt`) by
      phonetizing every word collected from the corpus, along with the
-     associated phone-set files.
+     associated phone-set files. Pronunciations are stored in the user's
+     cache directory, so only new words are phonetized on later runs
+     (unless --no-lexicon-cache is given). New words can be phonetized
+     in parallel with -j/--workers.
   4. Convert audio files to Kaldi-friendly 16kHz s16le mono PCM as needed,
      and optionally split them into per-utterance segments
      (--split-audio).
@@ -71,8 +74,9 @@ from colorama import Fore
 from ostilhou import normalize_sentence
 from ostilhou.asr import (
     parse_dataset,
+    PronunciationStore,
+    build_lexicon,
     phonemes,
-    phonetize_word,
     special_tokens,
 )
 from ostilhou.audio import convert_to_wav, export_segment, is_audiofile_valid_format
@@ -202,6 +206,18 @@ if __name__ == "__main__":
     parser.add_argument(
         "--split-audio", help="Split audio files by segments", action="store_true"
     )
+    parser.add_argument(
+        "--no-lexicon-cache",
+        help="phonetize every word, without using the stored pronunciations",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        help="number of processes used to phonetize the vocabulary",
+        type=int,
+        default=1,
+    )
     args = parser.parse_args()
     print(args)
 
@@ -303,26 +319,24 @@ if __name__ == "__main__":
     if "test" in corpora:
         corpora["train"]["lexicon"].update(corpora["test"]["lexicon"])
 
-    with open(lexicon_path, "w", encoding="utf-8") as f_out:
-        for key, val in special_tokens.items():
-            f_out.write(f"{key} {val}\n")
-        # f_out.write("<SPOKEN_NOISE> SPN\n"
-        #             "<UNK> SPN\n"
-        #             "<C'HOARZH> LAU\n"
-        #             "<NTT> SPN\n"
-        #             "<HUM> SPN\n"
-        #             "<PASAAT> SPN\n"
-        #             "<FRONAL> SPN\n"
-        #             "<SONEREZH> NSN\n")
-        for word in sorted(corpora["train"]["lexicon"]):
-            if word.lower() in stopwords:
-                continue
-            prons, errors = phonetize_word(word)
-            for pron in prons:
-                if not pron:
-                    print(Fore.RED + "ERROR empty pronunciation" + Fore.RESET, word)
-                elif errors == 0:
-                    f_out.write(f"{word} {pron}\n")
+    words = [
+        word
+        for word in corpora["train"]["lexicon"]
+        if word.lower() not in stopwords
+    ]
+    if args.no_lexicon_cache:
+        lexicon_phones = build_lexicon(
+            words, lexicon_path, workers=args.workers, special_tokens=special_tokens
+        )
+    else:
+        with PronunciationStore() as store:
+            lexicon_phones = build_lexicon(
+                words,
+                lexicon_path,
+                store=store,
+                workers=args.workers,
+                special_tokens=special_tokens,
+            )
 
     # silence_phones.txt
     silence_phones_path = os.path.join(dir_dict_nosp, "silence_phones.txt")
@@ -334,7 +348,7 @@ if __name__ == "__main__":
     nonsilence_phones_path = os.path.join(dir_dict_nosp, "nonsilence_phones.txt")
     print(f"building file '{nonsilence_phones_path}'")
     with open(nonsilence_phones_path, "w", encoding="utf-8") as f:
-        for p in sorted(phonemes):
+        for p in sorted(phonemes.union(lexicon_phones)):
             f.write(f"{p}\n")
 
     # optional_silence.txt
@@ -20,6 +20,7 @@ Author: Gweltaz Duval-Guennoc
 import os
 import re
 import argparse
+from contextlib import nullcontext
 
 
 from ostilhou.text import (
@@ -28,12 +29,13 @@ from ostilhou.text import (
     correct_sentence, normalize_sentence,
     PUNCTUATION
 )
-from ostilhou.hspell import get_hspell_mistakes
+from ostilhou.hspell import get_hspell_mistakes_batch, speller_pool
 
 
 
 LIMIT_VOCAB = False
 VOCAB_SIZE = 10000
+BATCH_SIZE = 10000  # Number of sentences spellchecked at a time
 
 KEMMADUR_PATTERN = re.compile(r" (g|b|d|w|v|c'h){1}/[a-zñ']{3,}", re.IGNORECASE)
 
@@ -45,6 +47,7 @@ if __name__ == "__main__":
     parser.add_argument("-t", "--min-words", help="Minimum number of words per sentence", type=int, default=3)
     parser.add_argument("-n", "--normalize", help="Normalize sentences", action="store_true")
     parser.add_argument("--rem-punct", help="Remove punctuation", action="store_true")
+    parser.add_argument("-j", "--workers", help="Number of spellchecking processes", type=int, default=1)
     args = parser.parse_args()
     print(args)
 
@@ -60,98 +63,122 @@ if __name__ == "__main__":
                 filenames.append(os.path.join(d, filename))
     
     
-    articles = []
-    for filename in filenames:
-        with open(filename, 'r', encoding='utf-8') as f:
-            articles.extend(f.read().split('\n\n'))
-    
-    keepers = []
-    num_outed = 0
-    vocabulary = dict()
-
-    for article in articles:
-        for line in article.split('\n'):
-            #if '&' in line:
-            #    line = html.unescape(line)
+    def iter_candidates():
+        for filename in filenames:
+            with open(filename, 'r', encoding='utf-8') as f:
+                articles = f.read().split('\n\n')
             
-            line = filter_out_chars(pre_process(line.strip()), '"[]•')
-            line = line.replace("()", '')
+            for article in articles:
+                for line in article.split('\n'):
+                    #if '&' in line:
+                    #    line = html.unescape(line)
+                    
+                    line = filter_out_chars(pre_process(line.strip()), '"[]•')
+                    line = line.replace("()", '')
+
+                    for sentence in split_sentences(line):
+                        # Filter out short sentences
+                        if len(sentence) < 8:
+                            continue
+                        
+                        stats = sentence_stats(sentence)
+                        
+                        if stats["words"] < args.min_words:
+                            continue
+
+                        if stats["letter"]/len(sentence) < 0.4:
+                            #print(f"skipped {stats['letter']/len(sentence):.2}: {sentence}")
+                            continue
+                        
+                        # Filter out sentences with only single letters or short words (ex: "v i v i a n a v i v i a n a")
+                        if len(sentence)/stats["words"] < 2.:
+                            #print(f"skipped {len(sentence)/stats['words']:.2}: {sentence}")
+                            continue
+                        
+                        # Remove all caps sentences
+                        if stats["upper"]/stats["letter"] > 0.8:
+                            print(sentence)
+                            continue
+                        
+                        sentence = correct_sentence(sentence)
+                        sentence = sentence.replace("J. -K.", "J.-K.")
+                        yield sentence
+    
 
-            for sentence in split_sentences(line):
-                # Filter out short sentences
-                if len(sentence) < 8:
-                    continue
-                
-                stats = sentence_stats(sentence)
-                
-                if stats["words"] < args.min_words:
-                    continue
+    def write_keeper(f, sentence: str) -> bool:
+        # Keep sentences with common words only
+        for w in sentence.split():
+            if LIMIT_VOCAB and not w in vocabulary:
+                return False
+        if args.normalize:
+            sentence = normalize_sentence(sentence)
+            if sentence_stats(sentence)["decimal"] > 0:
+                print("NORM:", sentence)
+                return False
+        f.write(sentence + '\n')
+        return True
+    
 
-                if stats["letter"]/len(sentence) < 0.4:
-                    #print(f"skipped {stats['letter']/len(sentence):.2}: {sentence}")
-                    continue
-                
-                # Filter out sentences with only single letters or short words (ex: "v i v i a n a v i v i a n a")
-                if len(sentence)/stats["words"] < 2.:
-                    #print(f"skipped {len(sentence)/stats['words']:.2}: {sentence}")
-                    continue
-                   
-                # Remove all caps sentences
-                if stats["upper"]/stats["letter"] > 0.8:
-                    print(sentence)
-                    continue
-                
-                sentence = correct_sentence(sentence)
-                sentence = sentence.replace("J. -K.", "J.-K.")
-
-                colored, num_errors, _ = get_hspell_mistakes(sentence, autocorrected=True)
-                if num_errors == 0:
-                    keepers.append(sentence)
-                elif num_errors == 1:
-                    if num_outed % 200 == 0:
-                        print(colored)
-                    num_outed += 1
-
-                # Collect vocabulary
-                for w in filter_out_chars(sentence, PUNCTUATION).split():
-                    w = w.lower()
-                    if w in vocabulary:
-                        vocabulary[w] += 1
-                    else:
-                        vocabulary[w] = 1
-                
-    #print(f"{num_outed} discarded sentences with 1 error")
+    def spellcheck(candidates):
+        # Spellcheck a batch of sentences at once, so that each word is checked only once
+        global num_outed
+        spellchecked = get_hspell_mistakes_batch(candidates, autocorrected=True, executor=executor)
+        for sentence, (colored, num_errors, _) in zip(candidates, spellchecked):
+            if num_errors == 0:
+                yield sentence
+            elif num_errors == 1:
+                if num_outed % 200 == 0:
+                    print(colored)
+                num_outed += 1
+
+            # Collect vocabulary
+            for w in filter_out_chars(sentence, PUNCTUATION).split():
+                w = w.lower()
+                if w in vocabulary:
+                    vocabulary[w] += 1
+                else:
+                    vocabulary[w] = 1
     
-    if LIMIT_VOCAB:
-        voc_list = sorted(vocabulary.items(), key=lambda x: x[1], reverse=True)
-        voc_list = voc_list[:VOCAB_SIZE]
-        vocabulary.clear()
-        vocabulary.update(voc_list)
 
     OUTPUT_DIR = args.output
     if not os.path.exists(OUTPUT_DIR):
         os.mkdir(OUTPUT_DIR)
 
+    keepers = []    # Only when the vocabulary is limited, as it depends on the whole corpus
+    num_outed = 0
+    vocabulary = dict()
     kept = 0
     
-    with open(os.path.join(OUTPUT_DIR, "wikipedia_keepers.txt"), 'w', encoding='utf-8') as f:
-        #for sentence in sorted(keepers):
-        for sentence in keepers:
-            words = sentence.split()
-            
-            # Keep sentences with common words only
-            for w in words:
-                if LIMIT_VOCAB and not w in vocabulary:
-                    break
-            else:   # Executed only if previous for loop exited normally
-                if args.normalize:
-                    sentence = normalize_sentence(sentence)
-                    if sentence_stats(sentence)["decimal"] > 0:
-                        print("NORM:", sentence)
-                        continue
-                    
-                f.write(sentence + '\n')
+    # The spellchecking processes are started once and reused for every batch
+    pool = speller_pool(args.workers) if args.workers > 1 else nullcontext()
+    with pool as executor, open(os.path.join(OUTPUT_DIR, "wikipedia_keepers.txt"), 'w', encoding='utf-8') as f:
+        candidates = []
+        for sentence in iter_candidates():
+            candidates.append(sentence)
+            if len(candidates) < BATCH_SIZE:
+                continue
+            for keeper in spellcheck(candidates):
+                if LIMIT_VOCAB:
+                    keepers.append(keeper)
+                elif write_keeper(f, keeper):
+                    kept += 1
+            candidates = []
+        for keeper in spellcheck(candidates):
+            if LIMIT_VOCAB:
+                keepers.append(keeper)
+            elif write_keeper(f, keeper):
                 kept += 1
+                
+        #print(f"{num_outed} discarded sentences with 1 error")
+        
+        if LIMIT_VOCAB:
+            voc_list = sorted(vocabulary.items(), key=lambda x: x[1], reverse=True)
+            voc_list = voc_list[:VOCAB_SIZE]
+            vocabulary.clear()
+            vocabulary.update(voc_list)
+            for keeper in keepers:
+                if write_keeper(f, keeper):
+                    kept += 1
     
     print(f"{kept} sentences kept")
     
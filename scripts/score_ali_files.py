@@ -12,6 +12,7 @@ usage:
     python3 score_ali_files.py data.ali
     python3 score_ali_files.py data_folder/ --model vosk_model/
     python3 score_ali_files.py list_of_files.txt -o result.txt
+    python3 score_ali_files.py data_folder/ -j 8
 """
 
 from typing import Optional
@@ -36,6 +37,9 @@ from ostilhou.text import (
 )
 from ostilhou.asr.models import load_model, get_loaded_model_name
 from ostilhou.asr.recognizer import transcribe_segment
+from ostilhou.asr.worker_pool import WorkerPool
+from ostilhou.asr.transcription_cache import enable_transcription_cache
+from ostilhou.asr.metrics import JsonLinesSink, add_metrics_sink
 from ostilhou.asr.dataset import format_timecode, read_ali_file
 from ostilhou.audio import (
     load_audiofile, get_audio_segment,
@@ -56,9 +60,21 @@ if __name__ == "__main__":
     parser.add_argument("--noise", type=float, help="Add white noise to audio (dB)")
     parser.add_argument("-v", "--verbose", action="store_true")
     parser.add_argument("--no-score", action="store_true")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+        help="Number of processes used for decoding")
+    parser.add_argument("--cache", action="store_true",
+        help="Reuse the transcriptions of previously decoded segments")
+    parser.add_argument("--metrics", metavar='FILE',
+        help="Append performance metrics of every decoding call to a JSON-lines file")
     args = parser.parse_args()
     
     load_model(args.model)
+    if args.cache:
+        enable_transcription_cache()
+    if args.metrics:
+        # Registered before the worker processes are forked
+        add_metrics_sink(JsonLinesSink(args.metrics))
+    pool = WorkerPool(workers=args.workers) if args.workers > 1 else None
 
     if os.path.isdir(args.data_folder):
         ali_files = list_files_with_extension('ali', args.data_folder)
@@ -130,13 +146,20 @@ if __name__ == "__main__":
         current_start_time = time.perf_counter()
         current_total_duration = 0.0
 
+        if pool:
+            audio_segments = [ get_audio_segment(i, audio, segments) for i in range(len(segments)) ]
+            transcriptions = pool.map(transcribe_segment, audio_segments)
+        
         for i in range(len(segments)):
             sentence = filter_out_chars(text[i], PUNCTUATION + '*')
             sentence = normalize_sentence(sentence, autocorrect=True)
             sentence = pre_process(sentence).replace('-', ' ').lower()
             sentence = ' '.join(sentence.split())
-            audio_segment = get_audio_segment(i, audio, segments)
-            transcription = transcribe_segment(audio_segment)
+            if pool:
+                transcription = transcriptions[i]
+            else:
+                audio_segment = get_audio_segment(i, audio, segments)
+                transcription = transcribe_segment(audio_segment)
             transcription = ' '.join(transcription)
             transcription = transcription.replace('-', ' ').lower()
             score_wer = round(wer(sentence, transcription), 2)
@@ -184,6 +207,9 @@ if __name__ == "__main__":
         print(f"  => WER: {wer(references, hypothesis):.2%}", file=sys.stderr)
         print(f"  => CER: {cer(references, hypothesis):.2%}", file=sys.stderr)
 
+    if pool:
+        pool.close()
+
     print(f"\n======== TOTAL ({get_loaded_model_name()}) ========", file=sys.stderr)
     if words_sum > 0:
         print(f"WER: {wer_sum / words_sum:.2%}", file=sys.stderr)
@@ -5,6 +5,8 @@
     Score every utterance in a CSV/TSV file ("path\tsentence\n")
     Creates a TSV file with the following columns :
     filepath, audio ext, seg start, seg end, reference, hypothesis, WER, CER
+
+    Audio files are transcribed in batches by a pool of decoding processes
 """
 
 
@@ -14,7 +16,7 @@ import os
 
 from colorama import Fore
 from ostilhou.text import pre_process, filter_out_chars, normalize_sentence, PUNCTUATION
-from ostilhou.asr.recognizer import transcribe_file
+from ostilhou.asr.batch import iter_transcribe_files
 
 from jiwer import wer, cer
 
@@ -23,6 +25,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Score every utterance in a CSV/TSV file")
     parser.add_argument("filename", help="CSV/TSV file")
     parser.add_argument("-o", "--output", type=str, help="Results file")
+    parser.add_argument("-m", "--model", help="Vosk model to use")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="Number of decoding processes")
+    parser.add_argument("--batch-size", type=int, default=32, help="Number of files sent to a decoding process at a time")
     args = parser.parse_args()
 
     root_folder = os.path.split(args.filename)[0]
@@ -49,13 +54,17 @@ if __name__ == "__main__":
             
     audio_files, sentences = zip(*sorted(zip(audio_files, sentences)))
 
-    for filepath, sentence in zip(audio_files, sentences):
+    results = iter_transcribe_files(
+        [ os.path.join(root_folder, filepath) for filepath in audio_files ],
+        args.workers, args.batch_size, args.model
+    )
+
+    for filepath, sentence, result in zip(audio_files, sentences, results):
         _, basename = os.path.split(filepath)
         basename, _ = os.path.splitext(basename)
         audio_ext = os.path.splitext(filepath)[1][1:]
 
-        path = os.path.join(root_folder, filepath)
-        hyp = ' '.join(transcribe_file(path))
+        hyp = ' '.join(result["text"])
         if not hyp: hyp = '-'
 
         hypothesis.append(hyp)
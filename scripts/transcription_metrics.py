@@ -0,0 +1,71 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File: transcription_metrics.py
+
+Summarize the performance metrics of transcription calls, as written
+by `ostilhou.asr.metrics.JsonLinesSink` (see the `--metrics` option
+of `score_ali_files.py`).
+
+For every transcription function, print the number of calls, the total
+audio duration, the overall real-time factor and throughput, and the
+percentiles of the per-call metrics.
+
+Usage: ./transcription_metrics.py FILE [FILE ...] [-p 50 90 99] [--json]
+
+Author: Gweltaz Duval-Guennoc
+"""
+
+
+import argparse
+import json
+from collections import defaultdict
+
+from ostilhou.asr.metrics import read_metrics, summarize
+
+
+
+def print_summary(name: str, summary: dict, percentiles) -> None:
+    print(f"== {name} ==")
+    print(f"calls: {summary['calls']}")
+    print(f"audio duration: {summary['audio_duration']:.1f}s")
+    print(f"wall time: {summary['wall_time']:.1f}s")
+    if summary.get("skipped_duration"):
+        total = summary["audio_duration"] + summary["skipped_duration"]
+        print(f"skipped audio: {summary['skipped_duration']:.1f}s ({summary['skipped_duration'] / total:.1%} of input)")
+    if summary["rtf"]:
+        print(f"real-time factor: {summary['rtf']:.3f} ({1/summary['rtf']:.1f}x real time)")
+
+    columns = ["mean"] + [ f"p{p}" for p in percentiles ] + ["max"]
+    print(f"{'':>16}" + ''.join( f"{c:>12}" for c in columns ))
+    for field, stats in summary.get("fields", dict()).items():
+        print(f"{field:>16}" + ''.join( f"{stats[c]:>12.3f}" for c in columns ))
+    print()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize transcription metrics")
+    parser.add_argument("files", nargs='+', metavar='FILE', help="JSON-lines metrics files")
+    parser.add_argument("-p", "--percentiles", nargs='+', type=float, default=[50, 90, 99])
+    parser.add_argument("--json", action="store_true", help="Print the summaries as JSON")
+    args = parser.parse_args()
+
+    percentiles = [ int(p) if p.is_integer() else p for p in args.percentiles ]
+
+    records = defaultdict(list)
+    for path in args.files:
+        for record in read_metrics(path):
+            records[record["function"]].append(record)
+    all_records = [ r for function_records in records.values() for r in function_records ]
+
+    summaries = { function: summarize(records[function], percentiles) for function in sorted(records) }
+    if len(summaries) > 1:
+        summaries["all"] = summarize(all_records, percentiles)
+
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+    else:
+        for name, summary in summaries.items():
+            print_summary(name, summary, percentiles)
@@ -0,0 +1,103 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File: transcription_queue.py
+
+Transcribe large collections of audio files with a persistent job queue.
+Progress is stored in a SQLite database: after a crash or an interruption,
+running the queue again resumes where it stopped.
+
+Usage:
+    ./transcription_queue.py add FILE_OR_FOLDER [...] [-o OUTPUT_DIR]
+    ./transcription_queue.py run [-j WORKERS] [-m MODEL] [--watch]
+    ./transcription_queue.py status [--failed]
+    ./transcription_queue.py retry
+
+Author: Gweltaz Duval-Guennoc
+"""
+
+
+import os
+import sys
+import argparse
+import datetime
+
+from ostilhou.asr.job_queue import JobQueue, FAILED
+from ostilhou.utils import list_files_with_extension
+
+
+
+AUDIO_EXTENSIONS = ("wav", "mp3", "m4a", "ogg", "opus", "flac", "mp4", "mkv", "webm")
+
+
+
+def format_duration(seconds) -> str:
+    if seconds is None:
+        return "?"
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+
+def print_status(queue: JobQueue, show_failed=False) -> None:
+    stats = queue.stats()
+    print(', '.join( f"{n} {status}" for status, n in stats["jobs"].items() ))
+    print(f"audio: {format_duration(stats['audio_done'])} / {format_duration(stats['audio_total'])}")
+    if stats["throughput"]:
+        print(f"throughput: {stats['throughput']:.1f}x real time")
+    print(f"remaining time: {format_duration(stats['eta'])}")
+    if show_failed:
+        for job in queue.jobs(FAILED):
+            print(f"{job['path']}: {job['error']}")
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent transcription job queue")
+    parser.add_argument("--db", default="transcription_queue.sqlite", help="Queue database file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Add audio files to the queue")
+    add_parser.add_argument("files", nargs='+', metavar="FILE_OR_FOLDER")
+    add_parser.add_argument("-o", "--output-dir",
+        help="Folder of the transcriptions (next to the audio files by default)")
+
+    run_parser = subparsers.add_parser("run", help="Transcribe the files of the queue")
+    run_parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+        help="Number of decoding processes")
+    run_parser.add_argument("-m", "--model", help="Vosk model to use")
+    run_parser.add_argument("--max-length", type=float, default=30,
+        help="Maximum duration of a chunk (seconds)")
+    run_parser.add_argument("--watch", action="store_true",
+        help="Keep running, waiting for new files")
+
+    status_parser = subparsers.add_parser("status", help="Show the progress of the queue")
+    status_parser.add_argument("--failed", action="store_true", help="List failed jobs")
+
+    subparsers.add_parser("retry", help="Put failed jobs back in the queue")
+    args = parser.parse_args()
+
+    with JobQueue(args.db) as queue:
+        if args.command == "add":
+            files = []
+            for path in args.files:
+                if os.path.isdir(path):
+                    files.extend(sorted(list_files_with_extension(AUDIO_EXTENSIONS, path)))
+                else:
+                    files.append(path)
+            n = queue.add(files, args.output_dir)
+            print(f"{n} file{'s' if n > 1 else ''} added", file=sys.stderr)
+
+        elif args.command == "run":
+            try:
+                queue.run(args.workers, args.model, args.max_length, watch=args.watch)
+            except KeyboardInterrupt:
+                print("Interrupted, progress is saved", file=sys.stderr)
+            print_status(queue)
+
+        elif args.command == "status":
+            print_status(queue, args.failed)
+
+        elif args.command == "retry":
+            n = queue.retry_failed()
+            print(f"{n} job{'s' if n > 1 else ''} back in the queue", file=sys.stderr)
@@ -18,7 +18,7 @@ import re
 
 from colorama import Style
 
-from ostilhou.text import get_hspell_mistakes
+from ostilhou.hspell import get_hspell_mistakes_batch
 from ostilhou.utils import list_files_with_extension, green
 from ostilhou.asr.dataset import parse_ali_file
 
@@ -35,8 +35,8 @@ if __name__ == "__main__":
         total_errors = 0
         all_errors = {}
 
-        for i, line in enumerate(_fin.readlines()):
-            correction, num_errors, errors = get_hspell_mistakes(line)
+        lines = _fin.readlines()
+        for i, (correction, num_errors, errors) in enumerate(get_hspell_mistakes_batch(lines)):
             total_errors += num_errors
             if errors:
                 # print(f"{Style.DIM}[{text.strip()}]{Style.RESET_ALL}")
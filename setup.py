@@ -49,6 +49,7 @@ setup(
         "console_scripts": [
             "srt2split = ostilhou:srt2split",
             "wavesplit = wavesplit:main",
+            "ostilhou-serve = ostilhou.asr.server:main",
         ],
     }
 )
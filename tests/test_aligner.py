@@ -66,4 +66,69 @@ def test_aligner():
     assert matches[1]["span"] == (6, 10)
     assert matches[2]["span"] == (10, 20)
     assert matches[3]["span"] == (20, 31)
-    assert matches[4]["span"] == (31, 35)
\ No newline at end of file
+    assert matches[4]["span"] == (31, 35)
+
+
+def test_decode_constrained():
+    import json
+    import numpy as np
+    from ostilhou.asr.aligner import decode_constrained, sentence_words
+
+    # 12 sentences of 2 or 3 distinct words
+    sentences = [
+        ' '.join( "g" + chr(97 + i) + chr(97 + j) for j in range(2 + i % 2) ).capitalize() + '.'
+        for i in range(12)
+    ]
+    reference = [ w for s in sentences for w in sentence_words(s) ]
+    grammars = []
+
+    class GrammarRecognizer:
+        """ Recognizes the next reference words, two per second of audio """
+        position = 0
+
+        def __init__(self, model, sample_rate, grammar):
+            self.grammar = json.loads(grammar)
+            grammars.append(self.grammar)
+            self.n_bytes = 0
+
+        def SetWords(self, enable):
+            pass
+
+        def AcceptWaveform(self, data):
+            self.n_bytes += len(data)
+            return False
+
+        def FinalResult(self):
+            n = round(self.n_bytes / 32000 * 2)
+            words = reference[GrammarRecognizer.position:GrammarRecognizer.position + n]
+            GrammarRecognizer.position += n
+            assert all( w in self.grammar for w in words )
+            result = [ {"word": w, "start": i * 0.5, "end": i * 0.5 + 0.4, "conf": 1.0} for i, w in enumerate(words) ]
+            return json.dumps({"text": ' '.join(words), "result": result + [{"word": "[unk]", "start": 0, "end": 0, "conf": 1}]})
+
+    # Bursts of noise separated by silences, at the reference speech rate
+    sr = 16000
+    rng = np.random.default_rng(0)
+    silence = np.zeros(sr // 2, dtype=np.int16)
+    bursts = [ rng.normal(0, 3000, sr * 3).astype(np.int16) for _ in range(4) ]
+    samples = np.concatenate([ part for b in bursts for part in (b, silence) ])
+
+    tokens = decode_constrained(
+        samples, sentences, sr, window=0, max_length=4.0,
+        model=object(), recognizer_factory=GrammarRecognizer, progress_bar=False
+    )
+    # 7 words in each region of 3.5 seconds
+    assert [ t["word"] for t in tokens ] == reference[:28]
+    # Timecodes are relative to the whole audio
+    assert all( t1["start"] <= t2["start"] for t1, t2 in zip(tokens[:-1], tokens[1:]) )
+    # Grammars are limited to a window of sentences
+    assert len(grammars) == 4
+    for grammar in grammars:
+        assert "[unk]" in grammar
+        assert len([ w for w in grammar if w.islower() ]) < len(reference) / 2
+
+    # Nothing to decode in empty audio
+    assert decode_constrained(
+        np.zeros(0, dtype=np.int16), sentences, sr,
+        model=object(), recognizer_factory=GrammarRecognizer, progress_bar=False
+    ) == []
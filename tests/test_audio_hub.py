@@ -0,0 +1,98 @@
+import io
+import json
+import time
+
+import numpy as np
+import pytest
+
+from ostilhou.audio.hub import StreamHub, collect_samples, waveform_peaks
+
+
+
+def pcm(n_samples=16000, seed=0) -> bytes:
+    rng = np.random.default_rng(seed)
+    return rng.integers(-20000, 20000, n_samples, dtype=np.int16).tobytes()
+
+
+
+def test_fan_out():
+    data = pcm(16000 * 3)
+    hub = StreamHub(chunk_size=1000, max_queued=2)
+    hub.add_consumer("samples", collect_samples)
+    hub.add_consumer("peaks", waveform_peaks(0.5))
+    hub.add_consumer("bytes", lambda stream: b''.join(stream))
+    hub.add_consumer("read", lambda stream: [ len(stream.read(3000)) for _ in range(34) ])
+    results = hub.run(io.BytesIO(data))
+
+    assert hub.duration == pytest.approx(3.0)
+    assert results["bytes"] == data
+    samples = np.frombuffer(data, dtype=np.int16)
+    np.testing.assert_allclose(results["samples"], samples / 32768.0)
+    assert results["peaks"].shape == (6, 2)
+    assert results["peaks"][0, 0] == pytest.approx(samples[:8000].min() / 32768.0)
+    assert results["read"][-2:] == [0, 0] and sum(results["read"]) == len(data)
+
+    with pytest.raises(ValueError):
+        hub.add_consumer("bytes", collect_samples)
+
+
+
+def test_slow_and_failing_consumers():
+    data = pcm(16000)
+
+    def slow(stream):
+        n = 0
+        for chunk in stream:
+            time.sleep(0.001)
+            n += len(chunk)
+        return n
+
+    def early_exit(stream):
+        return len(stream.read(100))
+
+    def failing(stream):
+        stream.read(100)
+        raise RuntimeError("consumer error")
+
+    hub = StreamHub(chunk_size=500, max_queued=1)
+    hub.add_consumer("slow", slow)
+    hub.add_consumer("early", early_exit)
+    assert hub.run(io.BytesIO(data)) == {"slow": len(data), "early": 100}
+
+    hub.add_consumer("failing", failing)
+    with pytest.raises(RuntimeError, match="consumer error"):
+        hub.run(io.BytesIO(data))
+
+
+
+def test_transcription_consumer(monkeypatch):
+    from ostilhou.asr import recognizer
+    from ostilhou.asr.recognizer import RecognizerPool, transcribe_stream_timecoded
+
+    class Model:
+        pass
+
+    class WordRecognizer:
+        """ One word per chunk """
+        def __init__(self, model=None, sample_rate=16000):
+            self.n = 0
+        def SetWords(self, enable):
+            pass
+        def Reset(self):
+            self.n = 0
+        def AcceptWaveform(self, data):
+            self.n += 1
+            return True
+        def Result(self):
+            return json.dumps({"result": [{"word": f"w{self.n}", "start": 0.0, "end": 0.1, "conf": 1.0}]})
+        def FinalResult(self):
+            return json.dumps({"text": ""})
+
+    model = Model()
+    monkeypatch.setattr(recognizer, "load_model", lambda: model)
+    monkeypatch.setattr(recognizer, "recognizer_pool", RecognizerPool(factory=WordRecognizer))
+
+    hub = StreamHub(chunk_size=4000)
+    hub.add_consumer("words", lambda stream: transcribe_stream_timecoded(stream, chunk_size=4000))
+    results = hub.run(io.BytesIO(pcm(8000)))
+    assert [ t["word"] for t in results["words"] ] == ["w1", "w2", "w3", "w4"]
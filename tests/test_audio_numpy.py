@@ -1,6 +1,9 @@
 from importlib import resources
 
-from ostilhou.audio.audio_numpy import split_to_segments, get_samples, binary_split
+import numpy as np
+import pytest
+
+from ostilhou.audio.audio_numpy import split_to_segments, get_samples, binary_split, EnergyVAD, SpeechGate
 from ostilhou.asr.recognizer import transcribe_file_timecoded_callback_ffmpeg
 
 
@@ -17,3 +20,38 @@ def test_audio_numpy():
 
     print(len(samples) / sample_rate)
     print(segments)
+
+
+
+def test_speech_gate():
+    sr = 16000
+    rng = np.random.default_rng(0)
+    silence = np.zeros(sr * 3, dtype=np.int16)
+    speech = rng.normal(0, 3000, sr * 2).astype(np.int16)
+    short_pause = np.zeros(sr // 2, dtype=np.int16)
+    data = np.concatenate([silence, speech, short_pause, speech, silence]).tobytes()
+
+    gate = SpeechGate(EnergyVAD(sr), sr, padding=0.3, min_silence=1.0)
+    frames = []
+    for i in range(0, len(data), 3333):
+        frames.extend(gate.process(data[i:i+3333]))
+    frames.extend(gate.flush())
+
+    # A single region, the short pause is kept
+    assert len({ start for start, _ in frames }) == 1
+    assert frames[0][0] == pytest.approx(2.7, abs=0.05)
+    kept = b''.join( f for _, f in frames )
+    assert len(kept) / 2 / sr == pytest.approx(4.5 + 0.6, abs=0.1)
+    assert gate.total_bytes == len(data)
+    assert gate.skipped_duration == pytest.approx(10.5 - 5.1, abs=0.1)
+    # Frames are kept contiguous
+    offset = int(frames[0][0] * sr) * 2
+    assert data[offset:offset+len(kept)] == kept
+
+
+
+def test_speech_gate_silence():
+    gate = SpeechGate(EnergyVAD())
+    assert list(gate.process(bytes(32000))) == []
+    assert list(gate.flush()) == []
+    assert gate.skipped_duration == pytest.approx(1.0)
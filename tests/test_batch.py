@@ -0,0 +1,113 @@
+import json
+import wave
+import multiprocessing
+
+import pytest
+
+from ostilhou.asr import batch, models
+from ostilhou.asr.recognizer import RecognizerPool
+from ostilhou.asr.batch import transcribe_files, iter_transcribe_files
+from ostilhou.asr.transcription_cache import enable_transcription_cache, disable_transcription_cache
+from ostilhou.asr.metrics import MemorySink, add_metrics_sink, remove_metrics_sink
+
+
+
+class Model:
+    pass
+
+
+_model = Model()
+
+
+
+class LengthRecognizer:
+    """ Transcribes the number of bytes it was fed """
+
+    def __init__(self, model=None, sample_rate=16000):
+        self.n = 0
+
+    def SetWords(self, enable):
+        pass
+
+    def Reset(self):
+        self.n = 0
+
+    def AcceptWaveform(self, data):
+        self.n += len(data)
+        return False
+
+    def Result(self):
+        return json.dumps({"text": str(self.n)})
+
+    def FinalResult(self):
+        return json.dumps({"text": str(self.n)})
+
+
+
+def write_wav(path, n_samples, sample_rate=16000):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(b"\x00\x01" * n_samples)
+
+
+@pytest.fixture
+def clips(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "load_model", lambda name=None: _model)
+    monkeypatch.setattr(batch, "recognizer_pool", RecognizerPool(factory=LengthRecognizer))
+    paths = []
+    for i in range(7):
+        path = tmp_path / f"clip_{i}.wav"
+        write_wav(path, 1000 * (i + 1))
+        paths.append(str(path))
+    return paths
+
+
+
+def test_order(clips):
+    results = transcribe_files(clips, batch_size=3)
+    assert [ r["path"] for r in results ] == clips
+    assert [ r["text"] for r in results ] == [ [str(2000 * (i + 1))] for i in range(7) ]
+    assert results[1]["duration"] == pytest.approx(2000 / 16000)
+    assert all( r["error"] is None and r["decode_time"] >= 0 for r in results )
+
+
+
+def test_unreadable(clips, tmp_path):
+    missing = str(tmp_path / "missing.mp3")
+    results = list(iter_transcribe_files([clips[0], missing, clips[1]], batch_size=2))
+    assert [ r["path"] for r in results ] == [clips[0], missing, clips[1]]
+    assert results[1]["text"] == [] and results[1]["error"]
+    assert results[2]["text"] == ["4000"]
+
+
+
+def test_cache(clips, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "get_loaded_model_name", lambda: "fake-model")
+    enable_transcription_cache(str(tmp_path / "cache.sqlite"))
+    try:
+        first = transcribe_files(clips, batch_size=3)
+        second = transcribe_files(clips, batch_size=3)
+    finally:
+        disable_transcription_cache()
+    assert not any( r["cached"] for r in first )
+    assert all( r["cached"] for r in second )
+    assert [ r["text"] for r in first ] == [ r["text"] for r in second ]
+
+
+
+def test_workers(clips, monkeypatch):
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("fork start method is not available")
+    monkeypatch.setattr(models, "_loaded_model", object())
+    sink = add_metrics_sink(MemorySink())
+    try:
+        results = transcribe_files(clips, workers=3, batch_size=2)
+    finally:
+        remove_metrics_sink(sink)
+    assert [ r["text"] for r in results ] == [ [str(2000 * (i + 1))] for i in range(7) ]
+    # A single record for the call, with the audio decoded by the workers
+    record, = sink.records
+    assert record["function"] == "transcribe_files"
+    assert record["bytes"] == sum( 2000 * (i + 1) for i in range(7) )
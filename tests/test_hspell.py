@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import ostilhou.hspell as hspell
+from ostilhou.hspell import (
+    get_hspell_mistakes, get_hspell_mistakes_batch,
+    spell_batch, clear_spell_cache,
+)
+
+
+
+class CountingSpeller:
+    """ Stand-in for a Hunspell dictionary, counting lookups """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = set(vocabulary)
+        self.lookups = []
+
+    def spell(self, word):
+        self.lookups.append(word)
+        return word.lower() in self.vocabulary
+
+
+
+def test_spell_batch():
+    speller = CountingSpeller(["demat", "d'an", "holl"])
+    hs, hspell._hs = hspell._hs, speller
+    clear_spell_cache()
+    try:
+        verdicts = spell_batch(["demat", "holl", "demat", "dematt", "holl"])
+        assert verdicts == {"demat": True, "holl": True, "dematt": False}
+        assert sorted(speller.lookups) == ["demat", "dematt", "holl"]
+        
+        # Verdicts are memoized between calls
+        spell_batch(["demat", "dematt"])
+        assert len(speller.lookups) == 3
+
+        sentences = [
+            "Demat d'an holl !",
+            "Demat d'an hol.",
+            "Demat d'an holl !",
+        ]
+        results = get_hspell_mistakes_batch(sentences)
+        assert [ r[1] for r in results ] == [0, 1, 0]
+        assert results[1][2] == {"hol"}
+        assert results == [ get_hspell_mistakes(s) for s in sentences ]
+    finally:
+        hspell._hs = hs
+        clear_spell_cache()
+
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    """ In-process stand-in for a speller pool, counting the chunks sent to it """
+
+    def __init__(self):
+        super().__init__(max_workers=2)
+        self.chunks = 0
+
+    def map(self, fn, *iterables, **kwargs):
+        chunks = list(iterables[0])
+        self.chunks += len(chunks)
+        return super().map(fn, chunks, **kwargs)
+
+
+
+def test_spell_batch_executor():
+    speller = CountingSpeller(["demat", "d'an", "holl"])
+    hs, hspell._hs = hspell._hs, speller
+    clear_spell_cache()
+    try:
+        with CountingExecutor() as executor:
+            verdicts = spell_batch(["demat", "holl", "dematt"], chunk_size=1, executor=executor)
+            assert verdicts == {"demat": True, "holl": True, "dematt": False}
+            assert executor.chunks == 3
+
+            # The pool is left running for the next batches
+            verdicts = spell_batch(["demat", "d'an", "hol"], chunk_size=1, executor=executor)
+            assert verdicts == {"demat": True, "d'an": True, "hol": False}
+            assert executor.chunks == 5
+            results = get_hspell_mistakes_batch(["Demat d'an hol."], executor=executor)
+            assert results[0][1] == 1
+    finally:
+        hspell._hs = hs
+        clear_spell_cache()
@@ -0,0 +1,63 @@
+from ostilhou.hspell.wordforms import (
+    expand_hunspell_dictionary, write_wordforms, WordformSet,
+)
+
+
+AFF = """SET UTF-8
+FLAG long
+
+PFX m0 Y 2
+PFX m0 k g k
+PFX m0 t d t
+
+SFX n1 Y 3
+SFX n1 0 où [^z]
+SFX n1 z zioù z
+SFX n1 0 ig .
+"""
+
+DIC = """4
+kazh/m0n1
+ti/n1
+taol/m0
+Breizh
+"""
+
+
+def test_expand_dictionary(tmp_path):
+    (tmp_path / "test.aff").write_text(AFF, encoding="utf-8")
+    (tmp_path / "test.dic").write_text(DIC, encoding="utf-8")
+
+    forms = set(expand_hunspell_dictionary(tmp_path / "test.dic", tmp_path / "test.aff"))
+    assert forms == {
+        "kazh", "gazh", "kazhoù", "kazhig", "gazhoù", "gazhig",
+        "ti", "tioù", "tiig",
+        "taol", "daol",
+        "Breizh",
+    }
+
+
+
+def test_wordform_set(tmp_path):
+    path = str(tmp_path / "test.wordforms")
+    forms = ["kazh", "kazhoù", "Breizh", "demat", "d'an", "holl", "kazh"]
+    assert write_wordforms(forms, path) == 6
+
+    wordforms = WordformSet(path)
+    assert len(wordforms) == 6
+    assert list(wordforms) == sorted(set(forms))
+    assert "kazhoù" in wordforms
+    assert "kazho" not in wordforms
+
+    assert wordforms.spell("demat")
+    assert wordforms.spell("Demat")     # Capitalized
+    assert wordforms.spell("DEMAT")     # All caps
+    assert wordforms.spell("BREIZH")
+    assert not wordforms.spell("breizh")
+    assert not wordforms.spell("dEmat")
+    assert wordforms.spell("D'an")
+    assert wordforms.spell("1984")
+    assert wordforms.spell("demat.")
+    assert wordforms.spell("kazh-holl")
+    assert not wordforms.spell("kazh-hol")
+    wordforms.close()
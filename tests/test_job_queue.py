@@ -0,0 +1,115 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+from ostilhou.asr import job_queue
+from ostilhou.asr.job_queue import JobQueue, DONE, FAILED
+
+
+
+def bursts(n: int, seed=0) -> np.ndarray:
+    """ Bursts of noise of 3 seconds, separated by silences """
+    sr = 16000
+    rng = np.random.default_rng(seed)
+    silence = np.zeros(sr // 2, dtype=np.int16)
+    parts = [ rng.normal(0, 3000, sr * 3).astype(np.int16) for _ in range(n) ]
+    return np.concatenate([ part for b in parts for part in (b, silence) ])
+
+
+def fake_decode(task):
+    """ One word per chunk, named after its start time """
+    data, offset, _ = task
+    duration = len(data) / 32000
+    return [ { "word": f"w{offset:.2f}", "start": offset + 0.1, "end": offset + duration - 0.1, "conf": 1.0 } ]
+
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    audio = { str(tmp_path / f"{name}.mp3"): bursts(n, i) for i, (name, n) in enumerate([("a", 6), ("b", 4)]) }
+    for path in audio:
+        open(path, 'wb').write(b'0' * 1000)
+    audio[str(tmp_path / "empty.mp3")] = np.zeros(0, dtype=np.int16)
+    open(tmp_path / "empty.mp3", 'wb').close()
+
+    monkeypatch.setattr(job_queue, "_load_samples", lambda path: audio[path])
+    monkeypatch.setattr(job_queue, "load_model", lambda name=None: None)
+    q = JobQueue(str(tmp_path / "queue.sqlite"))
+    assert q.add(sorted(audio), output_dir=str(tmp_path / "out")) == 3
+    assert q.add(sorted(audio)) == 0
+    yield q
+    q.close()
+
+
+
+def test_resume(queue, tmp_path):
+    calls = []
+
+    def crashing_decode(task):
+        if len(calls) == 4:
+            raise KeyboardInterrupt
+        calls.append(task[1])
+        return fake_decode(task)
+
+    with pytest.raises(KeyboardInterrupt):
+        queue.run(max_length=5.0, decode=crashing_decode)
+    stats = queue.stats()
+    assert stats["jobs"][DONE] == 0 and stats["audio_done"] > 0
+    assert stats["throughput"] is not None and stats["eta"] is not None
+
+    # Reopen the queue, as after a crash
+    queue = JobQueue(queue.path)
+    decoded = []
+    def counting_decode(task):
+        decoded.append(task[1])
+        return fake_decode(task)
+    queue.run(max_length=5.0, decode=counting_decode)
+
+    # Chunks are decoded only once
+    assert not set(calls).intersection(decoded[:2])
+    assert len(calls) + len(decoded) == 10
+
+    jobs = { os.path.basename(j["path"]): j for j in queue.jobs() }
+    assert jobs["a.mp3"]["status"] == DONE and jobs["b.mp3"]["status"] == DONE
+    assert jobs["empty.mp3"]["status"] == FAILED
+    with open(jobs["a.mp3"]["output"]) as f:
+        tokens = json.load(f)
+    assert len(tokens) == 6
+    assert all( t1["end"] < t2["start"] for t1, t2 in zip(tokens[:-1], tokens[1:]) )
+
+    stats = queue.stats()
+    assert stats["audio_remaining"] == 0 and stats["eta"] == 0
+    assert stats["audio_done"] == pytest.approx(jobs["a.mp3"]["duration"] + jobs["b.mp3"]["duration"])
+
+    assert queue.retry_failed() == 1
+    queue.close()
+
+
+
+def test_failed_chunk(queue):
+    def failing_decode(task):
+        if task[1] > 15:    # Only in the longest file
+            raise RuntimeError("decoding error")
+        return fake_decode(task)
+
+    queue.run(max_length=5.0, decode=failing_decode)
+    status = { os.path.basename(j["path"]): (j["status"], j["error"]) for j in queue.jobs() }
+    assert status["a.mp3"][0] == FAILED and "decoding error" in status["a.mp3"][1]
+    assert status["b.mp3"][0] == DONE
+
+
+
+def test_worker_pool(queue, tmp_path, monkeypatch):
+    import multiprocessing
+    from ostilhou.asr import models
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("fork start method is not available")
+    monkeypatch.setattr(models, "_loaded_model", object())
+
+    queue.run(workers=3, max_length=5.0, decode=fake_decode)
+    assert [ j["status"] for j in queue.jobs() ] == [DONE, DONE, FAILED]
+    with open(tmp_path / "out" / "b.json") as f:
+        assert len(json.load(f)) == 4
@@ -0,0 +1,128 @@
+import io
+import json
+
+import pytest
+from pydub import AudioSegment
+
+from ostilhou.asr import recognizer
+from ostilhou.asr.recognizer import RecognizerPool, decode_stream
+from ostilhou.asr.metrics import (
+    MemorySink, JsonLinesSink,
+    add_metrics_sink, remove_metrics_sink,
+    measure, read_metrics, summarize, CallMetrics,
+)
+
+
+
+class Model:
+    pass
+
+
+class CountingRecognizer:
+    """ Ends an utterance every 2 chunks """
+
+    def __init__(self, model=None, sample_rate=16000):
+        self.n = 0
+
+    def SetWords(self, enable):
+        pass
+
+    def Reset(self):
+        self.n = 0
+
+    def AcceptWaveform(self, data):
+        self.n += 1
+        return self.n % 2 == 0
+
+    def Result(self):
+        return json.dumps({"text": str(self.n)})
+
+    def FinalResult(self):
+        return json.dumps({"text": "final"})
+
+
+
+@pytest.fixture
+def sink():
+    sink = add_metrics_sink(MemorySink())
+    yield sink
+    remove_metrics_sink(sink)
+
+
+
+def test_no_sink():
+    rec = CountingRecognizer()
+    with measure("test") as metrics:
+        assert metrics.wrap_recognizer(rec) is rec
+
+
+
+def test_measure_stream(sink):
+    data = bytes(32000 * 3)     # 3 seconds of audio
+    with measure("test") as metrics:
+        results = list(decode_stream(
+            metrics.wrap_recognizer(CountingRecognizer()),
+            metrics.wrap_stream(io.BytesIO(data)),
+            4000
+        ))
+    assert len(results) == 13
+
+    record, = sink.records
+    assert record["function"] == "test"
+    assert record["bytes"] == len(data)
+    assert record["chunks"] == 24
+    assert record["audio_duration"] == pytest.approx(3.0)
+    assert record["wall_time"] >= record["decode_time"] + record["read_time"]
+    assert record["rtf"] == pytest.approx(record["wall_time"] / 3.0)
+
+
+def test_failed_call_not_recorded(sink):
+    with pytest.raises(RuntimeError):
+        with measure("test"):
+            raise RuntimeError
+    assert sink.records == []
+
+
+
+def test_transcribe_segment(sink, monkeypatch):
+    monkeypatch.setattr(recognizer, "load_model", lambda: Model())
+    monkeypatch.setattr(recognizer, "recognizer_pool", RecognizerPool(factory=CountingRecognizer))
+
+    segment = AudioSegment(bytes(16000), sample_width=2, frame_rate=16000, channels=1)
+    assert recognizer.transcribe_segment(segment, chunk_size=4000) == ["2", "final"]
+    record, = sink.records
+    assert record["function"] == "transcribe_segment"
+    assert record["audio_duration"] == pytest.approx(0.5)
+    assert record["chunks"] == 4
+
+
+
+def test_json_lines_sink(tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    sink = add_metrics_sink(JsonLinesSink(path))
+    try:
+        for _ in range(3):
+            with measure("test") as metrics:
+                metrics.wrap_recognizer(CountingRecognizer()).AcceptWaveform(bytes(3200))
+    finally:
+        remove_metrics_sink(sink)
+
+    records = list(read_metrics(path))
+    assert len(records) == 3
+    summary = summarize(records)
+    assert summary["calls"] == 3
+    assert summary["audio_duration"] == pytest.approx(0.3)
+    assert set(summary["fields"]["rtf"]) == {"mean", "p50", "p90", "p99", "max"}
+    assert summarize([])["rtf"] is None
+
+
+
+def test_merge_worker_counters(sink):
+    worker = CallMetrics("worker")
+    worker.wrap_recognizer(CountingRecognizer()).AcceptWaveform(bytes(32000))
+    with measure("test") as metrics:
+        metrics.merge(worker.counters())
+        metrics.merge(worker.counters())
+    record, = sink.records
+    assert record["audio_duration"] == pytest.approx(2.0)
+    assert record["chunks"] == 2
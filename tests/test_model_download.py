@@ -1,4 +1,15 @@
+import os
+import io
+import hashlib
+import zipfile
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from ostilhou.asr import models
 from ostilhou.asr.models import load_model, get_all_models
+from ostilhou.asr.models import _download, _ZipStreamExtractor, _is_valid_vosk_model
 
 
 
@@ -6,4 +17,139 @@ def test_show_models():
     print(get_all_models())
 
 def test_load_model():
-    model = load_model("vosk-br-0.7")
\ No newline at end of file
+    model = load_model("vosk-br-0.7")
+
+
+
+_VOSK_FILES = [
+    "am/final.mdl", "graph/HCLG.fst", "ivector/final.dubm", "ivector/final.ie", "ivector/final.mat",
+    "ivector/global_cmvn.stats", "ivector/online_cmvn.conf", "ivector/splice.conf",
+    "graph/phones/word_boundary.int", "conf/mfcc.conf",
+]
+
+
+def fake_model_zip(name: str) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(f"{name}/", b'')
+        for i, path in enumerate(_VOSK_FILES):
+            archive.writestr(f"{name}/{path}", os.urandom(20000) + bytes(i) * 20000)
+    return buffer.getvalue()
+
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        data = server.data
+        start = 0
+        range_header = self.headers.get("Range")
+        server.ranges.append(range_header)
+        if range_header and server.accept_ranges:
+            start = int(range_header.split('=')[1].split('-')[0])
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(data)-1}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data) - start))
+        self.send_header("ETag", '"fake-model"')
+        self.end_headers()
+        end = len(data)
+        if server.cut_at is not None:
+            end, server.cut_at = server.cut_at, None
+        self.wfile.write(data[start:end])
+        self.wfile.flush()
+        self.close_connection = True
+
+
+@pytest.fixture
+def server(monkeypatch):
+    httpd = HTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.data = fake_model_zip("fake-model")
+    httpd.ranges = []
+    httpd.accept_ranges = True
+    httpd.cut_at = None
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{httpd.server_address[1]}/fake-model.zip"
+    monkeypatch.setattr(models, "_model_list", [
+        { "name": "fake-model", "type": "vosk", "version": "0.1", "url": url },
+    ])
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+
+def test_download(server, tmp_path):
+    sha256 = hashlib.sha256(server.data).hexdigest()
+    path = _download("fake-model", str(tmp_path), sha256=sha256)
+    assert path == str(tmp_path / "fake-model")
+    assert _is_valid_vosk_model(path)
+    assert sorted(os.listdir(tmp_path)) == ["fake-model"]
+    with zipfile.ZipFile(io.BytesIO(server.data)) as archive:
+        assert archive.read("fake-model/am/final.mdl") == open(tmp_path / "fake-model/am/final.mdl", 'rb').read()
+
+
+def test_resume_download(server, tmp_path):
+    server.cut_at = len(server.data) // 2
+    with pytest.raises(ConnectionError):
+        _download("fake-model", str(tmp_path), retries=0)
+    assert not os.path.exists(tmp_path / "fake-model")
+    assert os.path.isdir(tmp_path / ".fake-model.part")
+
+    path = _download("fake-model", str(tmp_path))
+    assert _is_valid_vosk_model(path)
+    assert server.ranges[0] is None
+    offset = int(server.ranges[1].split('=')[1].rstrip('-'))
+    assert 0 < offset <= len(server.data) // 2
+    assert sorted(os.listdir(tmp_path)) == ["fake-model"]
+
+
+def test_resume_not_supported(server, tmp_path):
+    server.cut_at = len(server.data) // 2
+    server.accept_ranges = False
+    path = _download("fake-model", str(tmp_path), retries=1)
+    assert _is_valid_vosk_model(path)
+    assert server.ranges[1] is not None
+
+
+def test_checksum_mismatch(server, tmp_path):
+    with pytest.raises(RuntimeError, match="Checksum"):
+        _download("fake-model", str(tmp_path), sha256="0" * 64)
+    assert os.listdir(tmp_path) == []
+
+
+def test_data_descriptors(tmp_path):
+    # Archives written to a non-seekable stream have sizes after the data
+    class Unseekable(io.RawIOBase):
+        def __init__(self):
+            self.data = bytearray()
+        def writable(self):
+            return True
+        def write(self, b):
+            self.data += b
+            return len(b)
+
+    output = Unseekable()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for i in range(3):
+            with archive.open(f"dir/file{i}.txt", 'w') as f:
+                f.write(b"kenavo " * 1000 * (i + 1))
+    data = bytes(output.data)
+
+    extractor = _ZipStreamExtractor(str(tmp_path))
+    for i in range(0, len(data), 100):
+        extractor.feed(data[i:i+100])
+    assert extractor.done
+    for i in range(3):
+        assert open(tmp_path / f"dir/file{i}.txt", 'rb').read() == b"kenavo " * 1000 * (i + 1)
+
+    # Corrupted data
+    corrupted = bytearray(data)
+    corrupted[60] ^= 0xFF
+    with pytest.raises(Exception):
+        _ZipStreamExtractor(str(tmp_path / "corrupted")).feed(bytes(corrupted))
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+
+import pytest
+
+from ostilhou.asr import models
+from ostilhou.asr.models import ModelRegistry, scan_model_dir, _is_valid_vosk_model
+
+
+
+def fake_model(root, name: str, size: int) -> str:
+    path = os.path.join(root, name)
+    for filename in models._VOSK_MODEL_FILES:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, filename), 'wb') as f:
+            f.write(b'0' * (size // len(models._VOSK_MODEL_FILES)))
+    return path
+
+
+class FakeModel:
+    def __init__(self, path):
+        self.path = path
+
+
+@pytest.fixture
+def loads():
+    return []
+
+
+@pytest.fixture
+def registry(loads):
+    def loader(path):
+        loads.append(os.path.basename(path))
+        return FakeModel(path)
+    return ModelRegistry(memory_budget=2500, loader=loader)
+
+
+
+def test_lru_eviction(registry, loads, tmp_path):
+    a, b, c = ( fake_model(tmp_path, name, 1080) for name in "abc" )
+
+    with registry.use(a) as model_a:
+        assert registry.acquire(a) is model_a
+        registry.release(a)
+    with registry.use(b):
+        pass
+    assert loads == ['a', 'b']
+    assert registry.memory_used == 2160
+
+    with registry.use(a):
+        pass
+    # 'b' is the least recently used
+    with registry.use(c):
+        pass
+    assert loads == ['a', 'b', 'c']
+    assert [ os.path.basename(p) for p in registry.loaded_models() ] == ['a', 'c']
+
+    with pytest.raises(ValueError):
+        registry.release(b)
+
+    registry.clear()
+    assert registry.loaded_models() == []
+
+
+def test_model_in_use(registry, loads, tmp_path):
+    a, b, c = ( fake_model(tmp_path, name, 1080) for name in "abc" )
+
+    with registry.use(a), registry.use(b), registry.use(c):
+        # Over budget, but every model is in use
+        assert len(registry.loaded_models()) == 3
+    assert len(registry.loaded_models()) == 2
+
+    registry.set_memory_budget(None)
+    for path in (a, b, c):
+        with registry.use(path):
+            pass
+    assert len(registry.loaded_models()) == 3
+
+
+def test_concurrent_loading(tmp_path):
+    path = fake_model(tmp_path, "a", 1000)
+    loads = []
+
+    def slow_loader(path):
+        loads.append(path)
+        time.sleep(0.1)
+        return FakeModel(path)
+
+    registry = ModelRegistry(loader=slow_loader)
+    results = []
+    threads = [ threading.Thread(target=lambda: results.append(registry.acquire(path))) for _ in range(8) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert len(results) == 8 and all( model is results[0] for model in results )
+
+
+def test_load_model_keeps_previous(tmp_path, monkeypatch):
+    a, b = fake_model(tmp_path, "a", 1000), fake_model(tmp_path, "b", 1000)
+    loads = []
+    def loader(path):
+        loads.append(os.path.basename(path))
+        return FakeModel(path)
+
+    monkeypatch.setattr(models, "model_registry", ModelRegistry(loader=loader))
+    monkeypatch.setattr(models, "_loaded_model", None)
+    monkeypatch.setattr(models, "_loaded_model_name", "")
+    monkeypatch.setattr(models, "_loaded_model_path", None)
+
+    for path in (a, b, a, b):
+        assert models.load_model(path).path == path
+        assert models.load_model() is models.load_model(path)
+    assert loads == ['a', 'b']
+
+    with models.use_model(a) as model:
+        assert model.path == a
+        assert models.get_loaded_model_name() == b
+
+
+def test_valid_model_cache(tmp_path, monkeypatch):
+    path = fake_model(tmp_path, "model", 900)
+    assert _is_valid_vosk_model(path)
+
+    # Cached scans don't walk the model tree
+    walks = []
+    real_walk = os.walk
+    monkeypatch.setattr(os, "walk", lambda *args: walks.append(args) or real_walk(*args))
+    assert _is_valid_vosk_model(path)
+    assert scan_model_dir(path)["size"] == 900
+    assert walks == []
+    assert not _is_valid_vosk_model(str(tmp_path / "missing"))
+
+    # Model file overwritten in place
+    mdl = os.path.join(path, "final.mdl")
+    with open(mdl, 'wb') as f:
+        f.write(b'1' * 500)
+    os.utime(mdl, ns=(0, 10**9))
+    assert scan_model_dir(path)["size"] == 1300
+    assert len(walks) == 1
+
+    # Model copied file by file, in subfolders
+    path = str(tmp_path / "copied")
+    os.makedirs(os.path.join(path, "am"))
+    os.makedirs(os.path.join(path, "conf"))
+    assert not _is_valid_vosk_model(path)
+    for i, filename in enumerate(sorted(models._VOSK_MODEL_FILES)):
+        with open(os.path.join(path, "am" if i % 2 else "conf", filename), 'wb') as f:
+            f.write(b'0' * 10)
+    assert _is_valid_vosk_model(path)
+    assert scan_model_dir(path)["size"] == 10 * len(models._VOSK_MODEL_FILES)
@@ -0,0 +1,202 @@
+import os
+import io
+import json
+import time
+import shutil
+import subprocess
+
+import pytest
+
+from ostilhou.asr import recognizer
+from ostilhou.asr.recognizer import RecognizerPool, transcribe_stream_live
+from ostilhou.asr.partials import PartialPolicy
+from ostilhou.asr.metrics import MemorySink, add_metrics_sink, remove_metrics_sink
+
+
+
+class Clock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+
+class RealTimeStream:
+    """ Plays back recorded audio (16kHz mono s16le) at real-time pace """
+
+    def __init__(self, data: bytes, sample_rate=16000):
+        self._stream = io.BytesIO(data)
+        self._bytes_per_second = 2 * sample_rate
+        self._start = None
+        self._sent = 0
+
+    def readinto(self, buffer) -> int:
+        if self._start is None:
+            self._start = time.monotonic()
+        # Wait until the audio of the chunk has been "recorded"
+        delay = self._start + (self._sent + len(buffer)) / self._bytes_per_second - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        n = self._stream.readinto(buffer)
+        self._sent += n
+        return n
+
+
+
+class Model:
+    pass
+
+
+class CountingRecognizer:
+    """
+    A new word every 4000 bytes (0.125s), the last word of the partial result
+    is rewritten once before settling, an utterance ends every 16 words.
+    """
+
+    def __init__(self, model=None, sample_rate=16000):
+        self.Reset()
+
+    def SetWords(self, enable):
+        pass
+
+    def Reset(self):
+        self.n_bytes = 0
+        self.offset = 0.0
+
+    def _words(self):
+        return [ f"w{i}" for i in range(self.n_bytes // 4000) ]
+
+    def AcceptWaveform(self, data):
+        self.n_bytes += len(data)
+        return len(self._words()) == 16
+
+    def PartialResult(self):
+        words = self._words()
+        if words and self.n_bytes % 4000 < 2000:
+            words[-1] = "x"
+        return json.dumps({"partial": ' '.join(words)})
+
+    def _result(self):
+        words = self._words()
+        tokens = [
+            {"word": w, "start": self.offset + i * 0.125, "end": self.offset + (i + 1) * 0.125, "conf": 1.0}
+            for i, w in enumerate(words)
+        ]
+        self.offset += self.n_bytes / 32000
+        self.n_bytes = 0
+        return json.dumps({"text": ' '.join(words), "result": tokens})
+
+    def Result(self):
+        return self._result()
+
+    def FinalResult(self):
+        return self._result()
+
+
+
+def test_policy():
+    clock = Clock()
+    policy = PartialPolicy(interval=0.5, stability=2, clock=clock)
+
+    emitted = []
+    for i, text in enumerate(["a", "a b", "a b", "a b c", "a b c d", "a b c d", "a b c d e"]):
+        clock.t = i * 0.3
+        policy.chunk(9600)      # 0.3s of audio
+        emitted.append(policy.partial(text))
+    texts = [ e["text"] if e else None for e in emitted ]
+    # No more than one partial result every 0.5s, unchanged results are not emitted
+    assert texts == ["a", None, "a b", None, "a b c d", None, "a b c d e"]
+    assert emitted[0]["stable"] == "" and emitted[0]["unstable"] == "a"
+    assert emitted[2]["stable"] == "a b" and emitted[2]["unstable"] == ""
+    assert emitted[4]["stable"] == "a b c" and emitted[4]["unstable"] == "d"
+    assert emitted[6]["stable"] == "a b c d" and emitted[6]["unstable"] == "e"
+
+    clock.t = 2.0
+    policy.final({"text": "a b c d e", "result": [
+        {"word": w, "start": i * 0.3, "end": (i + 1) * 0.3, "conf": 1.0} for i, w in enumerate("abcde")
+    ]})
+    # 'a' emitted as stable at 0.6s, its audio arrived at 0.0s
+    assert policy.latencies[0] == pytest.approx(0.6)
+    # 'e' only emitted with the final result, its audio arrived at 1.2s
+    assert policy.latencies[-1] == pytest.approx(0.8)
+
+
+
+def test_policy_stable_prefix():
+    policy = PartialPolicy(interval=0, stability=2, clock=Clock())
+    policy.partial("a b")
+    assert policy.partial("a b")["stable"] == "a b"
+    # The stable prefix is never taken back before the end of the utterance
+    partial = policy.partial("a c d")
+    assert partial["stable"] == "a b" and partial["unstable"] == "d"
+    policy.final({"text": "a c d"})
+    assert policy.partial("e")["stable"] == ""
+
+
+
+def test_policy_stable_only():
+    clock = Clock()
+    policy = PartialPolicy(interval=0, stability=2, stable_only=True, clock=clock)
+    policy.chunk(1000)
+    assert policy.partial("a") is None
+    assert policy.partial("a b")["stable"] == "a"
+    assert policy.partial("a c") is None
+
+
+
+def test_live_playback(monkeypatch):
+    monkeypatch.setattr(recognizer, "recognizer_pool", RecognizerPool(factory=CountingRecognizer))
+    sink = add_metrics_sink(MemorySink())
+    results = []
+    try:
+        # 3 seconds of audio, played back at real-time pace
+        policy = transcribe_stream_live(
+            RealTimeStream(bytes(96000)), results.append,
+            PartialPolicy(interval=0.3), Model(), chunk_size=2000
+        )
+    finally:
+        remove_metrics_sink(sink)
+
+    partials = [ r for r in results if r["partial"] ]
+    finals = [ r for r in results if not r["partial"] ]
+    assert [ len(r["words"]) for r in finals ] == [16, 8]
+    assert finals[1]["words"][0]["start"] == pytest.approx(2.0)
+
+    # Partial results are throttled, and their stable prefix only grows within an utterance
+    assert 4 <= len(partials) <= 12
+    for p1, p2 in zip(partials[:-1], partials[1:]):
+        if len(p2["text"].split()) >= len(p1["text"].split()):
+            assert p2["stable"].startswith(p1["stable"])
+    assert all( "x" not in p["stable"].split() for p in partials )
+
+    # Words are emitted shortly after their audio arrived
+    assert len(policy.latencies) == 24
+    assert 0 <= min(policy.latencies) and max(policy.latencies) < 1.0
+    record = sink.records[0]
+    assert record["function"] == "transcribe_stream_live"
+    assert record["word_latency"] == pytest.approx(sum(policy.latencies) / 24)
+
+
+
+def test_live_playback_model():
+    from ostilhou.asr import load_model
+
+    if not shutil.which("ffmpeg"):
+        pytest.skip("ffmpeg is not available")
+    try:
+        load_model()
+    except Exception:
+        pytest.skip("No Vosk model available")
+
+    audio_path = os.path.join(os.path.dirname(__file__), "27782.mp3")
+    data = subprocess.run(
+        ["ffmpeg", "-loglevel", "quiet", "-i", audio_path, "-t", "5", "-ar", "16000", "-ac", "1", "-f", "s16le", "-"],
+        stdout=subprocess.PIPE
+    ).stdout
+    results = []
+    policy = transcribe_stream_live(RealTimeStream(data), results.append, PartialPolicy(interval=0.25))
+    partials = [ r for r in results if r["partial"] ]
+    assert partials and any( not r["partial"] for r in results )
+    assert policy.latencies and max(policy.latencies) < 2.0
@@ -22,4 +22,68 @@ def test_phonetize():
 
     # Single letters spelled out
     assert phonetize("B") == ['B E']
-    assert phonetize("Ñ") == ['EH N T I L D E']
\ No newline at end of file
+    assert phonetize("Ñ") == ['EH N T I L D E']
+
+
+def test_phonetize_graphemes_trie():
+    from ostilhou.asr import _phonetize_graphemes, _phonetize_graphemes_sliced
+
+    for word in ["bepred", "c'hoazh", "Penn", "gouzañv", "xyz!", "İstanbul", "ul", "pellocʼh"]:
+        assert _phonetize_graphemes(word) == _phonetize_graphemes_sliced(word)
+
+
+
+def test_phonetize_memoized():
+    prons, _ = phonetize_word("Marie-Jeanne")
+    prons.append("X")
+    assert phonetize_word("Marie-Jeanne")[0] == ['M A R I J A N']
+
+
+
+def test_pronunciation_store(tmp_path):
+    from ostilhou.asr import PronunciationStore, phonetize_words
+
+    path = str(tmp_path / "lexicon.sqlite")
+    digests = {"gwin": "a", "bara": "b"}
+    with PronunciationStore(path, rules_hash="v1", digests=digests) as store:
+        prons = phonetize_words(["bepred", "Marie-Jeanne", "bara", "bepred"], store)
+        assert prons["Marie-Jeanne"] == phonetize_word("Marie-Jeanne")
+        assert len(store) == 3
+
+    with PronunciationStore(path, rules_hash="v1", digests=digests) as store:
+        assert store.get_many(["bepred", "unknown"]) == {"bepred": phonetize_word("bepred")}
+
+    # Only the words affected by a modified lexicon entry are dropped
+    with PronunciationStore(path, rules_hash="v1", digests={"gwin": "a", "bara": "c"}) as store:
+        assert set(store.get_many(["bepred", "Marie-Jeanne", "bara"])) == {"bepred", "Marie-Jeanne"}
+
+    with PronunciationStore(path, rules_hash="v1", digests={"bara": "c", "jeanne": "d"}) as store:
+        assert set(store.get_many(["bepred", "Marie-Jeanne", "bara"])) == {"bepred"}
+
+    # Everything is dropped when the phonetization rules change
+    with PronunciationStore(path, rules_hash="v2", digests=digests) as store:
+        assert len(store) == 0
+
+
+
+def test_build_lexicon(tmp_path):
+    from ostilhou.asr import PronunciationStore, build_lexicon
+
+    words = ["bepred", "Marie-Jeanne", "gouzañv", "tra-mañ-tra", "QR", "bara"] * 3
+    path_1 = str(tmp_path / "lexicon_1.txt")
+    path_4 = str(tmp_path / "lexicon_4.txt")
+    phones_1 = build_lexicon(words, path_1, special_tokens={"<UNK>": "SPN"})
+    with PronunciationStore(str(tmp_path / "lexicon.sqlite")) as store:
+        phones_4 = build_lexicon(
+            words, path_4, store=store, workers=4, chunk_size=2, special_tokens={"<UNK>": "SPN"}
+        )
+        assert len(store) == 6
+
+    with open(path_1, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    with open(path_4, 'r', encoding='utf-8') as f:
+        assert f.readlines() == lines
+    assert phones_1 == phones_4
+    assert lines[0] == "<UNK> SPN\n"
+    assert lines[1] == "Marie-Jeanne M A R I J A N\n"
+    assert "SPN" not in phones_1 and {'M', 'A', 'R'} <= phones_1
@@ -2,6 +2,8 @@ from typing import List
 from ostilhou.asr.post_processing import (
     post_process_timecoded,
     post_process_text,
+    SubstitutionTrie,
+    StreamingPostProcessor,
 )
 
 
@@ -47,4 +49,66 @@ def test_post_process_timecoded():
     
     for test in test_cases:
         should_be(test[0], test[1])
-    
\ No newline at end of file
+    
+
+
+def test_substitution_trie():
+    trie = SubstitutionTrie()
+    trie.add(["penn", "ar", "bed"], ["Penn-ar-Bed"])
+    trie.add(["a", "hend", "all"], ["a-hend-all"])
+    trie.add(["a", "hend", "all", "ha", "kement", "all"], ["a-hend-all", "ha", "kement-all"])
+    trie.add(["hend"], ["hent"])
+
+    assert len(trie) == 4
+    assert trie.max_len == 6
+    assert ["PENN", "Ar", "bed"] in trie
+    assert trie.substitute("e Penn ar bed".split()) == ["e", "Penn-ar-Bed"]
+    assert trie.substitute("a hend all ha kement all".split()) == ["a-hend-all", "ha", "kement-all"]
+    assert trie.substitute("a hend all ha kement".split()) == ["a-hend-all", "ha", "kement"]
+    assert trie.substitute("ur hend".split()) == ["ur", "hent"]
+
+
+
+def test_streaming_post_process():
+    def tokenize(s: str) -> List[dict]:
+        return [{"word":t, "start":2*i, "end":2*i+1, "conf":1.0} for i, t in enumerate(s.split())]
+    
+    for sentence, _ in test_cases:
+        tokens = tokenize(sentence)
+        expected = post_process_timecoded(tokens, normalize=True, keep_fillers=False)
+        for chunk_size in (1, 2, 3):
+            post_processor = StreamingPostProcessor(normalize=True, keep_fillers=False)
+            result = []
+            for i in range(0, len(tokens), chunk_size):
+                result.extend(post_processor.push(tokens[i:i+chunk_size]))
+            result.extend(post_processor.flush())
+            assert result == expected
+
+
+
+def test_streaming_post_process_window():
+    def tokenize(words: List[str]) -> List[dict]:
+        return [{"word":t, "start":2*i, "end":2*i+1, "conf":1.0} for i, t in enumerate(words)]
+
+    sentences = [
+        "tri den ha daou gazh a zo er gêr",
+        "tri kazh ha daou besk",
+        "daou vloaz warn-ugent",
+    ]
+    for sentence in sentences:
+        tokens = tokenize(sentence.split())
+        expected = post_process_timecoded(tokens, normalize=True, keep_fillers=False)
+        post_processor = StreamingPostProcessor(normalize=True, keep_fillers=False)
+        result = []
+        for token in tokens:
+            result.extend(post_processor.push([token]))
+        result.extend(post_processor.flush())
+        assert result == expected
+
+    # Long runs of nouns or number words are not held back until the end
+    for word in ("kazh", "daou"):
+        post_processor = StreamingPostProcessor(normalize=True, keep_fillers=False)
+        emitted = 0
+        for token in tokenize([word] * 2000):
+            emitted += len(post_processor.push([token]))
+        assert emitted >= 2000 - 64
@@ -0,0 +1,488 @@
+import os
+import json
+
+import numpy as np
+import pytest
+from pydub import AudioSegment
+
+from ostilhou.asr.recognizer import RecognizerPool, _vosk_ffi
+
+
+
+class Model:
+    pass
+
+
+class DummyRecognizer:
+    def __init__(self, model, sample_rate):
+        self.sample_rate = sample_rate
+        self.words = False
+        self.resets = 0
+
+    def SetWords(self, enable):
+        self.words = enable
+
+    def Reset(self):
+        self.resets += 1
+
+
+
+def test_recognizer_pool():
+    pool = RecognizerPool(max_idle=2, factory=DummyRecognizer)
+    model = Model()
+
+    with pool.recognizer(model) as rec:
+        assert rec.words and rec.sample_rate == 16000
+    with pool.recognizer(model) as rec2:
+        assert rec2 is rec
+    assert rec.resets == 2
+    assert pool.created == 1
+
+    # Different configurations get different recognizers
+    with pool.recognizer(model, 8000) as rec3:
+        assert rec3 is not rec
+    with pool.recognizer(model, words=False) as rec4:
+        assert rec4 is not rec and not rec4.words
+    with pool.recognizer(Model()) as rec5:
+        assert rec5 is not rec
+    assert pool.created == 4
+
+    # Recognizers in use are never handed out twice
+    acquired = [ pool.acquire(model) for _ in range(3) ]
+    assert len(set(map(id, acquired))) == 3
+    for r in acquired:
+        pool.release(r, model)
+    assert len(pool._idle[(id(model), 16000, True)]) == 2
+
+    # Recognizers are released on errors
+    with pytest.raises(ValueError):
+        with pool.recognizer(model) as rec:
+            raise ValueError
+    assert rec in pool._idle[(id(model), 16000, True)]
+
+    # Idle recognizers are dropped with their model
+    model_id = id(model)
+    del model
+    assert all( key[0] != model_id for key in pool._idle )
+
+
+
+def test_recognizer_pool_identical_results():
+    from vosk import KaldiRecognizer
+    from ostilhou.asr import load_model
+    from ostilhou.asr.recognizer import transcribe_segment_timecoded, recognizer_pool
+
+    try:
+        model = load_model()
+    except Exception:
+        pytest.skip("No Vosk model available")
+
+    rng = np.random.default_rng(0)
+    segments = [
+        AudioSegment(
+            rng.normal(0, 1000, 16000 * 2).astype(np.int16).tobytes(),
+            frame_rate=16000, sample_width=2, channels=1
+        )
+        for _ in range(5)
+    ]
+
+    created = recognizer_pool.created
+    for segment in segments * 2:
+        recognizer = KaldiRecognizer(model, 16000)
+        recognizer.SetWords(True)
+        data = segment.raw_data
+        expected = []
+        i = 0
+        while i + 4000 < len(data):
+            if recognizer.AcceptWaveform(data[i:i+4000]):
+                expected.extend(json.loads(recognizer.Result()).get("result", []))
+            i += 4000
+        recognizer.AcceptWaveform(data[i:])
+        expected.extend(json.loads(recognizer.FinalResult()).get("result", []))
+        assert transcribe_segment_timecoded(segment) == expected
+    assert recognizer_pool.created <= created + 1
+
+
+
+class RecordingRecognizer(DummyRecognizer):
+    """ Ends an utterance every 3 chunks """
+
+    def __init__(self, model=None, sample_rate=16000):
+        super().__init__(model, sample_rate)
+        self.chunks = []
+
+    def AcceptWaveform(self, data):
+        # Chunks are given as bytes, or cffi buffers wrapping the audio memory
+        if not isinstance(data, bytes):
+            data = _vosk_ffi.buffer(data)[:]
+        self.chunks.append(data)
+        return len(self.chunks) % 3 == 0
+
+    def Result(self):
+        return json.dumps({"text": str(len(self.chunks))})
+
+    def FinalResult(self):
+        return json.dumps({"text": "final"})
+
+
+
+def test_decode_buffer():
+    from ostilhou.asr.recognizer import decode_buffer
+
+    data = bytes(range(256)) * 100
+    for chunk_size in (1000, 4000, 6400, 25600, 30000):
+        rec = RecordingRecognizer()
+        results = [ json.loads(r)["text"] for r in decode_buffer(rec, data, chunk_size) ]
+        assert b''.join(rec.chunks) == data
+        assert all( len(c) == chunk_size for c in rec.chunks[:-1] )
+        # The last chunk's result is given by `FinalResult`
+        n = len(rec.chunks)
+        assert results == [ str(i) for i in range(3, n, 3) ] + ["final"]
+
+    rec = RecordingRecognizer()
+    assert list(decode_buffer(rec, b'')) == [ '{"text": "final"}' ]
+    assert rec.chunks == [b'']
+
+
+
+def test_decode_stream():
+    import io
+    from ostilhou.asr.recognizer import decode_stream
+
+    data = bytes(range(256)) * 100
+    rec = RecordingRecognizer()
+    read = []
+    results = list(decode_stream(rec, io.BytesIO(data), 1000, read.append))
+    assert b''.join(rec.chunks) == data
+    assert read == [ len(c) for c in rec.chunks ]
+    assert [ json.loads(r)["text"] for r in results ] == [ str(i) for i in range(3, 26, 3) ] + ["final"]
+
+
+
+def test_decode_gated():
+    import io
+    from ostilhou.asr.recognizer import _decode_gated
+    from ostilhou.audio.audio_numpy import EnergyVAD, SpeechGate
+
+    class RegionRecognizer:
+        """ A single word per utterance, lasting as long as the audio fed """
+        def __init__(self):
+            self.n_bytes = 0
+        def AcceptWaveform(self, data):
+            self.n_bytes += len(data)
+            return False
+        def FinalResult(self):
+            end = self.n_bytes / 32000
+            return json.dumps({"result": [{"word": "w", "start": 0.0, "end": end, "conf": 1.0}]})
+        def Reset(self):
+            self.n_bytes = 0
+
+    sr = 16000
+    rng = np.random.default_rng(0)
+    silence = np.zeros(sr * 4, dtype=np.int16)
+    speech = rng.normal(0, 3000, sr * 2).astype(np.int16)
+    data = np.concatenate([silence, speech, silence, speech, silence]).tobytes()
+
+    gate = SpeechGate(EnergyVAD(), padding=0.3, min_silence=1.0)
+    read = []
+    results = list(_decode_gated(RegionRecognizer(), io.BytesIO(data), gate, 4000, read.append))
+    assert sum(read) == len(data)
+    assert len(results) == 2
+    # Word timecodes are relative to their region
+    words = [ (offset, json.loads(r)["result"][0]) for offset, r in results ]
+    assert words[0][0] == pytest.approx(3.7, abs=0.05)
+    assert words[1][0] == pytest.approx(9.7, abs=0.05)
+    assert words[0][1]["end"] == pytest.approx(2.6, abs=0.1)
+    assert gate.skipped_duration == pytest.approx(16 - 5.2, abs=0.1)
+
+
+
+def test_chunk_cuts():
+    from ostilhou.asr.chunking import silence_cuts, window_cuts
+
+    assert window_cuts(100, 10, 4.0, 1.0) == [(0, 40), (30, 70), (60, 100)]
+    assert window_cuts(75, 10, 4.0, 1.0) == [(0, 40), (30, 70), (60, 75)]
+    assert window_cuts(20, 10, 4.0, 1.0) == [(0, 20)]
+    with pytest.raises(ValueError):
+        window_cuts(100, 10, 2.0, 2.0)
+
+    # Bursts of noise separated by silences
+    sr = 16000
+    rng = np.random.default_rng(0)
+    silence = np.zeros(sr // 2, dtype=np.int16)
+    bursts = [ rng.normal(0, 3000, sr * 3).astype(np.int16) for _ in range(4) ]
+    samples = np.concatenate([ part for b in bursts for part in (b, silence) ])
+    ranges = silence_cuts(samples, sr, max_length=5.0)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(samples)
+    assert all( r1[1] == r2[0] for r1, r2 in zip(ranges[:-1], ranges[1:]) )
+    assert all( b - a <= 5.5 * sr for a, b in ranges )
+    # Cuts are in silences
+    for _, cut in ranges[:-1]:
+        assert not samples[cut - 100:cut + 100].any()
+
+
+
+def test_stitch_chunks():
+    from ostilhou.asr.chunking import stitch_chunks
+
+    tok = lambda w, s, e: {"word": w, "start": s, "end": e, "conf": 1.0}
+    chunks = [
+        [ tok("un", 0.5, 1.0), tok("daou", 8.2, 8.6), tok("tri", 9.1, 9.5), tok("pev", 9.8, 10.0) ],
+        [ tok("daou", 8.21, 8.6), tok("tri", 9.1, 9.52), tok("pevar", 9.8, 10.3), tok("pemp", 17.0, 17.5) ],
+        [ tok("pemp", 17.02, 17.5), tok("c'hwec'h", 18.5, 19.0) ],
+    ]
+    bounds = [ (0.0, 10.0), (8.0, 18.0), (16.0, 20.0) ]
+    assert [ t["word"] for t in stitch_chunks(chunks, bounds) ] == \
+        ["un", "daou", "tri", "pevar", "pemp", "c'hwec'h"]
+
+
+
+def test_transcribe_file_parallel():
+    import difflib
+    import shutil
+    from ostilhou.asr import load_model
+    from ostilhou.asr.recognizer import transcribe_file_timecoded, transcribe_file_timecoded_parallel
+
+    if not shutil.which("ffmpeg"):
+        pytest.skip("ffmpeg is not available")
+    try:
+        load_model()
+    except Exception:
+        pytest.skip("No Vosk model available")
+
+    audio_path = os.path.join(os.path.dirname(__file__), "sample_an_drouizig.mp3")
+    reference = [ t["word"] for t in transcribe_file_timecoded(audio_path, show_progress_bar=False) ]
+    for overlap in (None, 2.0):
+        tokens = transcribe_file_timecoded_parallel(
+            audio_path, workers=2, max_length=10.0, overlap=overlap, show_progress_bar=False
+        )
+        assert all( t1["start"] <= t2["start"] for t1, t2 in zip(tokens[:-1], tokens[1:]) )
+        words = [ t["word"] for t in tokens ]
+        assert difflib.SequenceMatcher(None, reference, words).ratio() > 0.9
+
+
+
+class PreloadedModel:
+    def __init__(self, tag):
+        self.tag = tag
+
+
+def _model_tag(x):
+    from ostilhou.asr import load_model
+    return x, load_model().tag, os.getpid()
+
+
+
+def test_worker_pool_fork(monkeypatch):
+    import multiprocessing
+    from ostilhou.asr import models, WorkerPool
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("fork start method is not available")
+
+    # Workers must get the model loaded in the parent
+    monkeypatch.setattr(models, "_loaded_model", PreloadedModel("preloaded"))
+    monkeypatch.setattr(models, "_loaded_model_name", "preloaded-model")
+    with WorkerPool(workers=3, start_method="fork") as pool:
+        assert pool.model_name == "preloaded-model"
+        results = pool.map(_model_tag, range(50))
+    assert [ r[0] for r in results ] == list(range(50))
+    assert all( r[1] == "preloaded" for r in results )
+    assert os.getpid() not in { r[2] for r in results }
+
+
+
+def test_decode_segments():
+    import io
+    from ostilhou.asr.recognizer import _decode_segments
+
+    data = bytes(range(256)) * 400
+    offset = 10000
+    ranges = [ (30000, 60000), (12000, 20000), (50000, 58000), (100000, 110000), (115000, 130000) ]
+    pool = RecognizerPool(factory=RecordingRecognizer)
+    model = Model()
+    results = _decode_segments(io.BytesIO(data), ranges, offset, pool, model, chunk_size=4000)
+
+    assert len(results) == len(ranges)
+    assert all( r[-1] == '{"text": "final"}' for r in results )
+    # Every segment is decoded from its own recognizer
+    assert pool.created == 2
+    for recognizer in pool._idle[(id(model), 16000, True)]:
+        assert recognizer.resets > 0
+    # The last segment goes beyond the end of the stream
+    assert len(data) + offset < ranges[-1][1]
+    assert len(results[-1]) == 1
+
+
+def test_decode_segments_routing():
+    import io
+    from ostilhou.asr.recognizer import _decode_segments
+
+    fed = []
+
+    class Recognizer(RecordingRecognizer):
+        def FinalResult(self):
+            fed.append(b''.join(self.chunks))
+            self.chunks = []
+            return json.dumps({"text": str(len(fed) - 1)})
+
+    data = bytes(range(256)) * 400
+    offset = 10000
+    ranges = [ (30000, 60000), (12000, 20000), (50000, 58000), (100000, 110000), (10000, 10000) ]
+    pool = RecognizerPool(factory=Recognizer)
+    results = _decode_segments(io.BytesIO(data), ranges, offset, pool, Model(), chunk_size=3000)
+    for (a, b), seg_results in zip(ranges, results):
+        audio = fed[int(json.loads(seg_results[-1])["text"])]
+        assert audio == data[a - offset:b - offset]
+
+
+
+def test_decode_segments_error():
+    import io
+    from ostilhou.asr.recognizer import _decode_segments
+
+    created = []
+
+    class Recognizer(RecordingRecognizer):
+        def __init__(self, *args):
+            super().__init__(*args)
+            created.append(self)
+
+        def AcceptWaveform(self, data):
+            # The second segment fails after the first one is finished
+            if self is created[1]:
+                raise RuntimeError("decoding error")
+            return super().AcceptWaveform(data)
+
+    data = bytes(range(256)) * 400
+    ranges = [ (0, 4000), (0, 40000) ]
+    pool = RecognizerPool(factory=Recognizer)
+    model = Model()
+    with pytest.raises(RuntimeError):
+        _decode_segments(io.BytesIO(data), ranges, 0, pool, model, chunk_size=4000)
+    # Every recognizer is released once
+    idle = pool._idle[(id(model), 16000, True)]
+    assert len(idle) == 2 and idle[0] is not idle[1]
+
+
+def test_recognize_stream_async():
+    import asyncio
+    from ostilhou.asr.recognizer import _recognize_stream_async
+
+    class Recognizer(RecordingRecognizer):
+        def PartialResult(self):
+            return json.dumps({"partial": str(len(self.chunks))})
+
+    data = bytes(range(256)) * 100
+
+    async def run(partial_results):
+        stream = asyncio.StreamReader()
+        recognizer = Recognizer()
+        results = []
+
+        async def feed():
+            # Data arrives in small irregular pieces
+            for i in range(0, len(data), 1500):
+                stream.feed_data(data[i:i+1500])
+                await asyncio.sleep(0)
+            stream.feed_eof()
+
+        feeder = asyncio.create_task(feed())
+        async for is_partial, result in _recognize_stream_async(
+            stream, recognizer, partial_results, chunk_size=4000, max_pending=2
+        ):
+            results.append((is_partial, json.loads(result)))
+        await feeder
+        return recognizer, results
+
+    recognizer, results = asyncio.run(run(False))
+    assert b''.join(recognizer.chunks) == data
+    assert all( len(c) == 4000 for c in recognizer.chunks[:-1] )
+    assert results == [ (False, {"text": str(i)}) for i in (3, 6) ] + [ (False, {"text": "final"}) ]
+
+    recognizer, results = asyncio.run(run(True))
+    assert [ r for p, r in results if p ] == [ {"partial": str(i)} for i in (1, 2, 4, 5, 7) ]
+
+
+
+def test_transcribe_stream_async_cancel(monkeypatch):
+    import asyncio
+    import threading
+    from ostilhou.asr import recognizer as recognizer_module
+
+    events = []
+    started = threading.Event()
+    unblock = threading.Event()
+
+    class Recognizer(RecordingRecognizer):
+        def AcceptWaveform(self, data):
+            events.append("decode")
+            started.set()
+            unblock.wait(5)
+            events.append("decoded")
+            return False
+
+        def Reset(self):
+            events.append("reset")
+
+    pool = RecognizerPool(factory=Recognizer)
+    monkeypatch.setattr(recognizer_module, "recognizer_pool", pool)
+
+    async def run():
+        stream = asyncio.StreamReader()
+        stream.feed_data(bytes(16000))
+
+        async def consume():
+            async for _ in recognizer_module.transcribe_stream_async(stream, Model(), chunk_size=4000):
+                pass
+
+        task = asyncio.create_task(consume())
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, started.wait, 5)
+        task.cancel()
+        await asyncio.sleep(0.1)
+        # The recognizer is still decoding, it must not be released yet
+        assert "reset" not in events
+        unblock.set()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert events == ["decode", "decoded", "reset"]
+
+
+def test_transcribe_file_async(tmp_path):
+    import asyncio
+    import shutil
+    import wave
+    from ostilhou.asr import load_model
+    from ostilhou.asr.recognizer import transcribe_file_async, transcribe_file_timecoded
+
+    if not shutil.which("ffmpeg"):
+        pytest.skip("ffmpeg is not available")
+    try:
+        load_model()
+    except Exception:
+        pytest.skip("No Vosk model available")
+
+    audio = AudioSegment.from_file(os.path.join(os.path.dirname(__file__), "sample_an_drouizig.mp3"))
+    audio = audio.set_frame_rate(16000).set_channels(1).set_sample_width(2)
+    paths = []
+    for i in range(4):
+        path = str(tmp_path / f"sample_{i}.wav")
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(16000)
+            f.writeframes(audio[i * 1000:].raw_data)
+        paths.append(path)
+
+    async def transcribe(path):
+        return [ tok async for r in transcribe_file_async(path) for tok in r["words"] ]
+
+    async def transcribe_all():
+        return await asyncio.gather(*[ transcribe(p) for p in paths ])
+
+    results = asyncio.run(transcribe_all())
+    for path, tokens in zip(paths, results):
+        assert tokens == transcribe_file_timecoded(path, show_progress_bar=False)
@@ -0,0 +1,150 @@
+import json
+import asyncio
+
+import pytest
+
+from ostilhou.asr import recognizer
+from ostilhou.asr.recognizer import RecognizerPool
+from ostilhou.asr.server import TranscriptionServer
+
+
+
+class Model:
+    pass
+
+
+class SentenceRecognizer:
+    """ Ends an utterance every 4 chunks, with a spelled number """
+
+    def __init__(self, model=None, sample_rate=16000):
+        self.sample_rate = sample_rate
+        self.n = 0
+
+    def SetWords(self, enable):
+        pass
+
+    def Reset(self):
+        self.n = 0
+
+    def AcceptWaveform(self, data):
+        self.n += 1
+        return self.n % 4 == 0
+
+    def _result(self):
+        words = ["c'hwec'h", "ha", "tregont", "den"]
+        return {
+            "text": ' '.join(words),
+            "result": [
+                { "word": w, "start": i, "end": i + 0.5, "conf": 1.0 }
+                for i, w in enumerate(words)
+            ]
+        }
+
+    def Result(self):
+        return json.dumps(self._result())
+
+    def PartialResult(self):
+        return json.dumps({ "partial": "euh " * (self.n % 4) })
+
+    def FinalResult(self):
+        return json.dumps({ "text": "" })
+
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(recognizer, "recognizer_pool", RecognizerPool(factory=SentenceRecognizer))
+    return TranscriptionServer(Model(), max_sessions=1, workers=2, max_pending=2, chunk_size=1000)
+
+
+
+async def tcp_session(port: int, config: str, data: bytes):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(config.encode() + b'\n')
+    for i in range(0, len(data), 700):
+        writer.write(data[i:i+700])
+        await writer.drain()
+    writer.write_eof()
+    messages = [ json.loads(line) async for line in reader ]
+    writer.close()
+    return messages
+
+
+
+def test_tcp(server):
+    async def run():
+        tcp = await server.start_tcp("127.0.0.1", 0)
+        port = tcp.sockets[0].getsockname()[1]
+        try:
+            default = await tcp_session(port, "", bytes(8000))
+            raw = await tcp_session(
+                port,
+                json.dumps({ "partial": False, "normalize": False, "words": False }),
+                bytes(8000)
+            )
+            error = await tcp_session(port, json.dumps({ "language": "br" }), b'')
+            throttled = await tcp_session(port, json.dumps({ "partial_interval": 0 }), bytes(8000))
+        finally:
+            await server.close()
+        return default, raw, error, throttled
+
+    default, raw, error, throttled = asyncio.run(run())
+
+    finals = [ m for m in default if "text" in m ]
+    assert len(finals) == 2
+    assert finals[0]["text"] == "36 den"
+    assert [ w["word"] for w in finals[0]["result"] ] == ["36", "den"]
+    assert any( "partial" in m for m in default )
+
+    assert raw == [ { "text": "c'hwec'h ha tregont den" } ] * 2
+    assert "error" in error[0]
+    partials = [ m for m in throttled if "partial" in m ]
+    assert partials and all( "stable" in m for m in partials )
+    assert [ m for m in throttled if "text" in m ] == finals
+
+
+
+def test_max_sessions(server):
+    async def run():
+        tcp = await server.start_tcp("127.0.0.1", 0)
+        port = tcp.sockets[0].getsockname()[1]
+        try:
+            # First client keeps its session open
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b'\n')
+            await writer.drain()
+            while server.sessions == 0:
+                await asyncio.sleep(0.01)
+            rejected = await tcp_session(port, "", b"")
+            writer.write_eof()
+            served = [ json.loads(line) async for line in reader ]
+            writer.close()
+        finally:
+            await server.close()
+        return rejected, served
+
+    rejected, served = asyncio.run(run())
+    assert "error" in rejected[0]
+    assert served == []
+
+
+
+def test_websocket(server):
+    websockets = pytest.importorskip("websockets")
+
+    async def run():
+        ws_server = await server.start_websocket("127.0.0.1", 0)
+        port = list(ws_server.sockets)[0].getsockname()[1]
+        try:
+            async with websockets.connect(f"ws://127.0.0.1:{port}") as ws:
+                await ws.send(json.dumps({ "config": { "partial": False } }))
+                for _ in range(8):
+                    await ws.send(bytes(1000))
+                await ws.send(json.dumps({ "eof": 1 }))
+                messages = [ json.loads(m) async for m in ws ]
+        finally:
+            await server.close()
+        return messages
+
+    messages = asyncio.run(run())
+    assert [ m["text"] for m in messages ] == ["36 den", "36 den"]
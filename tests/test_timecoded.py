@@ -0,0 +1,62 @@
+from ostilhou.text import TimecodedWords, inverse_normalize_timecoded
+from ostilhou.asr.post_processing import post_process_timecoded
+from ostilhou.asr.aligner import align
+
+
+def tokenize(s: str):
+    return [{"word":t, "start":2*i, "end":2*i+1, "conf":0.5} for i, t in enumerate(s.split())]
+
+
+
+def test_timecoded_words():
+    tokens = tokenize("demat d'an holl")
+    tw = TimecodedWords.from_vosk(tokens)
+
+    assert len(tw) == 3
+    assert tw.words == ["demat", "d'an", "holl"]
+    assert tw[1] == {"word": "d'an", "start": 2.0, "end": 3.0, "conf": 0.5}
+    assert tw.to_vosk() == tokens
+    assert list(tw) == tokens
+
+    # Slices are views on the same arrays
+    sub = tw[1:]
+    assert sub.words == ["d'an", "holl"]
+    assert sub.start.base is tw.start
+    assert sub + tw[:1] == [tokens[1], tokens[2], tokens[0]]
+
+    assert TimecodedWords.from_result('{"text": ""}') == []
+    assert TimecodedWords.from_result({"result": tokens}) == tw
+
+
+
+def test_columnar_post_processing():
+    sentences = [
+        "e penn ar bed ez eus un tour tan",
+        "naontek dregant ha tri ugent",
+        "An dra se hag an dra mañ",
+        "Euh mont a ra kwa",
+    ]
+    for sentence in sentences:
+        tokens = tokenize(sentence)
+        tw = TimecodedWords.from_vosk(tokens)
+
+        expected = post_process_timecoded(tokens, normalize=True, keep_fillers=False)
+        result = post_process_timecoded(tw, normalize=True, keep_fillers=False)
+        assert isinstance(result, TimecodedWords)
+        assert result.to_vosk() == expected
+
+        expected = inverse_normalize_timecoded(tokens)
+        result = inverse_normalize_timecoded(tw)
+        assert isinstance(result, TimecodedWords)
+        assert result.to_vosk() == expected
+
+
+
+def test_columnar_align():
+    sentences = ["Demat deoc'h.", "Kenavo !"]
+    hyp = tokenize("demat deoc'h kenavo")
+    matches = align(sentences, hyp, 0, len(hyp), progress_bar=False)
+    matches_columnar = align(sentences, TimecodedWords.from_vosk(hyp), 0, len(hyp), progress_bar=False)
+    for m, mc in zip(matches, matches_columnar):
+        assert m["span"] == mc["span"]
+        assert mc["hyp"] == m["hyp"]
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from ostilhou.asr import models
+from ostilhou.asr.lexicon_store import PronunciationStore
+from ostilhou.asr.transcription_cache import (
+    TranscriptionCache, enable_transcription_cache, disable_transcription_cache,
+    hash_file, make_key, model_identity,
+)
+
+
+
+def test_transcription_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = TranscriptionCache(path, max_size=10_000)
+    assert cache.get("a") is None
+    cache.put("a", ["demat", "deoc'h"])
+    cache.put("b", [{"word": "demat", "start": 0.1, "end": 0.5, "conf": 1.0}])
+    assert cache.get("a") == ["demat", "deoc'h"]
+    assert cache.get("b")[0]["start"] == 0.1
+    assert len(cache) == 2
+
+    # Shared by many instances
+    other = TranscriptionCache(path)
+    assert other.get("a") == ["demat", "deoc'h"]
+    other.close()
+
+    # Least recently used entries are evicted
+    for i in range(200):
+        cache.put(f"key_{i}", "x" * 100)
+        cache.get("a")
+    cache.evict()
+    assert cache.size() <= 10_000
+    assert cache.get("a") is not None
+    assert cache.get("key_0") is None
+    assert cache.get("key_199") is not None
+    cache.close()
+
+
+
+def test_cache_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    # Models, pronunciations and transcriptions share the same cache directory
+    cache = TranscriptionCache()
+    cache.close()
+    assert cache.path == str(tmp_path / "anaouder" / "transcriptions.sqlite")
+    with PronunciationStore(rules_hash="test", digests={}) as store:
+        assert store.path == str(tmp_path / "anaouder" / "lexicon.sqlite")
+    assert models._get_model_directory() == str(tmp_path / "anaouder" / "models")
+    assert os.path.isdir(tmp_path / "anaouder" / "models")
+
+
+
+def test_cache_keys(tmp_path):
+    audio = tmp_path / "audio.raw"
+    audio.write_bytes(b"\x00\x01" * 1000)
+    h = hash_file(str(audio))
+    assert hash_file(str(audio)) == h
+    audio.write_bytes(b"\x00\x02" * 1000)
+    os.utime(audio, ns=(0, 0))
+    assert hash_file(str(audio)) != h
+
+    model_dir = tmp_path / "model"
+    for path in ("am/final.mdl", "conf/mfcc.conf", "ivector/final.dubm", "ivector/final.ie", "ivector/final.mat",
+                 "ivector/global_cmvn.stats", "ivector/online_cmvn.conf", "ivector/splice.conf",
+                 "graph/phones/word_boundary.int"):
+        (model_dir / path).parent.mkdir(parents=True, exist_ok=True)
+        (model_dir / path).write_bytes(b"1234")
+    assert model_identity("vosk-br-0.8") == "vosk-br-0.8"
+    identity = model_identity(str(model_dir))
+    assert identity.startswith(str(model_dir))
+    assert model_identity(str(model_dir)) == identity
+    # Model rebuilt in place
+    (model_dir / "am" / "final.mdl").write_bytes(b"5678")
+    os.utime(model_dir / "am" / "final.mdl", ns=(0, 10**9))
+    assert model_identity(str(model_dir)) != identity
+
+    assert make_key("segment", h, "m", {"chunk_size": 4000}) != make_key("segment", h, "m", {"chunk_size": 8000})
+
+
+
+def test_cached_transcription(tmp_path, monkeypatch):
+    from ostilhou.asr.recognizer import _cached_transcription
+
+    monkeypatch.setattr(models, "_loaded_model_name", "model-a")
+    calls = []
+    def transcribe():
+        calls.append(1)
+        return ["demat"]
+
+    # Disabled by default
+    assert _cached_transcription("segment", lambda: pytest.fail("hashed"), {}, transcribe) == ["demat"]
+
+    enable_transcription_cache(str(tmp_path / "cache.sqlite"))
+    try:
+        for _ in range(3):
+            assert _cached_transcription("segment", lambda: "h1", {}, transcribe) == ["demat"]
+        assert len(calls) == 2
+        _cached_transcription("segment", lambda: "h2", {}, transcribe)
+        _cached_transcription("segment", lambda: "h1", {"chunk_size": 8000}, transcribe)
+        monkeypatch.setattr(models, "_loaded_model_name", "model-b")
+        _cached_transcription("segment", lambda: "h1", {}, transcribe)
+        assert len(calls) == 5
+    finally:
+        disable_transcription_cache()